@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+
+from treegen import TreeSpec, generate, specs
+
+from osync.config_cache import load_tree_config_cached
+from osync.filter_group import Direction, load_filter_groups
+from osync.filter_matcher import FilterMatcher, walk
+from osync.findup import findup
+from osync.path_resolver import PathResolver
+from osync.rsync import RsyncCommand
+from osync.seed import seed as seed_tree
+
+Timing = dict[str, float]
+
+
+def timeit(func: Callable[[], object], repeat: int) -> Timing:
+    samples: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _ = func()
+        samples.append(time.perf_counter() - start)
+    return {"min": min(samples), "median": statistics.median(samples)}
+
+
+def deepest_dir(root: str) -> str:
+    deepest = root
+    for dirpath, _, _ in os.walk(root):
+        if dirpath.count(os.sep) > deepest.count(os.sep):
+            deepest = dirpath
+    return deepest
+
+
+def bench_tree(
+    spec: TreeSpec, base_dir: str, repeat: int, seed: int
+) -> dict[str, Timing]:
+    results: dict[str, Timing] = {}
+    tree_dir = os.path.join(base_dir, spec.name)
+    os.makedirs(tree_dir)
+    root = generate(spec, tree_dir, seed)
+    config = os.path.join(tree_dir, "osync.yaml")
+    files = [os.path.join(d, f) for d, _, fs in os.walk(root) for f in fs]
+
+    os.chdir(deepest_dir(root))
+    results["findup"] = timeit(lambda: findup("osync.yaml"), repeat)
+    cache = os.path.join(base_dir, spec.name + "-config-cache")
+    os.makedirs(cache)
+    _ = load_tree_config_cached(directory=cache)
+    results["tree_config (cached)"] = timeit(
+        lambda: load_tree_config_cached(directory=cache), repeat
+    )
+    results["load_filter_groups"] = timeit(lambda: load_filter_groups(config), repeat)
+    filter_groups = load_filter_groups(config)
+
+    resolver = PathResolver(tree_dir, "user@host")
+    results["path_resolver"] = timeit(
+        lambda: [resolver.to_remote(f) for f in files], max(1, repeat // 5)
+    )
+    results["path_resolver_many"] = timeit(
+        lambda: list(resolver.to_remote_many(files)), max(1, repeat // 5)
+    )
+
+    def command(dest: str) -> RsyncCommand:
+        return RsyncCommand(
+            direction=Direction.PUSH,
+            source=root,
+            dest=dest,
+            filter_groups=filter_groups,
+        )
+
+    results["rsync_build"] = timeit(lambda: command("user@host:/.").build(), repeat)
+
+    matcher = FilterMatcher.from_args(command("user@host:/.").filter_args())
+    results["filter_walk"] = timeit(lambda: list(walk(root, matcher)), repeat)
+
+    if shutil.which("rsync") is not None:
+        dest = os.path.join(base_dir, f"{spec.name}-dest")
+
+        def transfer():
+            shutil.rmtree(dest, ignore_errors=True)
+            os.makedirs(dest)
+            rsync = command(dest + "/.")
+            rsync.build()
+            with open(os.devnull, "w") as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    return rsync.execute()
+                finally:
+                    sys.stdout = stdout
+
+        results["transfer"] = timeit(transfer, max(1, repeat // 5))
+
+    if shutil.which("tar") is not None:
+        dest = os.path.join(base_dir, f"{spec.name}-seed")
+        relpaths = [entry.relpath for entry in walk(root, matcher) if not entry.is_dir]
+
+        def tar_seed():
+            # the same filtered tree into an empty destination, as one tar
+            # stream through a local shell standing in for ssh
+            shutil.rmtree(dest, ignore_errors=True)
+            return seed_tree(
+                Direction.PUSH, ["sh", "-c"], os.path.dirname(root), dest, relpaths
+            )
+
+        results["seed"] = timeit(tar_seed, max(1, repeat // 5))
+    return results
+
+
+def compare(
+    current: dict[str, dict[str, Timing]], baseline_path: str, threshold: float
+):
+    with open(baseline_path) as f:
+        baseline: dict[str, dict[str, Timing]] = json.load(f)["results"]
+
+    regressions = 0
+    for tree, phases in current.items():
+        for phase, timing in phases.items():
+            before = baseline.get(tree, {}).get(phase)
+            if before is None:
+                continue
+            ratio = timing["median"] / max(before["median"], 1e-9)
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{tree:>6} {phase:<20} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Benchmark osync's sync path")
+    _ = parser.add_argument(
+        "--out", default="bench.json", help="Where to write results"
+    )
+    _ = parser.add_argument("--baseline", help="Earlier results to compare against")
+    _ = parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown of a phase's median that counts as a regression",
+    )
+    _ = parser.add_argument("--scale", type=float, default=1.0, help="Tree size factor")
+    _ = parser.add_argument("--repeat", type=int, default=10)
+    _ = parser.add_argument("--seed", type=int, default=0)
+    _ = parser.add_argument("--only", nargs="*", help="Only run these trees")
+    args = parser.parse_args(argv)
+
+    results: dict[str, dict[str, Timing]] = {}
+    cwd = os.getcwd()
+    base_dir = tempfile.mkdtemp(prefix="osync-bench-")
+    try:
+        for spec in specs(args.scale):
+            if args.only and spec.name not in args.only:
+                continue
+            results[spec.name] = bench_tree(spec, base_dir, args.repeat, args.seed)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(base_dir)
+
+    with open(args.out, "w") as f:
+        json.dump(
+            {
+                "meta": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "scale": args.scale,
+                    "repeat": args.repeat,
+                    "seed": args.seed,
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+    if args.baseline and compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
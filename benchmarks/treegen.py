@@ -0,0 +1,79 @@
+import os
+import random
+from dataclasses import dataclass
+
+OSYNC_YAML = """\
+- direction: push
+  kind: exclude
+  patterns: ["__pycache__/", "*.tmp", "build/"]
+- direction: push
+  kind: include
+  patterns: ["{root}/", "src/", "src/**/", "*.py", "*.txt", "docs/***", "data/***", "d*/"]
+- direction: pull
+  kind: include
+  patterns: ["{root}/", "results/***"]
+"""
+
+
+@dataclass(frozen=True)
+class TreeSpec:
+    name: str
+    files: int
+    depth: int
+    min_size: int
+    max_size: int
+    huge_files: int = 0
+    huge_size: int = 0
+
+
+def specs(scale: float = 1.0) -> list[TreeSpec]:
+    def n(count: int) -> int:
+        return max(1, int(count * scale))
+
+    return [
+        TreeSpec("tiny", files=n(5000), depth=2, min_size=0, max_size=1024),
+        TreeSpec("deep", files=n(500), depth=40, min_size=0, max_size=4096),
+        TreeSpec(
+            "huge",
+            files=n(10),
+            depth=1,
+            min_size=0,
+            max_size=1024,
+            huge_files=3,
+            huge_size=n(32 * 1024**2),
+        ),
+        TreeSpec("mixed", files=n(3000), depth=6, min_size=0, max_size=64 * 1024),
+    ]
+
+
+_NAMES = ["src", "docs", "data", "build", "__pycache__", "lib", "tests", "results"]
+_SUFFIXES = [".py", ".txt", ".tmp", ".bin", ".md"]
+
+
+def _write(path: str, size: int, rng: random.Random):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        _ = f.write(rng.randbytes(size))
+
+
+def generate(spec: TreeSpec, base_dir: str, seed: int = 0) -> str:
+    rng = random.Random(f"{seed}-{spec.name}")
+    root = os.path.join(base_dir, spec.name)
+
+    for i in range(spec.files):
+        parts = [rng.choice(_NAMES) for _ in range(rng.randint(0, spec.depth))]
+        if spec.name == "deep":
+            parts = [f"d{level}" for level in range(i % spec.depth)]
+        name = f"f{i}{rng.choice(_SUFFIXES)}"
+        _write(
+            os.path.join(root, *parts, name),
+            rng.randint(spec.min_size, spec.max_size),
+            rng,
+        )
+
+    for i in range(spec.huge_files):
+        _write(os.path.join(root, "data", f"huge{i}.bin"), spec.huge_size, rng)
+
+    with open(os.path.join(base_dir, "osync.yaml"), "w") as f:
+        _ = f.write(OSYNC_YAML.replace("{root}", spec.name))
+    return root
@@ -0,0 +1,210 @@
+import asyncio
+import os
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from .bandwidth import BandwidthPolicy
+from .batch import build_commands, coalesce, resolve_targets
+from .enums import Direction
+from .path_resolver import PathResolver
+from .progress import Event, FileEvent, Listener, OutputParser, StatsEvent
+from .rsync import RsyncCommand, RsyncResult
+from .ssh import SshMaster
+
+if TYPE_CHECKING:
+    from .config_cache import FilterGroupLike
+
+# how long a cancelled rsync gets to exit on SIGTERM before it is killed
+TERMINATE_GRACE = 5.0
+
+_prepared: set[str] = set()
+
+
+@dataclass(frozen=True)
+class SyncResult:
+    returncode: int
+    stats: dict[str, int | float] = field(default_factory=lambda: {})
+    files: list[FileEvent] = field(default_factory=lambda: [])
+    commands: list[list[str]] = field(default_factory=lambda: [])
+    stderr: str = ""
+    duration: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+    def summary(self) -> str:
+        return RsyncResult(self.returncode, self.stats).summary()
+
+
+async def _feed(stdin: asyncio.StreamWriter, data: bytes):
+    # rsync may exit before it read everything
+    try:
+        stdin.write(data)
+        await stdin.drain()
+        stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+async def _stop(proc: asyncio.subprocess.Process):
+    if proc.returncode is not None:
+        return
+    try:
+        proc.terminate()
+        try:
+            _ = await asyncio.wait_for(proc.wait(), TERMINATE_GRACE)
+        except TimeoutError:
+            proc.kill()
+            _ = await proc.wait()
+    except ProcessLookupError:
+        pass
+
+
+async def run(command: RsyncCommand) -> tuple[RsyncResult, str]:
+    if not command.args:
+        command.build()
+    data = command.stdin()
+    proc = await asyncio.create_subprocess_exec(
+        *command.args,
+        stdin=asyncio.subprocess.PIPE
+        if data is not None
+        else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    assert proc.stdout is not None and proc.stderr is not None
+    try:
+        async with asyncio.TaskGroup() as tasks:
+            if proc.stdin is not None and data is not None:
+                _ = tasks.create_task(_feed(proc.stdin, data))
+            stderr = tasks.create_task(proc.stderr.read())
+
+            parser = OutputParser()
+            stats: dict[str, int | float] = {}
+            while chunk := await proc.stdout.read(64 * 1024):
+                for event in parser.feed(chunk):
+                    _emit(command.listeners, event, stats)
+            for event in parser.close():
+                _emit(command.listeners, event, stats)
+        returncode = await proc.wait()
+    except BaseException:
+        # cancelled or timed out: rsync must not outlive the task that ran it
+        await asyncio.shield(_stop(proc))
+        raise
+    return RsyncResult(returncode, stats), stderr.result().decode(errors="replace")
+
+
+def _emit(listeners: list[Listener], event: Event, stats: dict[str, int | float]):
+    if isinstance(event, StatsEvent):
+        stats[event.key] = event.value
+    for listener in listeners:
+        listener(event)
+
+
+async def _prepare(master: SshMaster):
+    # checking the master means running ssh, once per host is plenty; a master
+    # that went away since (or a failed run, see sync) asks again
+    if master.host in _prepared and os.path.exists(master.socket):
+        return
+    await asyncio.to_thread(master.prepare)
+    _prepared.add(master.host)
+
+
+def _forget(master: SshMaster | None):
+    # whatever broke may have been the master, so the next run checks it again
+    if master is not None:
+        _prepared.discard(master.host)
+
+
+async def sync(
+    *paths: str,
+    direction: Direction | str = Direction.PUSH,
+    filters: "list[FilterGroupLike] | None" = None,
+    resolver: PathResolver | None = None,
+    force: bool = False,
+    dry_run: bool = False,
+    jobs: int = 1,
+    extra_args: Iterable[str] = (),
+    listeners: Iterable[Listener] = (),
+    timeout: float | None = None,
+    ssh: bool = True,
+) -> SyncResult:
+    # filters=None reads the osync.yaml files like the command line does; pass a list
+    # (maybe empty) to sync without looking for one
+    started = time.monotonic()
+    direction = Direction(direction)
+    resolver = resolver or PathResolver()
+    bandwidth: BandwidthPolicy | None = None
+    if filters is None:
+        from .config_cache import load_tree_config_cached
+
+        _, config, _ = await asyncio.to_thread(load_tree_config_cached)
+        filters = list(config.filter_groups)
+        bandwidth = config.bandwidth
+
+    transport: list[str] = []
+    master: SshMaster | None = None
+    if ssh:
+        master = SshMaster(resolver.remote_user_host)
+        await _prepare(master)
+        transport = master.transport_args()
+
+    files: list[FileEvent] = []
+    listeners = list(listeners)
+
+    def collect(event: Event):
+        if isinstance(event, FileEvent):
+            files.append(event)
+
+    def plan() -> list[RsyncCommand]:
+        # resolving paths and sharding stat the tree, which would stall the loop
+        commands = build_commands(
+            coalesce(resolve_targets(list(paths), resolver)),
+            direction,
+            filters,
+            force=force,
+            dry_run=dry_run,
+            jobs=jobs,
+            extra_args=[*transport, *extra_args],
+            bandwidth=bandwidth,
+        )
+        # the budget's --bwlimit applies, but sharing it through a throttle
+        # would need a thread per transfer
+        workers: list[RsyncCommand] = []
+        for command in commands:
+            command.listeners = [collect, *listeners]
+            command.build()
+            workers += command.shards()
+        return workers
+
+    workers = await asyncio.to_thread(plan)
+
+    limit = asyncio.Semaphore(max(1, jobs))
+
+    async def limited(worker: RsyncCommand) -> tuple[RsyncResult, str]:
+        async with limit:
+            return await run(worker)
+
+    try:
+        async with asyncio.timeout(timeout):
+            async with asyncio.TaskGroup() as tasks:
+                running = [tasks.create_task(limited(worker)) for worker in workers]
+    except BaseException:
+        _forget(master)
+        raise
+
+    results = [task.result() for task in running]
+    combined = RsyncResult.combine([result for result, _ in results])
+    if combined.returncode != 0:
+        _forget(master)
+    return SyncResult(
+        combined.returncode,
+        combined.stats,
+        files,
+        [worker.args for worker in workers],
+        "".join(stderr for _, stderr in results),
+        time.monotonic() - started,
+    )
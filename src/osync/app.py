@@ -0,0 +1,490 @@
+import os
+import stat
+import sys
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import replace
+from typing import TYPE_CHECKING
+
+from . import cli
+from .batch import (
+    SyncTarget,
+    build_commands,
+    coalesce,
+    expand_paths,
+    resolve_targets,
+    run_batches,
+)
+from .config_cache import load_tree_config_cached
+from .daemon import forward, forwardable
+from .enums import Direction
+from .filter_compiler import compile_filters
+from .filter_matcher import FilterMatcher, walk
+from .journal import PARTIAL_ARGS, Journal, journal_key, journal_path, load_journal
+from .manifest import (
+    ManifestCache,
+    ManifestRefresher,
+    fetch_manifest,
+    format_status,
+    plan_status,
+)
+from .metrics import Metrics, add_hook, emit, phase
+from .path_resolver import PathResolver
+from .progress import ConsoleReporter, JsonReport, Listener
+from .rsync import RsyncCommand, RsyncResult, user_filter_args
+from .seed import seed, seed_needed
+from .ssh import SshMaster, connections
+from .timings import Timings
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from .large_files import LargeFile, LargeFileLane
+    from .moves import ContentIndex
+
+
+def main(started: float | None = None):
+    cli_started = time.perf_counter()
+    args = cli.main()
+    cli_seconds = time.perf_counter() - cli_started
+
+    timings = Timings(started)
+    collected = Metrics()
+    if args.timings:
+        add_hook(timings.record)
+    if args.metrics:
+        add_hook(collected)
+    if started is not None:
+        emit("imports", cli_started - started)
+    emit("cli", cli_seconds)
+
+    printed = False
+
+    def print_timings():
+        nonlocal printed
+        if args.timings and not printed:
+            print(timings.report(), file=sys.stderr)
+        printed = True
+
+    stats: dict[str, int | float] = {}
+    returncode = 1
+    try:
+        _run(args, print_timings, stats)
+    except SystemExit as e:
+        returncode = e.code if isinstance(e.code, int) else int(e.code is not None)
+        raise
+    finally:
+        # every way out reports, not just the ones that got as far as rsync
+        print_timings()
+        if args.metrics:
+            direction = Direction.PUSH if args.push else Direction.PULL
+            collected.write(
+                args.metrics, args.metrics_format, direction.value, returncode, stats
+            )
+
+
+def _run(
+    args: cli.Args,
+    startup_done: Callable[[], None],
+    final_stats: dict[str, int | float],
+):
+    # ends in sys.exit; final_stats gets what the run transferred for --metrics
+    if args.connections is not None:
+        connections(args.connections)
+        sys.exit(0)
+
+    if forwardable(args):
+        returncode = forward(sys.argv[1:])
+        if returncode is not None:
+            sys.exit(returncode)
+
+    config_paths, config, _ = load_tree_config_cached()
+    # the nearest one; the sync index is kept per config file
+    pattern_config = config_paths[0]
+    filter_groups = config.filter_groups
+
+    direction = Direction.PUSH if args.push else Direction.PULL
+
+    if args.explain_filters:
+        print(compile_filters(user_filter_args(filter_groups, direction)).explain())
+        sys.exit(0)
+
+    with phase("resolve_paths"):
+        path_resolver = PathResolver(
+            remote_user_host=args.remotes[0] if args.remotes else None
+        )
+        paths = expand_paths(args.paths)
+        groups = coalesce(resolve_targets(paths, path_resolver))
+
+    ssh_master = SshMaster(path_resolver.remote_user_host, persist=args.ssh_persist)
+    ssh_master.prepare()
+    manifests = ManifestCache(ttl=args.manifest_ttl)
+
+    if args.status:
+
+        def matcher_for(direction: Direction) -> FilterMatcher:
+            if args.force:
+                return FilterMatcher([])
+            return FilterMatcher.from_args(
+                compile_filters(user_filter_args(filter_groups, direction)).args
+            )
+
+        push_matcher = matcher_for(Direction.PUSH)
+        pull_matcher = matcher_for(Direction.PULL)
+        for target in (target for group in groups for target in group):
+            manifest = manifests.get(
+                target.remote,
+                lambda root: fetch_manifest(root, ssh_master.transport_args()),
+                refresh=args.refresh,
+            )
+            changes = plan_status(target.local, manifest, push_matcher, pull_matcher)
+            print(format_status(changes, manifest.age()))
+        sys.exit(0)
+
+    tuned = None
+    if args.auto_tune:
+        from .tune import LinkCache, choose, probe, sample_mix
+
+        def sizes() -> Iterator[tuple[str, int]]:
+            # a sample of what is being sent is enough to tell its mix
+            matcher = (
+                FilterMatcher([])
+                if args.force
+                else FilterMatcher.from_args(
+                    compile_filters(user_filter_args(filter_groups, direction)).args
+                )
+            )
+            for target in (target for group in groups for target in group):
+                if args.push:
+                    for entry in walk(target.local, matcher):
+                        if not entry.is_dir:
+                            yield entry.relpath, os.lstat(entry.path).st_size
+                else:
+                    manifest = manifests.get(
+                        target.remote,
+                        lambda root: fetch_manifest(root, ssh_master.transport_args()),
+                    )
+                    entries = manifest.filtered(matcher)
+                    yield from ((path, e.size) for path, e in entries if not e.is_dir)
+
+        with phase("tune"):
+            link = LinkCache().get(
+                ssh_master.host,
+                lambda: probe([*ssh_master.command(), ssh_master.host]),
+            )
+            tuned = choose(link, sample_mix(sizes()))
+        print(
+            f"Tuned for {link.throughput / 1024**2:.1f} MiB/s at "
+            + f"{link.rtt * 1000:.0f} ms: {tuned.describe()}"
+        )
+
+    commands = build_commands(
+        groups,
+        direction,
+        filter_groups,
+        force=args.force,
+        dry_run=args.dry_run,
+        jobs=args.jobs,
+        extra_args=ssh_master.transport_args(),
+        bandwidth=config.bandwidth,
+        tuned=tuned,
+    )
+    fanning_out = len(args.remotes) > 1
+    if args.local_filter or fanning_out:
+        for command in commands:
+            matcher = FilterMatcher.from_args(command.filter_args())
+            command.files_from = [
+                entry.relpath
+                for source in [command.source, *command.extra_sources]
+                for entry in walk(source, matcher)
+            ]
+
+    listeners: list[Listener] = [
+        ConsoleReporter(live=sys.stderr if sys.stderr.isatty() else None)
+    ]
+    report = None
+    if args.report:
+        report = JsonReport(args.report, sys.argv)
+        listeners.append(report)
+
+    def finish(returncode: int, stats: dict[str, int | float]):
+        if report is not None:
+            report.close(returncode, stats)
+        final_stats.update(stats)
+
+    if fanning_out:
+        from .fanout import fan_out, format_fan_out, retarget
+
+        # the file list above was made once; every remote gets the same one
+        per_remote: dict[str, list[RsyncCommand]] = {}
+        for remote in args.remotes:
+            master = SshMaster(remote, persist=args.ssh_persist)
+            master.prepare()
+            per_remote[remote] = [
+                replace(
+                    retarget(command, remote, master.transport_args()),
+                    listeners=[report] if report is not None else [],
+                )
+                for command in commands
+            ]
+        results = fan_out(per_remote, args.remote_jobs)
+        print(format_fan_out(results))
+        combined = RsyncResult.combine([r.result for r in results])
+        finish(combined.returncode, combined.stats)
+        sys.exit(combined.returncode)
+
+    refreshers: list[ManifestRefresher] = []
+    for command, group in zip(commands, groups):
+        command.listeners = listeners
+        cached = [manifests.load(target.remote) for target in group]
+        if args.dry_run or args.watch or not any(cached):
+            continue
+        # keep the cached remote manifests current from what rsync reports
+        refresher = ManifestRefresher(
+            manifests,
+            [manifest for manifest in cached if manifest is not None],
+            os.path.dirname(group[0].local),
+        )
+        command.listeners = listeners + [refresher]
+        refreshers.append(refresher)
+
+    def listed(command: RsyncCommand, group: list[SyncTarget]) -> list[str]:
+        # every file the transfer covers, listed on the sending side
+        matcher = FilterMatcher.from_args(command.filter_args())
+        relpaths: list[str] = []
+        for target in group:
+            if args.push:
+                entries = walk(target.local, matcher)
+                relpaths += [e.relpath for e in entries if not e.is_dir]
+            else:
+                manifest = fetch_manifest(target.remote, ssh_master.transport_args())
+                entries = manifest.filtered(matcher)
+                relpaths += [path for path, e in entries if not e.is_dir]
+        return relpaths
+
+    # verify and resume drop commands, each has to keep its own group
+    pairs = list(zip(commands, groups))
+
+    if args.verify:
+        from .verify import HashCache, compare, local_hashes, remote_hashes
+
+        cache = HashCache()
+        checked = 0
+        for command, group in pairs:
+            relpaths = listed(command, group)
+            verification = compare(
+                relpaths,
+                local_hashes(os.path.dirname(group[0].local), relpaths, cache),
+                remote_hashes(
+                    [*ssh_master.command(), ssh_master.host],
+                    os.path.dirname(group[0].remote.split(":", 1)[1]),
+                    relpaths,
+                ),
+            )
+            for path in verification.differ:
+                print(f"differs  {path}")
+            checked += verification.checked
+            # size and mtime may well match, only the content does not
+            command.files_from = verification.differ
+            command.extra_args = [*command.extra_args, "--ignore-times"]
+        cache.close()
+
+        pairs = [(command, group) for command, group in pairs if command.files_from]
+        commands = [command for command, _ in pairs]
+        print(
+            f"Verified {checked} files, {sum(len(c.files_from or []) for c in commands)} differ"
+        )
+        if not commands:
+            finish(0, {})
+            sys.exit(0)
+
+    if args.resume:
+        resumed: list[tuple[RsyncCommand, list[SyncTarget]]] = []
+        for command, group in pairs:
+            state = load_journal(journal_path(journal_key(command)))
+            if state is None:
+                continue
+            # what arrived before the interruption is not sent again, rsync
+            # only gets to see the rest
+            command.files_from = [
+                path for path in listed(command, group) if path not in state.done
+            ]
+            print(
+                f"Resuming {journal_key(command)}: {len(state.done)} files done,"
+                + f" {len(command.files_from)} left"
+            )
+            resumed.append((command, group))
+        pairs = resumed
+        commands = [command for command, _ in pairs]
+        if not commands:
+            finish(0, {})
+            print("Nothing to resume")
+            sys.exit(0)
+
+    indexed: list[tuple["ContentIndex", dict[str, str]]] = []
+    if args.detect_moves:
+        from .moves import ContentIndex, apply_moves, detect_moves
+        from .sync_index import index_path
+        from .verify import HashCache, local_hashes
+
+        cache = HashCache()
+        for command, group in pairs:
+            hashes = local_hashes(
+                os.path.dirname(group[0].local), listed(command, group), cache
+            )
+            index = ContentIndex(index_path(pattern_config), journal_key(command))
+            moves = detect_moves(index.load(), hashes)
+            for move in moves:
+                print(f"moved  {move.source} -> {move.dest}")
+            if moves and not args.dry_run:
+                # rsync then finds them in place and only sends real changes
+                apply_moves(
+                    [*ssh_master.command(), ssh_master.host],
+                    os.path.dirname(group[0].remote.split(":", 1)[1]),
+                    moves,
+                )
+            indexed.append((index, hashes))
+        cache.close()
+
+    seedable = not (args.dry_run or args.resume or args.verify or args.incremental)
+    for command, group in pairs:
+        empty = args.pull and all(seed_needed(target.local) for target in group)
+        if not seedable or not (args.seed or empty):
+            continue
+        # one compressed tar stream lays down the tree, the rsync pass below
+        # then only picks up what changed while it ran
+        relpaths = listed(command, group)
+        with phase("seed"):
+            returncode = seed(
+                direction,
+                [*ssh_master.command(), ssh_master.host],
+                os.path.dirname(group[0].local),
+                os.path.dirname(group[0].remote.split(":", 1)[1]),
+                relpaths,
+            )
+        print(f"Seeded {len(relpaths)} files through tar (exit code {returncode})")
+
+    lanes: list[tuple["LargeFileLane", list["LargeFile"]]] = []
+    if args.large_files is not None and not args.dry_run:
+        from .large_files import SSH_ARGS, LargeFile, LargeFileLane, lane_excludes
+
+        threshold = args.large_files
+        for command, group in pairs:
+            matcher = FilterMatcher.from_args(command.filter_args())
+            found: list[LargeFile] = []
+            for target in group:
+                if args.push:
+                    for entry in walk(target.local, matcher):
+                        st = os.stat(entry.path) if not entry.is_dir else None
+                        if st is not None and st.st_size >= threshold:
+                            found.append(
+                                LargeFile(
+                                    entry.relpath,
+                                    st.st_size,
+                                    int(st.st_mtime),
+                                    stat.S_IMODE(st.st_mode),
+                                )
+                            )
+                else:
+                    manifest = fetch_manifest(
+                        target.remote, ssh_master.transport_args()
+                    )
+                    found += [
+                        LargeFile(path, e.size, e.mtime)
+                        for path, e in manifest.filtered(matcher)
+                        if not e.is_dir and e.size >= threshold
+                    ]
+            if not found:
+                continue
+            # rsync leaves these to the lane and moves the small files meanwhile
+            if command.files_from is not None:
+                skip = {file.relpath for file in found}
+                command.files_from = [p for p in command.files_from if p not in skip]
+            else:
+                command.extra_args = [*command.extra_args, *lane_excludes(found)]
+            lane = LargeFileLane(
+                direction,
+                [ssh_master.ssh, *SSH_ARGS, ssh_master.host],
+                os.path.dirname(group[0].local),
+                os.path.dirname(group[0].remote.split(":", 1)[1]),
+                args.streams,
+            )
+            lanes.append((lane, found))
+
+    journals: list[Journal] = []
+    if not (args.dry_run or args.watch):
+        for command in commands:
+            journal = Journal(journal_key(command))
+            command.listeners = [*command.listeners, journal]
+            command.extra_args = [*command.extra_args, *PARTIAL_ARGS]
+            journals.append(journal)
+
+    def close_journals(returncode: int):
+        for journal in journals:
+            journal.finish(returncode)
+        for index, hashes in indexed:
+            if returncode == 0 and not args.dry_run:
+                index.replace(hashes)
+            index.close()
+
+    lane_runs: list["Future[int]"] = []
+    if lanes:
+        from concurrent.futures import ThreadPoolExecutor  # pulls in logging
+
+        lane_pool = ThreadPoolExecutor(max_workers=len(lanes))
+        lane_runs = [lane_pool.submit(lane.run, files) for lane, files in lanes]
+
+    def join_lanes(returncode: int) -> int:
+        codes = [run.result() for run in lane_runs]
+        return returncode or next((code for code in codes if code != 0), 0)
+
+    if len(commands) > 1:
+        for command in commands:
+            command.build()
+        startup_done()
+        result = run_batches(commands, args.jobs)
+        result = RsyncResult(join_lanes(result.returncode), result.stats)
+        close_journals(result.returncode)
+        for refresher in refreshers:
+            refresher.apply(result.returncode)
+        finish(result.returncode, result.stats)
+        print(result.summary())
+        sys.exit(result.returncode)
+
+    command = commands[0]
+    source = command.source
+    if args.watch:
+        from .watch import watch
+
+        watch(command, args.debounce)
+        sys.exit(0)
+
+    incremental = None
+    if args.incremental:
+        from .sync_index import SyncIndex, index_path
+
+        index = SyncIndex(index_path(pattern_config), f"{source} -> {command.dest}")
+        diff = index.diff(walk(source, FilterMatcher.from_args(command.filter_args())))
+        if not diff.changed:
+            if not args.dry_run:
+                index.commit(diff)
+            close_journals(0)
+            finish(0, {})
+            print("Nothing changed since the last push")
+            sys.exit(0)
+        command.files_from = diff.paths
+        incremental = (index, diff)
+    command.build()
+    startup_done()
+    result = command.execute()
+    result = RsyncResult(join_lanes(result.returncode), result.stats)
+    close_journals(result.returncode)
+    for refresher in refreshers:
+        refresher.apply(result.returncode)
+    if incremental is not None and result.returncode == 0 and not args.dry_run:
+        index, diff = incremental
+        index.commit(diff)
+    finish(result.returncode, result.stats)
+    if result.stats:
+        print(result.summary())
+    sys.exit(result.returncode)
@@ -0,0 +1,300 @@
+import itertools
+import json
+import os
+import re
+import signal
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from types import FrameType
+from typing import TYPE_CHECKING
+
+from .dirs import runtime_dir, write_json_atomically
+from .enums import Direction
+
+if TYPE_CHECKING:
+    from .config_cache import FilterGroupLike
+
+DEFAULT_PRIORITY = 1
+DEFAULT_PERIOD = 0.5
+
+# same units as rsync's --bwlimit: KiB/s unless a suffix says otherwise
+_RATE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*$", re.IGNORECASE)
+_UNITS = {"": 1, "k": 1, "m": 1024, "g": 1024**2}
+
+
+def parse_rate(value: str | int) -> int:
+    if isinstance(value, int):
+        return value
+    match = _RATE.match(value)
+    if match is None:
+        raise ValueError(f"Not a bandwidth: {value!r} (expected e.g. 500K or 10M)")
+    return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+
+@dataclass(frozen=True)
+class BandwidthPolicy:
+    budget: int
+    priorities: dict[Direction, int] = field(default_factory=lambda: {})
+
+    def priority(
+        self, direction: Direction, filter_groups: "list[FilterGroupLike]"
+    ) -> int:
+        # a filter group's own class wins over its direction's
+        explicit = [
+            group.priority
+            for group in filter_groups
+            if Direction(group.direction) == Direction(direction)
+            and group.priority is not None
+        ]
+        if explicit:
+            return max(explicit)
+        return self.priorities.get(Direction(direction), DEFAULT_PRIORITY)
+
+    @classmethod
+    def from_json(cls, raw: dict[str, object]) -> "BandwidthPolicy":
+        priorities: dict[str, int] = raw["priorities"]  # pyright:ignore[reportAssignmentType]
+        return cls(
+            int(raw["budget"]),  # pyright:ignore[reportArgumentType]
+            {Direction(k): int(v) for k, v in priorities.items()},
+        )
+
+    def to_json(self) -> dict[str, object]:
+        return {
+            "budget": self.budget,
+            "priorities": {k.value: v for k, v in self.priorities.items()},
+        }
+
+
+@dataclass(frozen=True)
+class Lease:
+    path: str
+    budget: int
+    priority: float
+
+
+_counter = itertools.count()
+
+
+class BandwidthLedger:
+    # every running transfer on this host keeps a small file here; each one
+    # reads the others to work out its share of the budget
+    def __init__(self, directory: str | None = None):
+        self.directory: str = directory or runtime_dir("bandwidth")
+
+    def acquire(self, budget: int, priority: float) -> Lease:
+        name = f"{os.getpid()}-{threading.get_ident()}-{next(_counter)}.json"
+        lease = Lease(os.path.join(self.directory, name), budget, priority)
+        with open(lease.path, "w") as f:
+            json.dump(
+                {
+                    "pid": os.getpid(),
+                    "started": _start_time(os.getpid()),
+                    "budget": budget,
+                    "priority": priority,
+                },
+                f,
+            )
+        return lease
+
+    def mark_stopped(self, lease: Lease, pids: list[int]):
+        # whoever finds this lease orphaned resumes these, should we die
+        # without getting to it ourselves
+        write_json_atomically(
+            lease.path,
+            {
+                "pid": os.getpid(),
+                "started": _start_time(os.getpid()),
+                "budget": lease.budget,
+                "priority": lease.priority,
+                "stopped": pids,
+            },
+        )
+
+    def release(self, lease: Lease):
+        try:
+            os.unlink(lease.path)
+        except FileNotFoundError:
+            pass
+
+    def leases(self) -> list[Lease]:
+        leases: list[Lease] = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    raw = json.load(f)  # pyright:ignore[reportAny]
+                if not _alive(int(raw["pid"]), raw.get("started")):  # pyright:ignore[reportAny]
+                    _end_stopped(raw.get("stopped", []))  # pyright:ignore[reportAny]
+                    os.unlink(path)
+                    continue
+                leases.append(Lease(path, int(raw["budget"]), float(raw["priority"])))  # pyright:ignore[reportAny]
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+        return leases
+
+    def share(self, lease: Lease) -> float:
+        live = self.leases()
+        if lease.path not in {other.path for other in live}:
+            live.append(lease)
+        # the strictest budget any participant was configured with applies
+        budget = min(other.budget for other in live)
+        return budget * lease.priority / sum(other.priority for other in live)
+
+
+def _descendants(pid: int) -> list[int]:
+    # rsync forks a receiver and starts ssh; pausing only the parent would
+    # leave the data flowing
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+    return children + [d for child in children for d in _descendants(child)]
+
+
+def _end_stopped(pids: list[int]):
+    # a transfer killed while it had its rsync paused left it stopped for good,
+    # holding its locks and remote session; only still-stopped ones are ours
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                state = f.read().rpartition(")")[2].split()[0]
+        except (OSError, IndexError):
+            continue
+        if state in ("T", "t"):
+            for sig in (signal.SIGCONT, signal.SIGTERM):
+                try:
+                    os.kill(pid, sig)
+                except ProcessLookupError:
+                    pass
+
+
+def _start_time(pid: int) -> int | None:
+    # in clock ticks since boot; with the pid it names one process for good
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return int(f.read().rpartition(")")[2].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _alive(pid: int, started: int | None = None) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # a pid taken over by some other process leaves the lease just as dead
+    return started is None or _start_time(pid) in (started, None)
+
+
+@dataclass(frozen=True)
+class Bandwidth:
+    budget: int
+    priority: float = DEFAULT_PRIORITY
+    directory: str | None = None
+
+    @property
+    def rsync_args(self) -> list[str]:
+        return [f"--bwlimit={self.budget}"]
+
+    def split(self, parts: int) -> "Bandwidth":
+        return Bandwidth(self.budget, self.priority / max(1, parts), self.directory)
+
+
+_active: set["Throttle"] = set()
+_guarded = False
+
+
+def guard_signals():
+    # SIGTERM or SIGHUP during a pause would otherwise leave rsync and ssh
+    # stopped; handlers only go in from the main thread
+    global _guarded
+    if _guarded or threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGTERM, signal.SIGHUP):
+        previous = signal.getsignal(sig)
+        if previous == signal.SIG_IGN:
+            continue
+
+        def handler(signum: int, frame: FrameType | None, previous: object = previous):
+            for throttle in list(_active):
+                throttle.abort()
+            if callable(previous):
+                _ = previous(signum, frame)
+                return
+            # die of the signal, as we would have without the handler
+            _ = signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+        _ = signal.signal(sig, handler)
+    _guarded = True
+
+
+class Throttle:
+    # rsync can't change --bwlimit once it runs, so it is started at the full
+    # budget and paused for part of every period to bring it down to its share
+    def __init__(
+        self,
+        bandwidth: Bandwidth,
+        period: float = DEFAULT_PERIOD,
+    ):
+        self.ledger: BandwidthLedger = BandwidthLedger(bandwidth.directory)
+        self.lease: Lease = self.ledger.acquire(bandwidth.budget, bandwidth.priority)
+        self.period: float = period
+        self._proc: subprocess.Popen[bytes] | None = None
+        self._done: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+        guard_signals()
+
+    def duty(self) -> float:
+        return min(1.0, self.ledger.share(self.lease) / self.lease.budget)
+
+    def start(self, proc: "subprocess.Popen[bytes]"):
+        self._proc = proc
+        _active.add(self)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _signal(self, sig: signal.Signals) -> list[int]:
+        if self._proc is None:
+            return []
+        pids = [self._proc.pid, *_descendants(self._proc.pid)]
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+        return pids
+
+    def _run(self):
+        while not self._done.is_set():
+            duty = self.duty()
+            if duty >= 1.0:
+                _ = self._done.wait(self.period)
+                continue
+            _ = self._done.wait(self.period * duty)
+            if self._done.is_set():
+                break
+            self.ledger.mark_stopped(self.lease, self._signal(signal.SIGSTOP))
+            _ = self._done.wait(self.period * (1.0 - duty))
+            _ = self._signal(signal.SIGCONT)
+            self.ledger.mark_stopped(self.lease, [])
+
+    def abort(self):
+        # resumed first, or the tree could never act on the SIGTERM
+        self._done.set()
+        _ = self._signal(signal.SIGCONT)
+        _ = self._signal(signal.SIGTERM)
+
+    def stop(self):
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+        _ = self._signal(signal.SIGCONT)
+        _active.discard(self)
+        self.ledger.release(self.lease)
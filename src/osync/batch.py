@@ -0,0 +1,119 @@
+import os
+import sys
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, TextIO
+
+from .bandwidth import Bandwidth, BandwidthPolicy, guard_signals
+from .enums import Direction
+from .metrics import phase
+from .path_resolver import PathResolver
+from .rsync import RsyncCommand, RsyncResult
+from .tune import Profile
+
+if TYPE_CHECKING:
+    from .config_cache import FilterGroupLike
+
+
+@dataclass(frozen=True)
+class SyncTarget:
+    local: str
+    remote: str
+
+
+def expand_paths(paths: Iterable[str], stdin: TextIO = sys.stdin) -> list[str]:
+    expanded: list[str] = []
+    for path in paths:
+        if path == "-":
+            expanded += [line.strip() for line in stdin if line.strip()]
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def resolve_targets(paths: list[str], resolver: PathResolver) -> list[SyncTarget]:
+    # one phase each for the whole list, as the generators would otherwise
+    # interleave and nothing could be timed
+    with phase("to_local"):
+        local = list(resolver.to_local_many(paths))
+    with phase("to_remote"):
+        remote = list(resolver.to_remote_many(paths))
+    return [SyncTarget(*pair) for pair in zip(local, remote)]
+
+
+def coalesce(targets: list[SyncTarget]) -> list[list[SyncTarget]]:
+    kept: list[SyncTarget] = []
+    unique = {t.local: t for t in targets}.values()
+    for target in sorted(unique, key=lambda t: t.local.split("/")):
+        # component-wise order puts an ancestor right before everything nested in it
+        if kept and target.local.startswith(os.path.join(kept[-1].local, "")):
+            continue
+        kept.append(target)
+
+    groups: dict[str, list[SyncTarget]] = {}
+    for target in kept:
+        groups.setdefault(os.path.dirname(target.local), []).append(target)
+    return list(groups.values())
+
+
+def parent_dest(path: str) -> str:
+    return "/".join(path.split("/")[:-1]) + "/."
+
+
+def build_commands(
+    groups: list[list[SyncTarget]],
+    direction: Direction,
+    filter_groups: "list[FilterGroupLike]",
+    force: bool = False,
+    dry_run: bool = False,
+    jobs: int = 1,
+    extra_args: list[str] | None = None,
+    bandwidth: BandwidthPolicy | None = None,
+    tuned: Profile | None = None,
+) -> list[RsyncCommand]:
+    share = None
+    if bandwidth is not None:
+        # the throttles pause rsync from worker threads; their cleanup on
+        # SIGTERM has to be set up from this one
+        guard_signals()
+        share = Bandwidth(
+            bandwidth.budget, bandwidth.priority(direction, filter_groups)
+        )
+    commands: list[RsyncCommand] = []
+    for group in groups:
+        if direction == Direction.PUSH:
+            sources = [target.local for target in group]
+            dest = parent_dest(group[0].remote)
+        else:
+            sources = [target.remote for target in group]
+            dest = parent_dest(group[0].local)
+        commands.append(
+            RsyncCommand(
+                direction=direction,
+                source=sources[0],
+                dest=dest,
+                filter_groups=filter_groups,
+                force=force,
+                dry_run=dry_run,
+                jobs=jobs if len(groups) == 1 else 1,
+                extra_args=list(extra_args or []),
+                extra_sources=sources[1:],
+                bandwidth=share,
+                tuned=tuned,
+            )
+        )
+    return commands
+
+
+def run_batches(
+    commands: list[RsyncCommand], jobs: int, out: TextIO = sys.stdout
+) -> RsyncResult:
+    from concurrent.futures import ThreadPoolExecutor  # pulls in logging
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(RsyncCommand.run, commands))
+
+    for command, result in zip(commands, results):
+        sources = " ".join([command.source, *command.extra_sources])
+        print(f"{sources} -> {command.dest}: {result.summary()}", file=out)
+    return RsyncResult.combine(results)
@@ -7,7 +7,38 @@ class Args(argparse.Namespace):
     pull: bool = False
     force: bool = False
     dry_run: bool = False
-    path: str = "."
+    jobs: int = 1
+    local_filter: bool = False
+    incremental: bool = False
+    watch: bool = False
+    debounce: float = 0.2
+    connections: str | None = None
+    status: bool = False
+    refresh: bool = False
+    manifest_ttl: float = 300
+    ssh_persist: int = 600
+    report: str | None = None
+    timings: bool = False
+    verify: bool = False
+    resume: bool = False
+    detect_moves: bool = False
+    seed: bool = False
+    large_files: int | None = None
+    streams: int = 4
+    auto_tune: bool = False
+    remotes: list[str]
+    remote_jobs: int = 1
+    metrics: str | None = None
+    metrics_format: str = "json"
+    explain_filters: bool = False
+    no_daemon: bool = False
+    paths: list[str]
+
+    def __init__(self, **kwargs: object):
+        # a fresh list per parse, not one shared through the class
+        self.remotes = []
+        self.paths = []
+        super().__init__(**kwargs)
 
 
 def main(argv: list[str] | None = None):
@@ -17,6 +48,18 @@ def main(argv: list[str] | None = None):
     group = parser.add_mutually_exclusive_group(required=True)
     _ = group.add_argument("--push", action="store_true")
     _ = group.add_argument("--pull", action="store_true")
+    _ = group.add_argument(
+        "--connections",
+        nargs="?",
+        const="list",
+        choices=["list", "close"],
+        help="List (default) or close the live multiplexed SSH master connections",
+    )
+    _ = group.add_argument(
+        "--status",
+        action="store_true",
+        help="Show what a push or pull would change, using a cached remote manifest",
+    )
     _ = parser.add_argument(
         "--force",
         action="store_true",
@@ -28,9 +71,237 @@ def main(argv: list[str] | None = None):
         help="Perform a dry run (don't actually sync)",
     )
     _ = parser.add_argument(
-        "path",
-        help="The remote/local path to sync (will smartly obtain the counterpart path)",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Run up to N rsync workers: shards of one local source (so not for a "
+        + "single --pull), or groups of paths",
+    )
+    _ = parser.add_argument(
+        "--remote",
+        action="append",
+        default=[],
+        dest="remotes",
+        metavar="USER@HOST",
+        help="Sync with this remote instead of $OSYNC_REMOTE_USER_HOST; "
+        + "given more than once, push to all of them at the same time",
+    )
+    _ = parser.add_argument(
+        "--remote-jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Run up to N rsyncs at a time per remote when pushing to several",
+    )
+    _ = parser.add_argument(
+        "--local-filter",
+        action="store_true",
+        help="Match the filters in-process and hand rsync the resulting file list (push only)",
+    )
+    _ = parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only send files changed since the last successful push (push only)",
+    )
+    _ = parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and push changed files as they are written (push only)",
+    )
+    _ = parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.2,
+        metavar="SECONDS",
+        help="Quiet period that groups a burst of changes into one push (with --watch)",
+    )
+    _ = parser.add_argument(
+        "--ssh-persist",
+        type=int,
+        default=600,
+        metavar="SECONDS",
+        help="How long an idle SSH master connection is kept open for later runs",
+    )
+    _ = parser.add_argument(
+        "--report",
+        metavar="FILE",
+        help="Write a JSON report with per-file actions, totals and durations",
+    )
+    _ = parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print how long each startup phase took before rsync starts",
+    )
+    _ = parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Hash both ends, compare them and re-sync only the files whose content differs",
+    )
+    _ = parser.add_argument(
+        "--detect-moves",
+        action="store_true",
+        help="Find files renamed or moved since the last push by their content "
+        + "and move them on the remote instead of sending them again",
+    )
+    _ = parser.add_argument(
+        "--seed",
+        action="store_true",
+        help="Send the whole filtered tree as one compressed tar stream first "
+        + "(automatic when pulling into an empty or missing directory)",
+    )
+    _ = parser.add_argument(
+        "--large-files",
+        metavar="SIZE",
+        help="Send files of at least SIZE (e.g. 1G) in parallel byte ranges "
+        + "next to the regular rsync",
+    )
+    _ = parser.add_argument(
+        "--streams",
+        type=int,
+        default=4,
+        metavar="N",
+        help="How many concurrent SSH streams carry the ranges of one large file",
+    )
+    _ = parser.add_argument(
+        "--auto-tune",
+        action="store_true",
+        help="Pick compression, delta transfer and block size from a probe of "
+        + "the link (cached per host) and the mix of files being sent",
+    )
+    _ = parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the last interrupted transfer of the paths with only the files it did not finish",
+    )
+    _ = parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write per-phase timings, byte counts and the exit code of this sync",
+    )
+    _ = parser.add_argument(
+        "--metrics-format",
+        choices=["json", "prometheus"],
+        default="json",
+        help="Format of the --metrics file (prometheus: node_exporter textfile)",
+    )
+    _ = parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Fetch a fresh remote manifest instead of using the cached one (with --status)",
+    )
+    _ = parser.add_argument(
+        "--manifest-ttl",
+        type=float,
+        default=300,
+        metavar="SECONDS",
+        help="How long a cached remote manifest stays valid",
+    )
+    _ = parser.add_argument(
+        "--explain-filters",
+        action="store_true",
+        help="Print the optimized filter rules for the direction and exit",
+    )
+    _ = parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Run the transfer in this process even when osyncd is listening",
+    )
+    _ = parser.add_argument(
+        "paths",
+        nargs="*",
+        metavar="path",
+        help="The remote/local paths to sync (will smartly obtain the counterpart paths), "
+        + "'-' reads them from stdin",
     )
     args = parser.parse_args(argv, namespace=Args())
 
+    if args.connections is None and not args.explain_filters and not args.paths:
+        parser.error("the following arguments are required: path")
+    single = len(args.paths) == 1 and args.paths != ["-"]
+    if args.incremental and not single:
+        parser.error("--incremental only works with a single path")
+    if args.watch and not single:
+        parser.error("--watch only works with a single path")
+
+    if args.jobs > 1 and args.pull and single:
+        # a remote source cannot be weighed and split up
+        parser.error("--jobs only shards a local source, --pull needs several paths")
+
+    if args.refresh and not args.status:
+        parser.error("--refresh only works with --status")
+    if args.explain_filters and not (args.push or args.pull):
+        parser.error("--explain-filters needs --push or --pull")
+
+    if args.verify and not (args.push or args.pull):
+        parser.error("--verify needs --push or --pull")
+    if args.verify and (args.watch or args.incremental or args.local_filter):
+        parser.error(
+            "--verify does not combine with --watch, --incremental or --local-filter"
+        )
+
+    if args.resume and not (args.push or args.pull):
+        parser.error("--resume needs --push or --pull")
+    if args.resume and (
+        args.watch or args.incremental or args.local_filter or args.verify
+    ):
+        parser.error(
+            "--resume does not combine with --watch, --incremental, --local-filter or --verify"
+        )
+
+    if args.detect_moves and not args.push:
+        parser.error("--detect-moves only works with --push")
+    if args.detect_moves and (args.watch or len(args.remotes) > 1):
+        parser.error("--detect-moves does not combine with --watch or several --remote")
+
+    if args.seed and not (args.push or args.pull):
+        parser.error("--seed needs --push or --pull")
+    if args.seed and (
+        args.dry_run or args.watch or args.incremental or args.verify or args.resume
+    ):
+        parser.error(
+            "--seed does not combine with --dry-run, --watch, --incremental, --verify or --resume"
+        )
+
+    if args.large_files is not None:
+        from .large_files import parse_size
+
+        try:
+            args.large_files = parse_size(args.large_files)
+        except ValueError as e:
+            parser.error(str(e))
+        if not (args.push or args.pull):
+            parser.error("--large-files needs --push or --pull")
+        if args.watch or args.incremental or args.verify or args.resume:
+            parser.error(
+                "--large-files does not combine with --watch, --incremental, "
+                + "--verify or --resume"
+            )
+
+    if args.auto_tune and not (args.push or args.pull):
+        parser.error("--auto-tune needs --push or --pull")
+
+    if len(args.remotes) > 1 and not args.push:
+        parser.error("several --remote only work with --push")
+    if len(args.remotes) > 1 and (
+        args.watch
+        or args.incremental
+        or args.verify
+        or args.resume
+        or args.seed
+        or args.large_files
+        or args.auto_tune
+    ):
+        parser.error(
+            "several --remote do not combine with --watch, --incremental, --verify, "
+            + "--resume, --seed, --large-files or --auto-tune"
+        )
+
+    if args.local_filter and not args.push:
+        parser.error("--local-filter only works with --push")
+    if args.incremental and not args.push:
+        parser.error("--incremental only works with --push")
+    if args.watch and not args.push:
+        parser.error("--watch only works with --push")
+
     return args
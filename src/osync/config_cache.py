@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Protocol
+
+from .bandwidth import BandwidthPolicy
+from .dirs import cache_dir, write_json_atomically
+from .enums import Direction, Kind
+from .findup import findall
+from .metrics import emit
+
+CACHE_VERSION = 4
+CONFIG_NAME = "osync.yaml"
+
+
+class FilterGroupLike(Protocol):
+    @property
+    def direction(self) -> Direction: ...
+
+    @property
+    def kind(self) -> Kind: ...
+
+    @property
+    def patterns(self) -> list[str]: ...
+
+    @property
+    def priority(self) -> int | None: ...
+
+    @property
+    def compress(self) -> bool | None: ...
+
+    @property
+    def whole_file(self) -> bool | None: ...
+
+    @property
+    def block_size(self) -> int | None: ...
+
+    @property
+    def rsync_args(self) -> list[str]: ...
+
+
+@dataclass(frozen=True)
+class CompiledFilterGroup:
+    direction: Direction
+    kind: Kind
+    patterns: list[str]
+    priority: int | None = None
+    compress: bool | None = None
+    whole_file: bool | None = None
+    block_size: int | None = None
+
+    @property
+    def rsync_args(self) -> list[str]:
+        return [f"--{self.kind.value}={pat}" for pat in self.patterns]
+
+    @classmethod
+    def from_group(cls, group: FilterGroupLike) -> "CompiledFilterGroup":
+        return cls(
+            Direction(group.direction),
+            Kind(group.kind),
+            list(group.patterns),
+            group.priority,
+            group.compress,
+            group.whole_file,
+            group.block_size,
+        )
+
+    @classmethod
+    def from_json(
+        cls, raw: dict[str, str | list[str] | int | bool | None]
+    ) -> "CompiledFilterGroup":
+        return cls(
+            Direction(raw["direction"]),
+            Kind(raw["kind"]),
+            list(raw["patterns"]),  # pyright:ignore[reportArgumentType]
+            raw.get("priority"),  # pyright:ignore[reportArgumentType]
+            raw.get("compress"),  # pyright:ignore[reportArgumentType]
+            raw.get("whole_file"),  # pyright:ignore[reportArgumentType]
+            raw.get("block_size"),  # pyright:ignore[reportArgumentType]
+        )
+
+    def to_json(self) -> dict[str, str | list[str] | int | bool | None]:
+        return {
+            "direction": self.direction.value,
+            "kind": self.kind.value,
+            "patterns": self.patterns,
+            "priority": self.priority,
+            "compress": self.compress,
+            "whole_file": self.whole_file,
+            "block_size": self.block_size,
+        }
+
+
+@dataclass(frozen=True)
+class CompiledConfig:
+    filter_groups: list[CompiledFilterGroup]
+    bandwidth: BandwidthPolicy | None = None
+    root: bool = False
+
+    def to_json(self) -> dict[str, object]:
+        return {
+            "groups": [g.to_json() for g in self.filter_groups],
+            "bandwidth": None if self.bandwidth is None else self.bandwidth.to_json(),
+            "root": self.root,
+        }
+
+    @classmethod
+    def from_json(cls, raw: dict[str, object]) -> "CompiledConfig":
+        groups: list[dict[str, str | list[str] | int | bool | None]] = raw["groups"]  # pyright:ignore[reportAssignmentType]
+        bandwidth: dict[str, object] | None = raw["bandwidth"]  # pyright:ignore[reportAssignmentType]
+        return cls(
+            [CompiledFilterGroup.from_json(g) for g in groups],
+            None if bandwidth is None else BandwidthPolicy.from_json(bandwidth),
+            bool(raw.get("root", False)),
+        )
+
+
+def merge_configs(configs: list[CompiledConfig]) -> CompiledConfig:
+    # nearest first: its filter groups come first, so its rules match first,
+    # and its bandwidth section replaces any from further up
+    groups: list[CompiledFilterGroup] = []
+    bandwidth = None
+    for config in configs:
+        groups += config.filter_groups
+        bandwidth = bandwidth or config.bandwidth
+        if config.root:
+            break
+    return CompiledConfig(groups, bandwidth)
+
+
+def _cache_key(path: str) -> dict[str, str | int]:
+    st = os.stat(path)
+    return {
+        "version": CACHE_VERSION,
+        "path": path,
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+    }
+
+
+def load_config_cached(
+    path: str, directory: str | None = None
+) -> tuple[CompiledConfig, bool]:
+    start = time.perf_counter()
+    config, hit = _load_config_cached(path, directory)
+    emit(
+        "load_filter_groups" + (" (cached)" if hit else ""),
+        time.perf_counter() - start,
+    )
+    return config, hit
+
+
+def _load_config_cached(
+    path: str, directory: str | None
+) -> tuple[CompiledConfig, bool]:
+    path = os.path.abspath(path)
+    directory = directory or cache_dir("config")
+    cache_file = os.path.join(
+        directory, hashlib.sha1(path.encode()).hexdigest() + ".json"
+    )
+    key = _cache_key(path)
+
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)  # pyright:ignore[reportAny]
+        if cached["key"] == key:
+            return CompiledConfig.from_json(cached["config"]), True  # pyright:ignore[reportAny]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    # cache miss: only now pay for importing yaml and pydantic
+    from .filter_group import load_config
+
+    loaded = load_config(path)
+    bandwidth = None
+    if loaded.bandwidth is not None:
+        bandwidth = BandwidthPolicy(loaded.bandwidth.budget, loaded.bandwidth.priority)
+    config = CompiledConfig(
+        [CompiledFilterGroup.from_group(g) for g in loaded.filter_groups],
+        bandwidth,
+        loaded.root,
+    )
+    write_json_atomically(cache_file, {"key": key, "config": config.to_json()})
+    return config, False
+
+
+def _ancestors(cwd: str) -> list[str]:
+    dirs = [cwd]
+    while dirs[-1] != os.path.dirname(dirs[-1]):
+        dirs.append(os.path.dirname(dirs[-1]))
+    return dirs
+
+
+def _tree_key(cwd: str, dirs: dict[str, int], found: list[str]) -> dict[str, object]:
+    return {
+        "version": CACHE_VERSION,
+        "cwd": cwd,
+        "dirs": dirs,
+        "configs": [_cache_key(path) for path in found],
+    }
+
+
+def _dir_mtimes(dirs: list[str]) -> dict[str, int]:
+    # an osync.yaml appearing or disappearing changes its directory's mtime;
+    # one being edited is caught by its own key
+    return {d: os.stat(d).st_mtime_ns for d in dirs}
+
+
+def tree_stamp(cwd: str, paths: list[str]) -> dict[str, object]:
+    # changes when an osync.yaml up from cwd appears, goes or is edited
+    cwd = os.path.abspath(cwd)
+    return _tree_key(cwd, _dir_mtimes(_ancestors(cwd)), paths)
+
+
+def load_tree_config_cached(
+    cwd: str | None = None, directory: str | None = None
+) -> tuple[list[str], CompiledConfig, bool]:
+    start = time.perf_counter()
+    paths, config, hit = _load_tree_config_cached(cwd, directory)
+    emit(
+        "load_filter_groups" + (" (cached)" if hit else ""),
+        time.perf_counter() - start,
+    )
+    return paths, config, hit
+
+
+def _load_tree_config_cached(
+    cwd: str | None, directory: str | None
+) -> tuple[list[str], CompiledConfig, bool]:
+    cwd = os.path.abspath(cwd or os.getcwd())
+    directory = directory or cache_dir("config")
+    cache_file = os.path.join(
+        directory, hashlib.sha1(("tree " + cwd).encode()).hexdigest() + ".json"
+    )
+
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)  # pyright:ignore[reportAny]
+        found: list[str] = cached["found"]  # pyright:ignore[reportAny]
+        # the directories come from the entry, so a hit does no path walking
+        dirs = _dir_mtimes(list(cached["key"]["dirs"]))  # pyright:ignore[reportAny]
+        if cached["key"] == _tree_key(cwd, dirs, found):
+            config = CompiledConfig.from_json(cached["config"])  # pyright:ignore[reportAny]
+            return cached["paths"], config, True  # pyright:ignore[reportAny]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    # taken before looking, so a config showing up meanwhile is not missed
+    dirs = _dir_mtimes(_ancestors(cwd))
+    found = findall(CONFIG_NAME, cwd)
+    if not found:
+        raise LookupError("file not found: %s" % CONFIG_NAME)
+    key = _tree_key(cwd, dirs, found)
+    configs: list[CompiledConfig] = []
+    for path in found:
+        config, _ = _load_config_cached(path, directory)
+        configs.append(config)
+        if config.root:
+            break
+    paths = found[: len(configs)]
+    config = merge_configs(configs)
+    write_json_atomically(
+        cache_file,
+        {"key": key, "found": found, "paths": paths, "config": config.to_json()},
+    )
+    return paths, config, False
+
+
+def load_filter_groups_cached(
+    path: str, directory: str | None = None
+) -> tuple[list[CompiledFilterGroup], bool]:
+    config, hit = load_config_cached(path, directory)
+    return config.filter_groups, hit
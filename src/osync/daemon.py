@@ -0,0 +1,416 @@
+import argparse
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import TextIO, override
+
+from . import cli
+from .bandwidth import BandwidthPolicy, guard_signals
+from .batch import (
+    SyncTarget,
+    build_commands,
+    coalesce,
+    expand_paths,
+    resolve_targets,
+    run_batches,
+)
+from .config_cache import (
+    CompiledConfig,
+    CompiledFilterGroup,
+    load_tree_config_cached,
+    tree_stamp,
+)
+from .dirs import runtime_dir
+from .enums import Direction
+from .journal import PARTIAL_ARGS, Journal, journal_key
+from .manifest import ManifestCache, ManifestRefresher
+from .path_resolver import PathResolver
+from .progress import ConsoleReporter
+from .ssh import SshMaster
+
+DEFAULT_MAX_JOBS = 2
+DEFAULT_SETTLE = 0.1
+ENV_VARS = ("OSYNC_PROXY_ROOT", "OSYNC_REMOTE_USER_HOST")
+
+
+def socket_path() -> str:
+    return os.path.join(runtime_dir(), "osyncd.sock")
+
+
+def forwardable(args: cli.Args) -> bool:
+    # the daemon only runs plain transfers; anything that reports back
+    # locally or keeps running stays in the calling process
+    return (args.push or args.pull) and not (
+        args.no_daemon
+        or args.watch
+        or args.incremental
+        or args.local_filter
+        or args.report
+        or args.timings
+        or args.metrics
+        or args.verify
+        or args.resume
+        or args.remotes
+        or args.detect_moves
+        or args.seed
+        or args.large_files
+        or args.auto_tune
+        or args.explain_filters
+    )
+
+
+def forward(
+    argv: list[str],
+    path: str | None = None,
+    stdin: TextIO = sys.stdin,
+    out: TextIO = sys.stdout,
+) -> int | None:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path or socket_path())
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+
+    request = {
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": {name: os.environ[name] for name in ENV_VARS if name in os.environ},
+        "stdin": stdin.read() if "-" in argv else None,
+    }
+    with sock, sock.makefile("rw") as f:
+        _ = f.write(json.dumps(request) + "\n")
+        f.flush()
+        for line in f:
+            reply = json.loads(line)  # pyright:ignore[reportAny]
+            if "out" in reply:
+                _ = out.write(reply["out"])  # pyright:ignore[reportAny]
+                out.flush()
+            if "error" in reply:
+                print(f"osyncd: {reply['error']}", file=sys.stderr)
+            if "returncode" in reply:
+                return int(reply["returncode"])  # pyright:ignore[reportAny]
+    print("osyncd: connection closed before the transfer finished", file=sys.stderr)
+    return 1
+
+
+class Subscriber:
+    def __init__(self, f: TextIO):
+        self._f: TextIO = f
+        self._lock: threading.Lock = threading.Lock()
+        self.done: threading.Event = threading.Event()
+
+    def send(self, reply: dict[str, object]):
+        # a client that went away must not take the transfer down with it
+        with self._lock:
+            try:
+                _ = self._f.write(json.dumps(reply) + "\n")
+                self._f.flush()
+            except (OSError, ValueError):
+                pass
+        if "returncode" in reply:
+            self.done.set()
+
+
+class Fanout(io.TextIOBase):
+    def __init__(self, subscribers: list[Subscriber]):
+        self.subscribers: list[Subscriber] = subscribers
+
+    @override
+    def write(self, s: str) -> int:
+        for subscriber in self.subscribers:
+            subscriber.send({"out": s})
+        return len(s)
+
+
+@dataclass(frozen=True)
+class JobKey:
+    direction: Direction
+    force: bool
+    dry_run: bool
+    config: str
+    remote_user_host: str
+
+
+def _overlap(a: str, b: str) -> bool:
+    return (
+        a == b or a.startswith(os.path.join(b, "")) or b.startswith(os.path.join(a, ""))
+    )
+
+
+@dataclass
+class Job:
+    key: JobKey
+    targets: list[SyncTarget]
+    filter_groups: list[CompiledFilterGroup]
+    jobs: int = 1
+    subscribers: list[Subscriber] = field(default_factory=lambda: [])
+    submitted: float = field(default_factory=time.monotonic)
+    bandwidth: BandwidthPolicy | None = None
+
+    def overlaps(self, other: "Job") -> bool:
+        return any(
+            _overlap(a.local, b.local) or _overlap(a.remote, b.remote)
+            for a in self.targets
+            for b in other.targets
+        )
+
+    def absorb(self, other: "Job"):
+        self.targets += other.targets
+        self.subscribers += other.subscribers
+        self.jobs = max(self.jobs, other.jobs)
+        self.submitted = max(self.submitted, other.submitted)
+
+
+def execute_job(job: Job, out: TextIO) -> int:
+    ssh_master = SshMaster(job.key.remote_user_host)
+    ssh_master.prepare()
+    groups = coalesce(job.targets)
+    commands = build_commands(
+        groups,
+        job.key.direction,
+        job.filter_groups,
+        force=job.key.force,
+        dry_run=job.key.dry_run,
+        jobs=job.jobs,
+        extra_args=ssh_master.transport_args(),
+        bandwidth=job.bandwidth,
+    )
+    reporter = ConsoleReporter(out=out)
+    manifests = ManifestCache()
+    journals: list[Journal] = []
+    refreshers: list[ManifestRefresher] = []
+    for command, group in zip(commands, groups):
+        # the client sees the command line, not the daemon's own stdout
+        command.out = out
+        command.listeners = [reporter]
+        if not job.key.dry_run:
+            # as in a run of its own: --resume can pick up where this one was
+            # interrupted, and --status stays current
+            journal = Journal(journal_key(command))
+            command.listeners.append(journal)
+            command.extra_args = [*command.extra_args, *PARTIAL_ARGS]
+            journals.append(journal)
+            cached = [manifests.load(target.remote) for target in group]
+            if any(cached):
+                refresher = ManifestRefresher(
+                    manifests,
+                    [manifest for manifest in cached if manifest is not None],
+                    os.path.dirname(group[0].local),
+                )
+                command.listeners.append(refresher)
+                refreshers.append(refresher)
+        command.build()
+    if len(commands) == 1:
+        result = commands[0].execute()
+    else:
+        result = run_batches(commands, job.jobs, out)
+    for journal in journals:
+        journal.finish(result.returncode)
+    for refresher in refreshers:
+        refresher.apply(result.returncode)
+    print(result.summary(), file=out)
+    return result.returncode
+
+
+class Daemon:
+    def __init__(
+        self,
+        path: str | None = None,
+        max_jobs: int = DEFAULT_MAX_JOBS,
+        settle: float = DEFAULT_SETTLE,
+        run_job: Callable[[Job, TextIO], int] = execute_job,
+    ):
+        self.path: str = path or socket_path()
+        self.max_jobs: int = max(1, max_jobs)
+        self.settle: float = settle
+        self.run_job: Callable[[Job, TextIO], int] = run_job
+        self.pending: list[Job] = []
+        self.running: list[Job] = []
+        self._cond: threading.Condition = threading.Condition()
+        self._resolvers: dict[tuple[str, str], PathResolver] = {}
+        self._configs: dict[
+            str, tuple[dict[str, object], list[str], CompiledConfig]
+        ] = {}
+
+    def config(self, cwd: str) -> tuple[str, CompiledConfig]:
+        # kept in memory per directory; only the mtimes up from cwd are
+        # checked, and any change goes back through the persistent cache
+        resident = self._configs.get(cwd)
+        if resident is not None:
+            stamp, paths, config = resident
+            try:
+                if tree_stamp(cwd, paths) == stamp:
+                    return paths[0], config
+            except OSError:
+                pass
+        paths, config, _ = load_tree_config_cached(cwd)
+        self._configs[cwd] = (tree_stamp(cwd, paths), paths, config)
+        return paths[0], config
+
+    def resolver(self, env: dict[str, str]) -> PathResolver:
+        for name in ENV_VARS:
+            if not env.get(name):
+                raise ValueError(f"Undefined or empty environment variable '{name}'")
+        key = (env["OSYNC_PROXY_ROOT"], env["OSYNC_REMOTE_USER_HOST"])
+        if key not in self._resolvers:
+            self._resolvers[key] = PathResolver(*key)
+        return self._resolvers[key]
+
+    def job(self, request: dict[str, object], subscriber: Subscriber) -> Job:
+        args = cli.main(list(request["argv"]))  # pyright:ignore[reportArgumentType,reportCallIssue]
+        cwd = str(request["cwd"])
+        env: dict[str, str] = request["env"]  # pyright:ignore[reportAssignmentType]
+        stdin = io.StringIO(str(request.get("stdin") or ""))
+
+        resolver = self.resolver(env)
+        config, compiled = self.config(cwd)
+        paths = [os.path.join(cwd, path) for path in expand_paths(args.paths, stdin)]
+        key = JobKey(
+            Direction.PUSH if args.push else Direction.PULL,
+            args.force,
+            args.dry_run,
+            config,
+            resolver.remote_user_host,
+        )
+        return Job(
+            key,
+            resolve_targets(paths, resolver),
+            compiled.filter_groups,
+            args.jobs,
+            [subscriber],
+            bandwidth=compiled.bandwidth,
+        )
+
+    def submit(self, job: Job):
+        with self._cond:
+            merged = [p for p in self.pending if p.key == job.key and p.overlaps(job)]
+            if merged:
+                # one transfer serves every queued request it covers
+                for other in merged[1:]:
+                    merged[0].absorb(other)
+                    self.pending.remove(other)
+                merged[0].absorb(job)
+            else:
+                self.pending.append(job)
+            self._cond.notify_all()
+
+    def _next(self, now: float) -> Job | None:
+        # an earlier request, queued or running, keeps any later one that
+        # touches the same paths waiting, so transfers never race each other
+        blocking = list(self.running)
+        for job in self.pending:
+            ready = now - job.submitted >= self.settle
+            if ready and not any(job.overlaps(other) for other in blocking):
+                return job
+            blocking.append(job)
+        return None
+
+    def dispatch(self, stop: threading.Event):
+        while not stop.is_set():
+            with self._cond:
+                job = None
+                if len(self.running) < self.max_jobs:
+                    job = self._next(time.monotonic())
+                if job is None:
+                    _ = self._cond.wait(self.settle or None)
+                    continue
+                self.pending.remove(job)
+                self.running.append(job)
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job: Job):
+        try:
+            returncode = self.run_job(job, Fanout(job.subscribers))
+        except Exception as e:
+            for subscriber in job.subscribers:
+                subscriber.send({"error": str(e)})
+            returncode = 1
+        for subscriber in job.subscribers:
+            subscriber.send({"returncode": returncode})
+        with self._cond:
+            self.running.remove(job)
+            self._cond.notify_all()
+
+    def _handle(self, conn: socket.socket):
+        with conn, conn.makefile("rw") as f:
+            subscriber = Subscriber(f)
+            try:
+                request = json.loads(f.readline())  # pyright:ignore[reportAny]
+                job = self.job(request, subscriber)  # pyright:ignore[reportAny]
+            except SystemExit:
+                subscriber.send({"error": "invalid arguments", "returncode": 2})
+                return
+            except (ValueError, KeyError, TypeError, LookupError) as e:
+                subscriber.send({"error": str(e), "returncode": 2})
+                return
+            self.submit(job)
+            _ = subscriber.done.wait()
+
+    def bind(self) -> socket.socket:
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise RuntimeError(f"osyncd is already listening on {self.path}")
+            except ConnectionRefusedError:
+                os.unlink(self.path)
+            finally:
+                probe.close()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen()
+        return server
+
+    def serve_forever(self, stop: threading.Event | None = None):
+        stop = stop or threading.Event()
+        server = self.bind()
+        threading.Thread(target=self.dispatch, args=(stop,), daemon=True).start()
+        try:
+            server.settimeout(0.5)
+            while not stop.is_set():
+                try:
+                    conn, _ = server.accept()
+                except TimeoutError:
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            stop.set()
+            server.close()
+            os.unlink(self.path)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Queue osync pushes and pulls from every shell on this machine"
+    )
+    _ = parser.add_argument("--socket", metavar="PATH", help="Unix socket to listen on")
+    _ = parser.add_argument(
+        "--max-jobs",
+        type=int,
+        default=DEFAULT_MAX_JOBS,
+        metavar="N",
+        help="Run up to N transfers at a time",
+    )
+    _ = parser.add_argument(
+        "--settle",
+        type=float,
+        default=DEFAULT_SETTLE,
+        metavar="SECONDS",
+        help="How long a request waits for overlapping ones to merge with",
+    )
+    args = parser.parse_args(argv)
+
+    daemon = Daemon(args.socket, args.max_jobs, args.settle)  # pyright:ignore[reportAny]
+    guard_signals()
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,28 @@
+import json
+import os
+import tempfile
+
+
+def runtime_dir(*parts: str) -> str:
+    base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    path = os.path.join(base, f"osync-{os.getuid()}", *parts)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def cache_dir(*parts: str) -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(base, "osync", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_json_atomically(path: str, data: object):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
@@ -0,0 +1,11 @@
+from enum import Enum
+
+
+class Direction(Enum):
+    PUSH = "push"
+    PULL = "pull"
+
+
+class Kind(Enum):
+    INCLUDE = "include"
+    EXCLUDE = "exclude"
@@ -0,0 +1,78 @@
+import statistics
+import time
+from dataclasses import dataclass, replace
+
+from .rsync import RsyncCommand, RsyncResult
+
+# a remote that takes this many times the median (or, of two, the faster one)
+# is reported as a straggler
+STRAGGLER_FACTOR = 2.0
+
+
+@dataclass(frozen=True)
+class RemoteResult:
+    remote: str
+    result: RsyncResult
+    seconds: float
+
+
+def retarget(
+    command: RsyncCommand, remote_user_host: str, extra_args: list[str]
+) -> RsyncCommand:
+    # the same push with the remote's host swapped in; the file list, filters
+    # and everything else are shared
+    prefix = command.dest.split(":", 1)[0] + ":"
+    return replace(
+        command,
+        dest=remote_user_host + ":" + command.dest.removeprefix(prefix),
+        extra_args=list(extra_args),
+        args=[],
+    )
+
+
+def _push(remote: str, commands: list[RsyncCommand], jobs: int) -> RemoteResult:
+    start = time.monotonic()
+    if len(commands) == 1 or jobs <= 1:
+        results = [command.execute() for command in commands]
+    else:
+        from concurrent.futures import ThreadPoolExecutor  # pulls in logging
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(RsyncCommand.execute, commands))
+    return RemoteResult(remote, RsyncResult.combine(results), time.monotonic() - start)
+
+
+def fan_out(
+    commands: dict[str, list[RsyncCommand]], per_remote: int = 1
+) -> list[RemoteResult]:
+    from concurrent.futures import ThreadPoolExecutor  # pulls in logging
+
+    for remote_commands in commands.values():
+        for command in remote_commands:
+            command.build()
+    with ThreadPoolExecutor(max_workers=max(1, len(commands))) as pool:
+        futures = [
+            pool.submit(_push, remote, remote_commands, per_remote)
+            for remote, remote_commands in commands.items()
+        ]
+        return [future.result() for future in futures]
+
+
+def stragglers(
+    results: list[RemoteResult], factor: float = STRAGGLER_FACTOR
+) -> list[str]:
+    if len(results) < 2:
+        return []
+    # the median of two would be dragged halfway towards the slow one
+    seconds = [r.seconds for r in results]
+    baseline = min(seconds) if len(seconds) == 2 else statistics.median(seconds)
+    return [r.remote for r in results if r.seconds > factor * max(baseline, 1e-3)]
+
+
+def format_fan_out(results: list[RemoteResult]) -> str:
+    slow = stragglers(results)
+    lines: list[str] = []
+    for r in sorted(results, key=lambda r: r.seconds):
+        note = "  (straggler)" if r.remote in slow else ""
+        lines.append(f"{r.remote}: {r.result.summary()} in {r.seconds:.1f}s{note}")
+    return "\n".join(lines)
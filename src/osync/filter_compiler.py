@@ -0,0 +1,137 @@
+from dataclasses import dataclass, field
+from itertools import groupby
+
+from .enums import Kind
+from .filter_matcher import Rule, parse_filter_args
+
+_WILDCARDS = "*?["
+_UNCONDITIONAL = {"*", "**", "***", "/**", "/***"}
+
+CATCH_ALL = Rule(Kind.EXCLUDE, "*")
+ALL_DIRS = Rule(Kind.INCLUDE, "*/")
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    rule: Rule
+    origin: str
+
+
+@dataclass
+class CompiledFilters:
+    rules: list[CompiledRule] = field(default_factory=lambda: [])
+    dropped: list[CompiledRule] = field(default_factory=lambda: [])
+    passthrough: list[str] = field(default_factory=lambda: [])
+    prune_empty_dirs: bool = False
+
+    @property
+    def args(self) -> list[str]:
+        args = self.passthrough.copy()
+        if self.prune_empty_dirs:
+            args.append("--prune-empty-dirs")
+        return args + [f"--{c.rule.kind.value}={c.rule.pattern}" for c in self.rules]
+
+    def explain(self) -> str:
+        sign = {Kind.INCLUDE: "+", Kind.EXCLUDE: "-"}
+        lines = [
+            f"{sign[c.rule.kind]} {c.rule.pattern:<40} # {c.origin}" for c in self.rules
+        ]
+        lines += [
+            f"  {sign[c.rule.kind]} {c.rule.pattern:<38} # dropped: {c.origin}"
+            for c in self.dropped
+        ]
+        if self.prune_empty_dirs:
+            lines.append("--prune-empty-dirs")
+        return "\n".join(lines)
+
+
+def specificity(rule: Rule) -> tuple[bool, int, int]:
+    literal = sum(1 for char in rule.pattern if char not in _WILDCARDS)
+    return rule.pattern.startswith("/"), rule.pattern.count("/"), literal
+
+
+def _anchored_dir(components: list[str]) -> str:
+    return "/" + "".join(component + "/" for component in components)
+
+
+def parent_includes(rule: Rule) -> list[Rule] | None:
+    # None means the rule can match at any depth, so every directory has to be
+    # traversed to find its matches
+    pattern = rule.pattern
+    if not pattern.startswith("/"):
+        return None
+    if pattern.endswith("/***"):
+        pattern = pattern[:-4]
+    *components, last = pattern.strip("/").split("/")
+
+    parents: list[Rule] = []
+    for i, component in enumerate(components):
+        if "**" in component:
+            parents.append(Rule(Kind.INCLUDE, _anchored_dir(components[:i]) + "**/"))
+            return parents
+        parents.append(Rule(Kind.INCLUDE, _anchored_dir(components[: i + 1])))
+    if "**" in last:
+        parents.append(Rule(Kind.INCLUDE, _anchored_dir(components) + "**/"))
+    return parents
+
+
+def _dedupe(rules: list[Rule], compiled: CompiledFilters) -> list[Rule]:
+    seen: set[str] = set()
+    kept: list[Rule] = []
+    for rule in rules:
+        if rule.pattern in seen:
+            compiled.dropped.append(CompiledRule(rule, "shadowed by an earlier rule"))
+            continue
+        if kept and kept[-1].pattern in _UNCONDITIONAL:
+            compiled.dropped.append(CompiledRule(rule, "unreachable after a catch-all"))
+            continue
+        seen.add(rule.pattern)
+        kept.append(rule)
+    return kept
+
+
+def _order(rules: list[Rule]) -> list[Rule]:
+    # the first matching rule wins, so only runs of the same kind may be
+    # reordered without changing what gets transferred
+    ordered: list[Rule] = []
+    for _, run in groupby(rules, key=lambda rule: rule.kind):
+        ordered += sorted(run, key=specificity, reverse=True)
+    return ordered
+
+
+def compile_filters(args: list[str]) -> CompiledFilters:
+    compiled = CompiledFilters(
+        passthrough=[
+            arg
+            for arg in args
+            if not any(arg.startswith(f"--{kind.value}=") for kind in Kind)
+        ]
+    )
+    rules = _order(_dedupe(parse_filter_args(args), compiled))
+    compiled.rules = [CompiledRule(rule, "user") for rule in rules]
+    if rules and rules[-1].pattern in _UNCONDITIONAL:
+        return compiled
+
+    parents: list[Rule] = []
+    for rule in rules:
+        if rule.kind != Kind.INCLUDE:
+            continue
+        needed = parent_includes(rule)
+        if needed is None:
+            parents = [ALL_DIRS]
+            break
+        parents += [p for p in needed if p not in parents]
+
+    user_patterns = {rule.pattern for rule in rules}
+    compiled.rules += [
+        CompiledRule(parent, "parent directory")
+        for parent in parents
+        if parent.pattern not in user_patterns
+    ]
+    # only a `*/` of our own makes every directory go across; parents the
+    # user wrote, and anchored ones, leave empty directories as they were
+    compiled.prune_empty_dirs = (
+        ALL_DIRS in parents and ALL_DIRS.pattern not in user_patterns
+    )
+    compiled.rules.append(CompiledRule(CATCH_ALL, "catch-all, prunes everything else"))
+    return compiled
@@ -1,18 +1,21 @@
-from enum import Enum
+from typing import Annotated
 
-import yaml
 from pydantic import Field, TypeAdapter, field_validator
 from pydantic.dataclasses import dataclass
 
+from .bandwidth import parse_rate
+from .enums import Direction, Kind
+from .large_files import parse_size
 
-class Direction(Enum):
-    PUSH = "push"
-    PULL = "pull"
-
-
-class Kind(Enum):
-    INCLUDE = "include"
-    EXCLUDE = "exclude"
+__all__ = [
+    "BandwidthConfig",
+    "Direction",
+    "FilterGroup",
+    "Kind",
+    "OsyncConfig",
+    "load_config",
+    "load_filter_groups",
+]
 
 
 @dataclass
@@ -20,6 +23,12 @@ class FilterGroup:
     direction: Direction
     kind: Kind
     patterns: list[str] = Field(min_length=1)
+    priority: int | None = Field(default=None, ge=1)
+    # transfer settings for this group's direction; they win over --auto-tune
+    compress: bool | None = None
+    whole_file: bool | None = None
+    # rsync refuses blocks over 128 KiB
+    block_size: int | None = Field(default=None, gt=0, le=128 * 1024)
 
     @field_validator("direction", mode="before")
     @classmethod
@@ -31,15 +40,51 @@ class FilterGroup:
     def parse_kind(cls, v: str | Kind) -> Kind:
         return v if isinstance(v, Kind) else Kind(v)
 
+    @field_validator("block_size", mode="before")
+    @classmethod
+    def parse_block_size(cls, v: str | int | None) -> int | None:
+        return None if v is None else parse_size(v)
+
     @property
     def rsync_args(self) -> list[str]:
         return [f"--{self.kind.value}={pat}" for pat in self.patterns]
 
 
+@dataclass
+class BandwidthConfig:
+    budget: int = Field(gt=0)
+    priority: dict[Direction, Annotated[int, Field(ge=1)]] = Field(
+        default_factory=lambda: {}
+    )
+
+    @field_validator("budget", mode="before")
+    @classmethod
+    def parse_budget(cls, v: str | int) -> int:
+        return parse_rate(v)
+
+
+@dataclass
+class OsyncConfig:
+    filter_groups: list[FilterGroup] = Field(default_factory=lambda: [])
+    bandwidth: BandwidthConfig | None = None
+    # osync.yaml files further up are not merged into this one
+    root: bool = False
+
+
 FilterGroupList = TypeAdapter(list[FilterGroup])
+OsyncConfigAdapter = TypeAdapter(OsyncConfig)
 
 
-def load_filter_groups(path: str) -> list[FilterGroup]:
+def load_config(path: str) -> OsyncConfig:
+    import yaml  # only needed when the compiled config cache misses
+
     with open(path) as f:
         raw = yaml.safe_load(f)  # pyright:ignore[reportAny]
-    return FilterGroupList.validate_python(raw)
+    if isinstance(raw, list):
+        # a bare list of filter groups is the original format
+        return OsyncConfig(filter_groups=FilterGroupList.validate_python(raw))
+    return OsyncConfigAdapter.validate_python(raw)
+
+
+def load_filter_groups(path: str) -> list[FilterGroup]:
+    return load_config(path).filter_groups
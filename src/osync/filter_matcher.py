@@ -0,0 +1,181 @@
+import os
+import re
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+from .enums import Kind
+from .shard import transfer_prefix
+
+_WILDCARDS = "*?["
+
+
+@dataclass(frozen=True)
+class Rule:
+    kind: Kind
+    pattern: str
+
+
+@dataclass(frozen=True)
+class WalkEntry:
+    relpath: str
+    path: str
+    is_dir: bool
+
+
+def parse_filter_args(args: list[str]) -> list[Rule]:
+    rules: list[Rule] = []
+    for arg in args:
+        for kind in Kind:
+            prefix = f"--{kind.value}="
+            if arg.startswith(prefix):
+                rules.append(Rule(kind, arg[len(prefix) :]))
+    return rules
+
+
+def _translate_class(body: str) -> str:
+    negate = body[:1] in ("!", "^")
+    if negate:
+        body = body[1:]
+    escaped = "".join("\\" + char if char in "\\[]^" else char for char in body)
+    return "[^/" + escaped + "]" if negate else "[" + escaped + "]"
+
+
+def _translate(pattern: str) -> str:
+    if not any(char in pattern for char in _WILDCARDS):
+        return re.escape(pattern)
+
+    out: list[str] = []
+    i, n = 0, len(pattern)
+    while i < n:
+        char = pattern[i]
+        if char == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            while i < n and pattern[i] == "*":
+                i += 1
+        elif char == "*":
+            out.append("[^/]*")
+            i += 1
+        elif char == "?":
+            out.append("[^/]")
+            i += 1
+        elif char == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                out.append(re.escape(char))
+                i += 1
+            else:
+                out.append(_translate_class(pattern[i + 1 : j]))
+                i = j + 1
+        else:
+            out.append(re.escape(char))
+            i += 1
+    return "".join(out)
+
+
+def pattern_regex(pattern: str) -> str:
+    tail = ""
+    if pattern.endswith("/***"):
+        pattern, tail = pattern[:-4], "(?:/.*)?"
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+
+    if pattern.startswith("/"):
+        head, pattern = "/", pattern[1:]
+    else:
+        head = ".*/"
+
+    return head + _translate(pattern) + tail + ("/" if dir_only else "/?")
+
+
+class FilterMatcher:
+    def __init__(self, rules: list[Rule], prune_empty_dirs: bool = False):
+        self.rules: list[Rule] = rules
+        self.prune_empty_dirs: bool = prune_empty_dirs
+        alternatives = (
+            f"(?P<r{i}>{pattern_regex(rule.pattern)})" for i, rule in enumerate(rules)
+        )
+        self._regex: re.Pattern[str] | None = (
+            re.compile("|".join(alternatives), re.DOTALL) if rules else None
+        )
+
+    @classmethod
+    def from_args(cls, args: list[str]) -> "FilterMatcher":
+        return cls(parse_filter_args(args), "--prune-empty-dirs" in args)
+
+    def match(self, relpath: str, is_dir: bool) -> Rule | None:
+        if self._regex is None:
+            return None
+        match = self._regex.fullmatch("/" + relpath + ("/" if is_dir else ""))
+        if match is None or match.lastgroup is None:
+            return None
+        return self.rules[int(match.lastgroup[1:])]
+
+    def included(self, relpath: str, is_dir: bool) -> bool:
+        rule = self.match(relpath, is_dir)
+        return rule is None or rule.kind == Kind.INCLUDE
+
+
+def transfer_root(source: str) -> str:
+    if source.endswith("/"):
+        return source
+    root = os.path.dirname(source) or "."
+    return root + "/" if root.endswith(":") else root
+
+
+def walk(
+    source: str, matcher: FilterMatcher, prefix: str | None = None
+) -> Iterator[WalkEntry]:
+    if not os.path.isdir(source):
+        relpath = os.path.basename(source)
+        if matcher.included(relpath, False):
+            yield WalkEntry(relpath, source, False)
+        return
+
+    if prefix is None:
+        prefix = transfer_prefix(source)
+        if prefix and not matcher.included(prefix.rstrip("/"), True):
+            return
+
+    # with --prune-empty-dirs rsync skips directories that end up with nothing
+    # in them, so one is only yielded (just ahead of it) once a file turns up
+    pending: dict[str, WalkEntry] = {}
+    stack = [(source, prefix)]
+    while stack:
+        path, relprefix = stack.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            relpath = relprefix + entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if not matcher.included(relpath, is_dir):
+                continue
+            walk_entry = WalkEntry(relpath, entry.path, is_dir)
+            if is_dir:
+                stack.append((entry.path, relpath + "/"))
+                if matcher.prune_empty_dirs:
+                    pending[relpath] = walk_entry
+                    continue
+            elif pending:
+                yield from _unpend(pending, relprefix.rstrip("/"))
+            yield walk_entry
+
+
+def _unpend(pending: dict[str, WalkEntry], relpath: str) -> Iterator[WalkEntry]:
+    # a yielded directory's parents were yielded before it, so the first one
+    # that is not pending ends the chain
+    chain: list[WalkEntry] = []
+    while relpath in pending:
+        chain.append(pending.pop(relpath))
+        relpath = relpath.rpartition("/")[0]
+    return reversed(chain)
@@ -1,16 +1,24 @@
 import os
 
+from .metrics import timed
 
-def findup(filename: str):
-    cwd = os.getcwd()
 
-    def inner(drive: str, dir: str, filename: str) -> str:
+def findup(filename: str, cwd: str | None = None) -> str:
+    found = findall(filename, cwd)
+    if not found:
+        raise LookupError("file not found: %s" % filename)
+    return found[0]
+
+
+@timed("findup")
+def findall(filename: str, cwd: str | None = None) -> list[str]:
+    # every one up to the root, nearest first
+    drive, dir = os.path.splitdrive(os.path.abspath(cwd or os.getcwd()))
+    found: list[str] = []
+    while True:
         filepath = os.path.join(drive, dir, filename)
         if os.path.isfile(filepath):
-            return filepath
+            found.append(filepath)
         if dir == os.path.sep:
-            raise LookupError("file not found: %s" % filename)
-        return inner(drive, os.path.dirname(dir), filename)
-
-    drive, start = os.path.splitdrive(os.path.abspath(cwd))
-    return inner(drive, start, filename)
+            return found
+        dir = os.path.dirname(dir)
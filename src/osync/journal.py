@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TextIO
+
+from .dirs import cache_dir
+from .progress import Event, FileEvent
+from .rsync import RsyncCommand
+
+# rsync keeps the partly written file here and uses it as the basis next time,
+# so an interrupted large file is not sent from scratch again
+PARTIAL_DIR = ".osync-partial"
+PARTIAL_ARGS = [f"--partial-dir={PARTIAL_DIR}"]
+
+
+def journal_key(command: RsyncCommand) -> str:
+    sources = " ".join([command.source, *command.extra_sources])
+    return f"{command.direction.value} {sources} -> {command.dest}"
+
+
+def journal_path(key: str, directory: str | None = None) -> str:
+    directory = directory or cache_dir("journals")
+    return os.path.join(directory, hashlib.sha1(key.encode()).hexdigest() + ".jsonl")
+
+
+@dataclass
+class JournalState:
+    key: str
+    started: float
+    done: set[str] = field(default_factory=lambda: set())
+    returncode: int | None = None
+
+
+def load_journal(path: str) -> JournalState | None:
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return None
+    state: JournalState | None = None
+    for line in lines:
+        try:
+            record = json.loads(line)  # pyright:ignore[reportAny]
+        except ValueError:
+            # the last line may be cut short if the process died mid-write
+            continue
+        if "key" in record:
+            state = JournalState(record["key"], record["started"])  # pyright:ignore[reportAny]
+        elif state is not None and "done" in record:
+            state.done.add(record["done"])  # pyright:ignore[reportAny]
+        elif state is not None and "returncode" in record:
+            state.returncode = record["returncode"]  # pyright:ignore[reportAny]
+    return state
+
+
+class Journal:
+    # appends one line per completed file, as rsync reports it, so whatever
+    # interrupts the run the journal knows exactly what already arrived
+    def __init__(self, key: str, directory: str | None = None):
+        self.key: str = key
+        self.path: str = journal_path(key, directory)
+        fresh = not os.path.exists(self.path)
+        self._f: TextIO = open(self.path, "a", buffering=1)
+        self._lock: threading.Lock = threading.Lock()
+        if fresh:
+            self._write({"key": key, "started": time.time()})
+
+    def _write(self, record: dict[str, object]):
+        with self._lock:
+            _ = self._f.write(json.dumps(record) + "\n")
+
+    def __call__(self, event: Event):
+        if isinstance(event, FileEvent):
+            self._write({"done": event.path.rstrip("/")})
+
+    def finish(self, returncode: int):
+        if returncode == 0:
+            self._f.close()
+            os.unlink(self.path)
+            return
+        self._write({"returncode": returncode})
+        self._f.close()
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import subprocess
+import threading
+from dataclasses import dataclass
+
+from .dirs import cache_dir, write_json_atomically
+from .enums import Direction
+from .shard import escape_pattern
+
+DEFAULT_STREAMS = 4
+RANGE_SIZE = 256 * 1024**2
+PART_SUFFIX = ".osync-part"
+# each stream gets its own TCP connection instead of sharing the master's
+SSH_ARGS = ["-o", "ControlMaster=no", "-o", "ControlPath=none"]
+
+_SIZE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*$", re.IGNORECASE)
+_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+_BLOCK = 1024 * 1024
+
+
+def parse_size(value: str | int) -> int:
+    if isinstance(value, int):
+        return value
+    match = _SIZE.match(value)
+    if match is None:
+        raise ValueError(f"Not a size: {value!r} (expected e.g. 512M or 2G)")
+    return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+
+@dataclass(frozen=True)
+class LargeFile:
+    relpath: str
+    size: int
+    mtime: int
+    # permission bits, as --perms keeps them; None takes them from the remote
+    mode: int | None = None
+
+
+def ranges(size: int, range_size: int = RANGE_SIZE) -> list[tuple[int, int]]:
+    return [
+        (offset, min(range_size, size - offset))
+        for offset in range(0, size, range_size)
+    ]
+
+
+def lane_excludes(files: list[LargeFile]) -> list[str]:
+    # relpaths start at the transfer root, which is where rsync anchors "/"
+    return [f"--exclude=/{escape_pattern(f.relpath)}" for f in files]
+
+
+class RangeState:
+    # which ranges of a file already made it across, so an interrupted
+    # transfer only sends the rest
+    def __init__(self, key: str, directory: str | None = None):
+        directory = directory or cache_dir("ranges")
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        self.path: str = os.path.join(directory, digest + ".json")
+        self._lock: threading.Lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.done: set[int] = set(json.load(f))  # pyright:ignore[reportAny]
+        except (OSError, ValueError):
+            self.done = set()
+
+    def add(self, index: int):
+        with self._lock:
+            self.done.add(index)
+            write_json_atomically(self.path, sorted(self.done))
+
+    def clear(self):
+        self.done = set()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class LargeFileLane:
+    def __init__(
+        self,
+        direction: Direction,
+        ssh: list[str],
+        local_parent: str,
+        remote_parent: str,
+        streams: int = DEFAULT_STREAMS,
+        range_size: int = RANGE_SIZE,
+        state_dir: str | None = None,
+    ):
+        self.direction: Direction = direction
+        self.ssh: list[str] = ssh
+        self.local_parent: str = local_parent
+        self.remote_parent: str = remote_parent
+        self.streams: int = max(1, streams)
+        self.range_size: int = range_size
+        self.state_dir: str | None = state_dir
+
+    def _remote(
+        self,
+        command: str,
+        stdin: int | None = None,
+        stdout: int | None = None,
+        stderr: int | None = None,
+    ) -> subprocess.Popen[bytes]:
+        remote = f"cd {shlex.quote(self.remote_parent)} && {command}"
+        return subprocess.Popen(
+            [*self.ssh, remote], stdin=stdin, stdout=stdout, stderr=stderr
+        )
+
+    def _remote_output(self, command: str) -> str | None:
+        proc = self._remote(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        output, _ = proc.communicate()
+        return output.decode(errors="replace") if proc.returncode == 0 else None
+
+    def _up_to_date(self, file: LargeFile) -> bool:
+        # the same rule as rsync's --update with its quick check
+        if self.direction == Direction.PUSH:
+            output = self._remote_output(
+                f"stat -c '%s %Y' -- {shlex.quote(file.relpath)}"
+            )
+            try:
+                size, mtime = (int(field) for field in (output or "").split())
+            except ValueError:
+                # no answer, or not the one asked for
+                return False
+        else:
+            try:
+                st = os.stat(os.path.join(self.local_parent, file.relpath))
+            except OSError:
+                return False
+            size, mtime = st.st_size, int(st.st_mtime)
+        return mtime > file.mtime or (mtime == file.mtime and size == file.size)
+
+    def _send(self, file: LargeFile, offset: int, length: int) -> bool:
+        part = shlex.quote(file.relpath + PART_SUFFIX)
+        proc = self._remote(
+            f"dd of={part} bs={_BLOCK} seek={offset} oflag=seek_bytes"
+            + " conv=notrunc status=none",
+            stdin=subprocess.PIPE,
+        )
+        assert proc.stdin is not None
+        sent = False
+        try:
+            with open(os.path.join(self.local_parent, file.relpath), "rb") as f:
+                _ = f.seek(offset)
+                left = length
+                while left and (block := f.read(min(_BLOCK, left))):
+                    _ = proc.stdin.write(block)
+                    left -= len(block)
+            sent = not left
+        except OSError:
+            # a vanished or unreadable file must not leave dd waiting for more
+            proc.kill()
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        return proc.wait() == 0 and sent
+
+    def _receive(self, file: LargeFile, offset: int, length: int) -> bool:
+        part = os.path.join(self.local_parent, file.relpath + PART_SUFFIX)
+        try:
+            fd = os.open(part, os.O_WRONLY)
+        except OSError:
+            return False
+        proc = self._remote(
+            f"dd if={shlex.quote(file.relpath)} bs={_BLOCK} skip={offset}"
+            + f" count={length} iflag=skip_bytes,count_bytes status=none",
+            stdout=subprocess.PIPE,
+        )
+        assert proc.stdout is not None
+        position = offset
+        try:
+            while block := proc.stdout.read(_BLOCK):
+                position += os.pwrite(fd, block, position)
+        except OSError:
+            proc.kill()
+        finally:
+            os.close(fd)
+            proc.stdout.close()
+        return proc.wait() == 0 and position == offset + length
+
+    def _prepare(self, file: LargeFile, fresh: bool) -> bool:
+        # a fresh start must not inherit bytes from an older part file
+        if self.direction == Direction.PUSH:
+            directory = shlex.quote(os.path.dirname(file.relpath) or ".")
+            part = shlex.quote(file.relpath + PART_SUFFIX)
+            create = f": > {part}" if fresh else f"touch {part}"
+            return self._remote_output(f"mkdir -p {directory} && {create}") is not None
+        part = os.path.join(self.local_parent, file.relpath + PART_SUFFIX)
+        os.makedirs(os.path.dirname(part), exist_ok=True)
+        with open(part, "wb" if fresh else "ab") as f:
+            _ = f.truncate(file.size)
+        return True
+
+    def _finish(self, file: LargeFile) -> bool:
+        from .verify import hash_file  # pulls in sqlite3
+
+        # the reassembled file only replaces the old one once it hashes the same
+        part = file.relpath + PART_SUFFIX
+        remote_file = shlex.quote(
+            file.relpath if self.direction == Direction.PULL else part
+        )
+        output = self._remote_output(f"b2sum -- {remote_file}")
+        local_file = os.path.join(
+            self.local_parent,
+            file.relpath if self.direction == Direction.PUSH else part,
+        )
+        if output is None or output.split(" ", 1)[0] != hash_file(local_file):
+            return False
+        if self.direction == Direction.PUSH:
+            q = shlex.quote
+            chmod = "" if file.mode is None else f" && chmod {file.mode:o} -- {q(part)}"
+            return (
+                self._remote_output(
+                    f"touch -m -d @{file.mtime} -- {q(part)}{chmod}"
+                    + f" && mv -f -- {q(part)} {q(file.relpath)}"
+                )
+                is not None
+            )
+        mode = file.mode
+        if mode is None:
+            output = self._remote_output(f"stat -c %a -- {remote_file}")
+            try:
+                mode = int(output or "", 8)
+            except ValueError:
+                mode = None
+        if mode is not None:
+            os.chmod(local_file, mode)
+        dest = os.path.join(self.local_parent, file.relpath)
+        os.replace(local_file, dest)
+        os.utime(dest, (file.mtime, file.mtime))
+        return True
+
+    def transfer(self, file: LargeFile) -> bool:
+        if self._up_to_date(file) or file.size == 0:
+            return True
+        key = f"{self.direction.value} {self.local_parent} {self.remote_parent}"
+        state = RangeState(
+            f"{key} {file.relpath} {file.size} {file.mtime}", self.state_dir
+        )
+        if not self._prepare(file, fresh=not state.done):
+            return False
+        move = self._send if self.direction == Direction.PUSH else self._receive
+        todo = [
+            (i, offset, length)
+            for i, (offset, length) in enumerate(ranges(file.size, self.range_size))
+            if i not in state.done
+        ]
+
+        def one(job: tuple[int, int, int]) -> bool:
+            i, offset, length = job
+            ok = move(file, offset, length)
+            if ok:
+                state.add(i)
+            return ok
+
+        from concurrent.futures import ThreadPoolExecutor  # pulls in logging
+
+        with ThreadPoolExecutor(max_workers=self.streams) as pool:
+            sent = all(list(pool.map(one, todo)))
+        if not sent:
+            return False
+        finished = self._finish(file)
+        # on a mismatch the recorded ranges can't be trusted, so start over
+        state.clear()
+        return finished
+
+    def run(self, files: list[LargeFile]) -> int:
+        failed = 0
+        for file in files:
+            try:
+                ok = self.transfer(file)
+            except OSError as e:
+                print(f"{file.relpath}: {e}")
+                ok = False
+            failed += not ok
+            print(f"{'large' if ok else 'failed'}  {file.relpath}")
+        return 0 if not failed else 23
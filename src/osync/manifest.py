@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import re
+import stat
+import subprocess
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+
+from .dirs import cache_dir, write_json_atomically
+from .enums import Direction
+from .filter_matcher import FilterMatcher, walk
+from .progress import Event, FileEvent
+
+MANIFEST_VERSION = 1
+DEFAULT_TTL = 300
+
+# `rsync --list-only` prints one of these per entry, times in the local timezone
+_LIST_LINE = re.compile(
+    r"^([dlcbps-])[rwxsStT-]{9}\s+([\d,]+) (\d{4}/\d\d/\d\d \d\d:\d\d:\d\d) (.+)$"
+)
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    size: int
+    mtime: int
+    is_dir: bool = False
+
+
+@dataclass
+class Manifest:
+    root: str
+    fetched: float
+    entries: dict[str, ManifestEntry] = field(default_factory=lambda: {})
+
+    def age(self, now: float | None = None) -> float:
+        return (time.time() if now is None else now) - self.fetched
+
+    def filtered(self, matcher: FilterMatcher) -> Iterator[tuple[str, ManifestEntry]]:
+        # a parent sorts before everything below it, so pruned directories are
+        # known by the time their contents come up
+        pruned: set[str] = set()
+        for relpath, entry in sorted(self.entries.items()):
+            if relpath.rpartition("/")[0] in pruned or not matcher.included(
+                relpath, entry.is_dir
+            ):
+                if entry.is_dir:
+                    pruned.add(relpath)
+                continue
+            yield relpath, entry
+
+    @classmethod
+    def from_json(cls, raw: dict[str, object]) -> "Manifest":
+        entries: dict[str, list[int]] = raw["entries"]  # pyright:ignore[reportAssignmentType]
+        return cls(
+            str(raw["root"]),
+            float(raw["fetched"]),  # pyright:ignore[reportArgumentType]
+            {
+                path: ManifestEntry(size, mtime, bool(is_dir))
+                for path, (size, mtime, is_dir) in entries.items()
+            },
+        )
+
+    def to_json(self) -> dict[str, object]:
+        return {
+            "version": MANIFEST_VERSION,
+            "root": self.root,
+            "fetched": self.fetched,
+            "entries": {
+                path: [e.size, e.mtime, int(e.is_dir)]
+                for path, e in self.entries.items()
+            },
+        }
+
+
+def parse_list_line(line: str) -> tuple[str, ManifestEntry] | None:
+    match = _LIST_LINE.match(line)
+    if match is None:
+        return None
+    kind, size, stamp, name = match.groups()
+    if kind == "l":
+        name = name.rsplit(" -> ", 1)[0]
+    mtime = int(time.mktime(time.strptime(stamp, "%Y/%m/%d %H:%M:%S")))
+    return name, ManifestEntry(int(size.replace(",", "")), mtime, kind == "d")
+
+
+def fetch_manifest(
+    root: str, extra_args: list[str] | None = None, rsync: str = "rsync"
+) -> Manifest:
+    fetched = time.time()
+    args = [rsync, "--list-only", "--recursive", *(extra_args or []), root]
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, text=True, errors="replace")
+    assert proc.stdout is not None
+    manifest = Manifest(root, fetched)
+    with proc.stdout:
+        for line in proc.stdout:
+            parsed = parse_list_line(line.rstrip("\n"))
+            if parsed is not None:
+                manifest.entries[parsed[0]] = parsed[1]
+    returncode = proc.wait()
+    if returncode != 0:
+        raise RuntimeError(f"Listing {root} failed (rsync exit code {returncode})")
+    return manifest
+
+
+class ManifestCache:
+    def __init__(
+        self,
+        directory: str | None = None,
+        ttl: float = DEFAULT_TTL,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.directory: str = directory or cache_dir("manifests")
+        self.ttl: float = ttl
+        self.clock: Callable[[], float] = clock
+
+    def path(self, root: str) -> str:
+        return os.path.join(
+            self.directory, hashlib.sha1(root.encode()).hexdigest() + ".json"
+        )
+
+    def load(self, root: str) -> Manifest | None:
+        try:
+            with open(self.path(root)) as f:
+                raw = json.load(f)  # pyright:ignore[reportAny]
+            if raw["version"] != MANIFEST_VERSION or raw["root"] != root:
+                return None
+            manifest = Manifest.from_json(raw)  # pyright:ignore[reportAny]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if manifest.age(self.clock()) > self.ttl:
+            return None
+        return manifest
+
+    def save(self, manifest: Manifest):
+        write_json_atomically(self.path(manifest.root), manifest.to_json())
+
+    def invalidate(self, root: str):
+        try:
+            os.unlink(self.path(root))
+        except FileNotFoundError:
+            pass
+
+    def get(
+        self, root: str, fetch: Callable[[str], Manifest], refresh: bool = False
+    ) -> Manifest:
+        manifest = None if refresh else self.load(root)
+        if manifest is None:
+            manifest = fetch(root)
+            self.save(manifest)
+        return manifest
+
+
+@dataclass(frozen=True)
+class PlannedChange:
+    direction: Direction
+    reason: str
+    path: str
+
+
+def _differs(size: int, mtime: int, entry: ManifestEntry) -> bool:
+    return size != entry.size or mtime != entry.mtime
+
+
+def plan_status(
+    local: str,
+    manifest: Manifest,
+    push_matcher: FilterMatcher,
+    pull_matcher: FilterMatcher,
+) -> list[PlannedChange]:
+    # mirrors the rsync flags osync uses: size or mtime decide whether a file
+    # differs, and --update leaves alone whatever is newer on the receiver
+    changes: list[PlannedChange] = []
+    for entry in walk(local, push_matcher):
+        if entry.is_dir:
+            continue
+        st = os.lstat(entry.path)
+        remote = manifest.entries.get(entry.relpath)
+        if remote is None:
+            changes.append(PlannedChange(Direction.PUSH, "new", entry.relpath))
+        elif _differs(st.st_size, int(st.st_mtime), remote) and (
+            int(st.st_mtime) >= remote.mtime
+        ):
+            changes.append(PlannedChange(Direction.PUSH, "changed", entry.relpath))
+
+    parent = os.path.dirname(local)
+    for relpath, remote in manifest.filtered(pull_matcher):
+        if remote.is_dir:
+            continue
+        try:
+            st = os.lstat(os.path.join(parent, relpath))
+        except FileNotFoundError:
+            changes.append(PlannedChange(Direction.PULL, "new", relpath))
+            continue
+        if _differs(st.st_size, int(st.st_mtime), remote) and (
+            remote.mtime >= int(st.st_mtime)
+        ):
+            changes.append(PlannedChange(Direction.PULL, "changed", relpath))
+    return changes
+
+
+def format_status(changes: list[PlannedChange], age: float) -> str:
+    lines = [f"{c.direction.value:<5} {c.reason:<8} {c.path}" for c in changes]
+    pushes = sum(1 for c in changes if c.direction == Direction.PUSH)
+    footer = f"(remote manifest from {age:.0f}s ago)"
+    if not changes:
+        lines.append(f"Up to date {footer}")
+    else:
+        lines.append(f"{pushes} to push, {len(changes) - pushes} to pull {footer}")
+    return "\n".join(lines)
+
+
+class ManifestRefresher:
+    def __init__(self, cache: ManifestCache, manifests: list[Manifest], parent: str):
+        self.cache: ManifestCache = cache
+        self.parent: str = parent
+        self._manifests: dict[str, Manifest] = {
+            os.path.basename(manifest.root): manifest for manifest in manifests
+        }
+        self._touched: set[str] = set()
+
+    def __call__(self, event: Event):
+        # whatever rsync just transferred now looks the same on both ends, so
+        # the local copy tells what the remote holds without another listing
+        if isinstance(event, FileEvent):
+            self._touched.add(event.path.rstrip("/"))
+
+    def apply(self, returncode: int):
+        if returncode != 0:
+            for manifest in self._manifests.values():
+                self.cache.invalidate(manifest.root)
+            return
+
+        for relpath in self._touched:
+            manifest = self._manifests.get(relpath.split("/", 1)[0])
+            if manifest is None:
+                continue
+            try:
+                st = os.lstat(os.path.join(self.parent, relpath))
+            except FileNotFoundError:
+                _ = manifest.entries.pop(relpath, None)
+                continue
+            manifest.entries[relpath] = ManifestEntry(
+                st.st_size, int(st.st_mtime), stat.S_ISDIR(st.st_mode)
+            )
+        for manifest in self._manifests.values():
+            self.cache.save(manifest)
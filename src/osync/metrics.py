@@ -0,0 +1,142 @@
+import functools
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import ParamSpec, TypeVar
+
+from .dirs import write_json_atomically
+
+Hook = Callable[[str, float], None]
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+_hooks: list[Hook] = []
+
+
+def add_hook(hook: Hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def emit(name: str, seconds: float):
+    for hook in list(_hooks):
+        hook(name, seconds)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    def decorate(func: Callable[P, R]) -> Callable[P, R]:
+        @functools.wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            # nobody listening: don't even read the clock
+            if not _hooks:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock: Callable[[], float] = clock
+        self.started: float = clock()
+        self.phases: dict[str, tuple[int, float]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def __call__(self, name: str, seconds: float):
+        with self._lock:
+            calls, total = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (calls + 1, total + seconds)
+
+    def to_json(
+        self, direction: str, returncode: int, stats: dict[str, int | float]
+    ) -> dict[str, object]:
+        return {
+            "direction": direction,
+            "timestamp": self.started,
+            "duration": self.clock() - self.started,
+            "returncode": returncode,
+            "phases": {
+                name: {"calls": calls, "seconds": seconds}
+                for name, (calls, seconds) in self.phases.items()
+            },
+            "stats": stats,
+        }
+
+    def to_prometheus(
+        self, direction: str, returncode: int, stats: dict[str, int | float]
+    ) -> str:
+        labels = f'direction="{_label(direction)}"'
+        lines = [
+            "# HELP osync_phase_seconds Time spent in each phase of the last sync",
+            "# TYPE osync_phase_seconds gauge",
+        ]
+        lines += [
+            f'osync_phase_seconds{{{labels},phase="{_label(name)}"}} {seconds}'
+            for name, (_, seconds) in self.phases.items()
+        ]
+        lines += [
+            "# HELP osync_phase_calls How often each phase ran during the last sync",
+            "# TYPE osync_phase_calls gauge",
+        ]
+        lines += [
+            f'osync_phase_calls{{{labels},phase="{_label(name)}"}} {calls}'
+            for name, (calls, _) in self.phases.items()
+        ]
+        lines += [
+            "# HELP osync_sync_duration_seconds Wall time of the last sync",
+            "# TYPE osync_sync_duration_seconds gauge",
+            f"osync_sync_duration_seconds{{{labels}}} {self.clock() - self.started}",
+            "# HELP osync_sync_timestamp_seconds When the last sync started",
+            "# TYPE osync_sync_timestamp_seconds gauge",
+            f"osync_sync_timestamp_seconds{{{labels}}} {self.started}",
+            "# HELP osync_sync_exit_code rsync exit code of the last sync",
+            "# TYPE osync_sync_exit_code gauge",
+            f"osync_sync_exit_code{{{labels}}} {returncode}",
+        ]
+        for key, value in stats.items():
+            lines += [
+                f"# TYPE osync_rsync_{key} gauge",
+                f"osync_rsync_{key}{{{labels}}} {value}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write(
+        self,
+        path: str,
+        fmt: str,
+        direction: str,
+        returncode: int,
+        stats: dict[str, int | float],
+    ):
+        if fmt == "json":
+            write_json_atomically(path, self.to_json(direction, returncode, stats))
+            return
+        # the textfile collector may read at any moment, so never leave it a
+        # half-written file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            _ = f.write(self.to_prometheus(direction, returncode, stats))
+        os.replace(tmp, path)
@@ -0,0 +1,100 @@
+import shlex
+import sqlite3
+import subprocess
+from dataclasses import dataclass
+
+# moved files wait here on the remote, so swaps and chains of renames
+# never overwrite each other
+STAGING_DIR = ".osync-moving"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents (
+    target TEXT NOT NULL,
+    path TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (target, path)
+) WITHOUT ROWID
+"""
+
+
+@dataclass(frozen=True)
+class Move:
+    source: str
+    dest: str
+
+
+class ContentIndex:
+    # the content of every file as of the last successful push; it lives in
+    # the sync index database of osync.yaml
+    def __init__(self, path: str, target: str):
+        self.path: str = path
+        self.target: str = target
+        self._conn: sqlite3.Connection = sqlite3.connect(path)
+        _ = self._conn.execute(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def load(self) -> dict[str, str]:
+        rows = self._conn.execute(
+            "SELECT path, digest FROM contents WHERE target = ?", (self.target,)
+        )
+        return {str(path): str(digest) for path, digest in rows}  # pyright:ignore[reportAny]
+
+    def replace(self, hashes: dict[str, str]):
+        with self._conn:
+            _ = self._conn.execute(
+                "DELETE FROM contents WHERE target = ?", (self.target,)
+            )
+            _ = self._conn.executemany(
+                "INSERT INTO contents VALUES (?, ?, ?)",
+                ((self.target, path, digest) for path, digest in hashes.items()),
+            )
+
+
+def detect_moves(known: dict[str, str], current: dict[str, str]) -> list[Move]:
+    # a new path holding the content of a path that is gone was moved there
+    gone: dict[str, list[str]] = {}
+    for path, digest in sorted(known.items()):
+        if path not in current:
+            gone.setdefault(digest, []).append(path)
+    moves: list[Move] = []
+    for path in sorted(current):
+        candidates = gone.get(current[path])
+        if path not in known and candidates:
+            moves.append(Move(candidates.pop(0), path))
+    return moves
+
+
+def move_script(moves: list[Move]) -> str:
+    q = shlex.quote
+    lines = [f"mkdir -p {q(STAGING_DIR)}"]
+    # a file that is not where we expect it is left to rsync
+    lines += [
+        f"[ -f {q(m.source)} ] && mv -- {q(m.source)} {q(f'{STAGING_DIR}/{i}')}"
+        for i, m in enumerate(moves)
+    ]
+    for i, m in enumerate(moves):
+        staged = q(f"{STAGING_DIR}/{i}")
+        parent = q(m.dest.rsplit("/", 1)[0]) if "/" in m.dest else "."
+        lines.append(
+            f"[ -f {staged} ] && mkdir -p -- {parent} && mv -n -- {staged} {q(m.dest)}"
+        )
+    # whatever could not be placed is gone from the remote, rsync resends it
+    lines.append(f"rm -rf {q(STAGING_DIR)}")
+    sources = sorted({m.source.rsplit("/", 1)[0] for m in moves if "/" in m.source})
+    lines += [f"rmdir -p -- {q(d)} 2>/dev/null" for d in sources]
+    lines.append("true")
+    return "\n".join(lines) + "\n"
+
+
+def apply_moves(ssh: list[str], parent: str, moves: list[Move]):
+    # all of them in one round trip
+    proc = subprocess.run(
+        [*ssh, f"cd {shlex.quote(parent)} && sh -s"],
+        input=move_script(moves).encode(),
+        capture_output=True,
+    )
+    if proc.returncode != 0:
+        message = proc.stderr.decode(errors="replace").strip()
+        raise RuntimeError(f"Moving files on the remote failed: {message}")
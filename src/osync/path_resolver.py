@@ -1,6 +1,10 @@
 import os
+import stat
+from collections.abc import Callable, Iterable, Iterator
 from pathlib import Path
 
+from .metrics import timed
+
 
 def _get_envvar_or_error(varname: str):
     envvar = dict(os.environ).get(varname)
@@ -24,8 +28,9 @@ class PathResolver:
 
     def _to_remote(self, path: str):
         path_obj = Path(path)
-        if path_obj.resolve().is_relative_to(self.proxy_root):
-            return Path("/") / path_obj.resolve().relative_to(self.proxy_root)
+        resolved = path_obj.resolve()
+        if resolved.is_relative_to(self.proxy_root):
+            return Path("/") / resolved.relative_to(self.proxy_root)
 
         if not path_obj.is_absolute():
             raise ValueError("Can't work with a path outside OSYNC_PROXY_ROOT")
@@ -34,16 +39,76 @@ class PathResolver:
 
     def _to_local(self, path: str):
         path_obj = Path(path)
-        if path_obj.resolve().is_relative_to(self.proxy_root):
-            return path_obj.resolve()
+        resolved = path_obj.resolve()
+        if resolved.is_relative_to(self.proxy_root):
+            return resolved
 
         if not path_obj.is_absolute():
-            return path_obj.resolve()
+            return resolved
 
         return self.proxy_root / Path(path[1:])
 
+    @timed("to_remote")
     def to_remote(self, path: str):
         return self.remote_user_host + ":" + self._to_remote(path).as_posix()
 
+    @timed("to_local")
     def to_local(self, path: str):
         return self._to_local(path).as_posix()
+
+    # the same mappings for whole file lists; pathlib's comparisons cost more
+    # than the lookups here, so these work on the resolved strings
+
+    def to_remote_many(self, paths: Iterable[str]) -> Iterator[str]:
+        resolve = _cached_resolve()
+        root = self.proxy_root.as_posix()
+        prefix = root.rstrip("/") + "/"
+        for path in paths:
+            path_obj = Path(path)
+            resolved = resolve(path_obj)
+            if resolved == root:
+                yield self.remote_user_host + ":/"
+            elif resolved.startswith(prefix):
+                yield self.remote_user_host + ":/" + resolved[len(prefix) :]
+            elif not path_obj.is_absolute():
+                raise ValueError("Can't work with a path outside OSYNC_PROXY_ROOT")
+            else:
+                yield self.remote_user_host + ":" + path_obj.as_posix()
+
+    def to_local_many(self, paths: Iterable[str]) -> Iterator[str]:
+        resolve = _cached_resolve()
+        root = self.proxy_root.as_posix()
+        prefix = root.rstrip("/") + "/"
+        for path in paths:
+            path_obj = Path(path)
+            resolved = resolve(path_obj)
+            if resolved == root or resolved.startswith(prefix):
+                yield resolved
+            elif not path_obj.is_absolute():
+                yield resolved
+            else:
+                yield (self.proxy_root / Path(path[1:])).as_posix()
+
+
+def _cached_resolve() -> Callable[[Path], str]:
+    # Path.resolve checks every component of every path; across a file list
+    # the directories repeat, so each is resolved once and only the last
+    # component is looked at per path
+    resolved_dirs: dict[Path, str] = {}
+
+    def resolve(path: Path) -> str:
+        name = path.name
+        if name in ("", ".", ".."):
+            return path.resolve().as_posix()
+        parent = resolved_dirs.get(path.parent)
+        if parent is None:
+            parent = resolved_dirs[path.parent] = resolve(path.parent)
+        candidate = os.path.join(parent, name)
+        try:
+            if stat.S_ISLNK(os.lstat(candidate).st_mode):
+                return Path(candidate).resolve().as_posix()
+        except OSError:
+            pass
+        return candidate
+
+    return resolve
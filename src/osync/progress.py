@@ -0,0 +1,223 @@
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from typing import TextIO
+
+# rsync prints one of these per changed file; the tag keeps them apart from the
+# rest of its chatter and the name comes last since it may contain the separator
+OUT_FORMAT_TAG = "osync|"
+OUTPUT_ARGS = [f"--out-format={OUT_FORMAT_TAG}%i|%l|%b|%n", "--info=progress2,stats2"]
+
+_STATS_LINE = re.compile(r"^([A-Z][A-Za-z ]+): ([\d,]+(?:\.\d+)?)")
+_PROGRESS_LINE = re.compile(
+    r"^\s*([\d,]+)\s+(\d+)%\s+([\d.,]+)([kMGT]?B)/s\s+(\d+):(\d\d):(\d\d)"
+    + r"(?:\s+\(xfr#(\d+), (?:ir|to)-chk=(\d+)/(\d+)\))?"
+)
+_UNITS = {"B": 1, "kB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+_runs = itertools.count(1)
+
+
+def parse_stats_line(line: str) -> tuple[str, int | float] | None:
+    match = _STATS_LINE.match(line)
+    if match is None:
+        return None
+    key = match.group(1).lower().replace(" ", "_")
+    value = match.group(2).replace(",", "")
+    return key, float(value) if "." in value else int(value)
+
+
+def parse_stats(output: str) -> dict[str, int | float]:
+    stats: dict[str, int | float] = {}
+    for line in output.splitlines():
+        parsed = parse_stats_line(line)
+        if parsed is not None:
+            stats[parsed[0]] = parsed[1]
+    return stats
+
+
+@dataclass(frozen=True)
+class FileEvent:
+    itemize: str
+    size: int
+    transferred: int
+    path: str
+
+    @property
+    def action(self) -> str:
+        if self.itemize.startswith("*"):
+            return self.itemize[1:].strip()
+        if "+++++" in self.itemize:
+            return "created"
+        if self.itemize[:1] in ("<", ">"):
+            return "updated"
+        return "attributes"
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    bytes: int
+    percent: int
+    rate: float
+    eta: int
+    transfers: int
+    to_check: int
+    total: int
+    # the rsync run the totals belong to, as numbered by its OutputParser
+    run: int = 0
+
+
+@dataclass(frozen=True)
+class StatsEvent:
+    key: str
+    value: int | float
+    line: str
+
+
+@dataclass(frozen=True)
+class LogEvent:
+    line: str
+
+
+Event = FileEvent | ProgressEvent | StatsEvent | LogEvent
+Listener = Callable[[Event], None]
+
+
+def parse_line(line: str, run: int = 0) -> Event:
+    if line.startswith(OUT_FORMAT_TAG):
+        fields = line[len(OUT_FORMAT_TAG) :].split("|", 3)
+        if len(fields) == 4:
+            itemize, size, transferred, path = fields
+            return FileEvent(itemize, int(size or 0), int(transferred or 0), path)
+
+    match = _PROGRESS_LINE.match(line)
+    if match is not None:
+        hours, minutes, seconds = (int(match.group(i)) for i in (5, 6, 7))
+        return ProgressEvent(
+            bytes=int(match.group(1).replace(",", "")),
+            percent=int(match.group(2)),
+            rate=float(match.group(3).replace(",", "")) * _UNITS[match.group(4)],
+            eta=hours * 3600 + minutes * 60 + seconds,
+            transfers=int(match.group(8) or 0),
+            to_check=int(match.group(9) or 0),
+            total=int(match.group(10) or 0),
+            run=run,
+        )
+
+    stats = parse_stats_line(line)
+    if stats is not None:
+        return StatsEvent(*stats, line)
+
+    return LogEvent(line)
+
+
+class OutputParser:
+    def __init__(self):
+        self._pending: bytes = b""
+        self.run: int = next(_runs)
+
+    def feed(self, data: bytes) -> Iterator[Event]:
+        # progress2 redraws its line with \r, so both end a record
+        chunks = (self._pending + data).replace(b"\r", b"\n").split(b"\n")
+        self._pending = chunks.pop()
+        for chunk in chunks:
+            line = chunk.decode(errors="surrogateescape")
+            if line.strip():
+                yield parse_line(line, self.run)
+
+    def close(self) -> Iterator[Event]:
+        pending, self._pending = self._pending, b""
+        if pending.strip():
+            yield parse_line(pending.decode(errors="surrogateescape"), self.run)
+
+
+class ConsoleReporter:
+    def __init__(
+        self,
+        out: TextIO = sys.stdout,
+        live: TextIO | None = None,
+        interval: float = 0.5,
+    ):
+        self.out: TextIO = out
+        self.live: TextIO | None = live
+        self.interval: float = interval
+        self.started: float = time.monotonic()
+        self.files: int = 0
+        self._bytes: dict[int, int] = {}
+        self._eta: dict[int, int] = {}
+        self._shown: float = 0.0
+        self._lock: threading.Lock = threading.Lock()
+
+    def __call__(self, event: Event):
+        with self._lock:
+            if isinstance(event, FileEvent):
+                self.files += 1
+                _ = self.out.write(event.path + "\n")
+            elif isinstance(event, (LogEvent, StatsEvent)):
+                _ = self.out.write(event.line + "\n")
+            elif isinstance(event, ProgressEvent):
+                # concurrent workers each report their own totals; pool
+                # threads get reused, so they are told apart by run
+                self._bytes[event.run] = event.bytes
+                self._eta[event.run] = event.eta
+                self._show()
+
+    def line(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        rate = sum(self._bytes.values()) / elapsed
+        eta = max(self._eta.values(), default=0)
+        return (
+            f"{rate / 1024**2:8.2f} MB/s {self.files / elapsed:8.1f} files/s"
+            + f"  ETA {eta // 3600}:{eta // 60 % 60:02}:{eta % 60:02}"
+        )
+
+    def _show(self):
+        now = time.monotonic()
+        if self.live is None or now - self._shown < self.interval:
+            return
+        self._shown = now
+        _ = self.live.write("\r" + self.line())
+        self.live.flush()
+
+
+class JsonReport:
+    def __init__(self, path: str, command: list[str]):
+        self.started: float = time.monotonic()
+        self.totals: dict[str, int] = {"files": 0, "bytes": 0, "transferred_bytes": 0}
+        self._first: bool = True
+        self._lock: threading.Lock = threading.Lock()
+        self._f: TextIO = open(path, "w")
+        _ = self._f.write('{"command": ' + json.dumps(command) + ', "files": [\n')
+
+    def __call__(self, event: Event):
+        if not isinstance(event, FileEvent):
+            return
+        entry = {
+            "path": event.path,
+            "action": event.action,
+            "itemize": event.itemize,
+            "size": event.size,
+            "transferred": event.transferred,
+            "time": round(time.monotonic() - self.started, 6),
+        }
+        with self._lock:
+            self.totals["files"] += 1
+            self.totals["bytes"] += event.size
+            self.totals["transferred_bytes"] += event.transferred
+            # entries go straight to disk, so huge transfers never pile up in memory
+            _ = self._f.write(("" if self._first else ",\n") + json.dumps(entry))
+            self._first = False
+
+    def close(self, returncode: int, stats: dict[str, int | float]):
+        tail = {
+            "totals": self.totals,
+            "duration": round(time.monotonic() - self.started, 6),
+            "returncode": returncode,
+            "stats": stats,
+        }
+        _ = self._f.write("\n], " + json.dumps(tail)[1:] + "\n")
+        self._f.close()
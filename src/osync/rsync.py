@@ -1,8 +1,58 @@
 import os
 import subprocess
-from dataclasses import dataclass, field
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import IO, TYPE_CHECKING, TextIO
 
-from .filter_group import Direction, FilterGroup
+from .bandwidth import Bandwidth, Throttle
+from .enums import Direction
+from .filter_compiler import compile_filters
+from .filter_matcher import FilterMatcher, transfer_root
+from .metrics import emit, timed
+from .progress import (
+    OUTPUT_ARGS,
+    Event,
+    Listener,
+    OutputParser,
+    StatsEvent,
+)
+from .shard import plan_shards, shard_excludes, transfer_prefix
+from .tune import Profile, transfer_args
+
+if TYPE_CHECKING:
+    from .config_cache import FilterGroupLike
+
+
+def user_filter_args(
+    filter_groups: "list[FilterGroupLike]", direction: Direction
+) -> list[str]:
+    return [
+        arg
+        for filter_group in filter_groups
+        for arg in filter_group.rsync_args
+        if Direction(filter_group.direction) == Direction(direction)
+    ]
+
+
+@dataclass
+class RsyncResult:
+    returncode: int
+    stats: dict[str, int | float] = field(default_factory=lambda: {})
+
+    @classmethod
+    def combine(cls, results: list["RsyncResult"]) -> "RsyncResult":
+        returncode = next((r.returncode for r in results if r.returncode != 0), 0)
+        stats: dict[str, int | float] = {}
+        for result in results:
+            for key, value in result.stats.items():
+                stats[key] = stats.get(key, 0) + value
+        return cls(returncode, stats)
+
+    def summary(self) -> str:
+        files = self.stats.get("number_of_regular_files_transferred", 0)
+        size = self.stats.get("total_transferred_file_size", 0)
+        return f"{files} files transferred, {size} bytes (exit code {self.returncode})"
 
 
 @dataclass
@@ -10,9 +60,10 @@ class RsyncCommand:
     direction: Direction
     source: str
     dest: str
-    filter_groups: list[FilterGroup]
+    filter_groups: "list[FilterGroupLike]"
     force: bool = False
     dry_run: bool = False
+    jobs: int = 1
     base_args: list[str] = field(
         default_factory=lambda: [
             "rsync",
@@ -25,24 +76,174 @@ class RsyncCommand:
             "--perms",  # preserve permissions
         ]
     )
+    extra_args: list[str] = field(default_factory=lambda: [])
+    extra_sources: list[str] = field(default_factory=lambda: [])
+    files_from: list[str] | None = None
+    listeners: list[Listener] = field(default_factory=lambda: [])
+    bandwidth: Bandwidth | None = None
+    tuned: Profile | None = None
+    # where the command line is echoed; None is whatever sys.stdout is then
+    out: TextIO | None = None
     args: list[str] = field(default_factory=lambda: [])
 
+    def filter_args(self) -> list[str]:
+        if self.force:
+            return []
+        return compile_filters(
+            user_filter_args(self.filter_groups, self.direction)
+        ).args
+
+    @timed("build")
     def build(self):
         self.args = self.base_args.copy()
+        self.args += OUTPUT_ARGS
+        self.args += self.extra_args
+        self.args += transfer_args(self.direction, self.filter_groups, self.tuned)
+        if self.bandwidth is not None:
+            self.args += self.bandwidth.rsync_args
 
-        if not self.force:
-            self.args += [
-                arg
-                for filter_group in self.filter_groups
-                for arg in filter_group.rsync_args
-                if Direction(filter_group.direction) == Direction(self.direction)
-            ] + ["--exclude=*"]
+        if self.files_from is not None:
+            # the list was already filtered in-process, so rsync neither walks
+            # nor filters: it only transfers exactly what it is given
+            self.args += ["--no-recursive", "--from0", "--files-from=-"]
+        else:
+            self.args += self.filter_args()
 
         if self.dry_run:
             self.args += ["--dry-run"]
 
-        self.args += [self.source, self.dest]
+        if self.files_from is not None:
+            self.args += [transfer_root(self.source), self.dest]
+        else:
+            self.args += [self.source, *self.extra_sources, self.dest]
+
+    def stdin(self) -> bytes | None:
+        if self.files_from is None:
+            return None
+        return b"".join(os.fsencode(path) + b"\0" for path in self.files_from)
+
+    def shards(self) -> list["RsyncCommand"]:
+        if self.jobs <= 1 or self.extra_sources or not os.path.isdir(self.source):
+            return [self]
+
+        plan = plan_shards(
+            self.source, self.jobs, FilterMatcher.from_args(self.filter_args())
+        )
+        if len(plan) <= 1:
+            return [self]
+
+        if self.files_from is not None:
+            return self._shard_files_from(plan)
+
+        workers: list[RsyncCommand] = []
+        for i in range(len(plan)):
+            others = [name for j, names in enumerate(plan) if j != i for name in names]
+            worker = replace(
+                self,
+                jobs=1,
+                extra_args=self.extra_args + shard_excludes(self.source, others),
+                bandwidth=self._shard_bandwidth(len(plan)),
+            )
+            worker.build()
+            workers.append(worker)
+        return workers
+
+    def _shard_files_from(self, plan: list[list[str]]) -> list["RsyncCommand"]:
+        assert self.files_from is not None
+        prefix = transfer_prefix(self.source)
+        owner = {name: i for i, names in enumerate(plan) for name in names}
+        lists: list[list[str]] = [[] for _ in plan]
+        for relpath in self.files_from:
+            top = relpath[len(prefix) :].split("/", 1)[0]
+            lists[owner.get(top, 0)].append(relpath)
+
+        workers: list[RsyncCommand] = []
+        for files in lists:
+            worker = replace(
+                self,
+                jobs=1,
+                files_from=files,
+                bandwidth=self._shard_bandwidth(len(plan)),
+            )
+            worker.build()
+            workers.append(worker)
+        return workers
+
+    def _shard_bandwidth(self, shards: int) -> Bandwidth | None:
+        # the shards of one command share the priority of the command
+        return None if self.bandwidth is None else self.bandwidth.split(shards)
+
+    def execute(self) -> RsyncResult:
+        workers = self.shards()
+        if len(workers) == 1:
+            return self.run()
+
+        from concurrent.futures import ThreadPoolExecutor  # pulls in logging
+
+        with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+            results = list(pool.map(RsyncCommand.run, workers))
+        return RsyncResult.combine(results)
+
+    def run(self) -> RsyncResult:
+        start = time.perf_counter()
+        result = self._run()
+        self._emit_phases(time.perf_counter() - start, result.stats)
+        return result
+
+    def _emit_phases(self, seconds: float, stats: dict[str, int | float]):
+        # rsync's own split of its run, taken from --stats
+        file_list = 0.0
+        for key in ("file_list_generation_time", "file_list_transfer_time"):
+            if key in stats:
+                emit("rsync." + key.removesuffix("_time"), stats[key])
+                file_list += stats[key]
+        emit("rsync.transfer", max(0.0, seconds - file_list))
+
+    def _run(self) -> RsyncResult:
+        print(" ".join(self.args), file=self.out)
+        stdin = self.stdin()
+        throttle = Throttle(self.bandwidth) if self.bandwidth is not None else None
+        proc = subprocess.Popen(
+            self.args,
+            stdin=subprocess.PIPE if stdin is not None else None,
+            stdout=subprocess.PIPE,
+        )
+        if throttle is not None:
+            throttle.start(proc)
+        if proc.stdin is not None:
+            threading.Thread(
+                target=_feed, args=(proc.stdin, stdin), daemon=True
+            ).start()
+
+        assert proc.stdout is not None
+        parser = OutputParser()
+        stats: dict[str, int | float] = {}
+        try:
+            while chunk := proc.stdout.read1(64 * 1024):
+                for event in parser.feed(chunk):
+                    self._emit(event, stats)
+            for event in parser.close():
+                self._emit(event, stats)
+        finally:
+            proc.stdout.close()
+            if throttle is not None:
+                # resumes rsync first, or a paused one would never exit
+                throttle.stop()
+            returncode = proc.wait()
+        return RsyncResult(returncode, stats)
+
+    def _emit(self, event: Event, stats: dict[str, int | float]):
+        if isinstance(event, StatsEvent):
+            stats[event.key] = event.value
+        for listener in self.listeners:
+            listener(event)
+
 
-    def execute(self) -> None:
-        print(" ".join(self.args))
-        _ = subprocess.run(self.args)
+def _feed(pipe: IO[bytes], data: bytes | None):
+    # rsync may exit before it read everything; closing flushes, so it can
+    # hit the broken pipe as well
+    try:
+        _ = pipe.write(data or b"")
+        pipe.close()
+    except BrokenPipeError:
+        pass
@@ -0,0 +1,56 @@
+import os
+import shlex
+import subprocess
+
+from .enums import Direction
+
+# the file list comes in on stdin; it already holds every wanted path, so
+# tar must not add what else lives in a listed directory
+TAR_CREATE = "tar -cf - --null --no-recursion -T - | gzip -1"
+# like rsync's --update, whatever is newer on the receiver stays
+TAR_EXTRACT = "tar -xzpf - --keep-newer-files --warning=no-ignore-newer"
+
+
+def seed_needed(local: str) -> bool:
+    # nothing there yet, so rsync's per-file checks would only cost time
+    if not os.path.lexists(local):
+        return True
+    return os.path.isdir(local) and not os.listdir(local)
+
+
+def seed(
+    direction: Direction,
+    ssh: list[str],
+    local_parent: str,
+    remote_parent: str,
+    relpaths: list[str],
+) -> int:
+    remote = shlex.quote(remote_parent)
+    if direction == Direction.PULL:
+        os.makedirs(local_parent, exist_ok=True)
+        create = [*ssh, f"cd {remote} && {TAR_CREATE}"]
+        extract = ["sh", "-c", TAR_EXTRACT]
+        create_cwd, extract_cwd = None, local_parent
+    else:
+        create = ["sh", "-c", TAR_CREATE]
+        extract = [*ssh, f"mkdir -p {remote} && cd {remote} && {TAR_EXTRACT}"]
+        create_cwd, extract_cwd = local_parent, None
+
+    producer = subprocess.Popen(
+        create, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=create_cwd
+    )
+    consumer = subprocess.Popen(extract, stdin=producer.stdout, cwd=extract_cwd)
+    assert producer.stdin is not None and producer.stdout is not None
+    # the consumer holds its own copy; ours would keep the pipe open if it dies
+    producer.stdout.close()
+    # tar's output goes straight to the consumer, so nothing stalls while the
+    # whole list is written here
+    try:
+        with producer.stdin:
+            for path in relpaths:
+                _ = producer.stdin.write(os.fsencode(path) + b"\0")
+    except BrokenPipeError:
+        pass
+
+    returncodes = [consumer.wait(), producer.wait()]
+    return next((code for code in returncodes if code != 0), 0)
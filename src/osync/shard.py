@@ -0,0 +1,73 @@
+import heapq
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .filter_matcher import FilterMatcher
+
+# Bytes-equivalent cost charged per file, so that trees of many tiny files
+# are weighed against the per-file round trips rsync pays for them
+PER_FILE_COST = 64 * 1024
+
+_WILDCARDS = "*?["
+
+
+def transfer_prefix(source: str) -> str:
+    if source.endswith("/"):
+        return ""
+    return os.path.basename(source) + "/"
+
+
+def escape_pattern(name: str) -> str:
+    if not any(char in name for char in _WILDCARDS):
+        return name
+    return "".join("\\" + char if char in _WILDCARDS + "\\" else char for char in name)
+
+
+def _weight(entry: os.DirEntry[str], relpath: str, matcher: "FilterMatcher") -> int:
+    from .filter_matcher import walk
+
+    is_dir = entry.is_dir(follow_symlinks=False)
+    if not matcher.included(relpath, is_dir):
+        return 0
+    if not is_dir:
+        return entry.stat(follow_symlinks=False).st_size + PER_FILE_COST
+
+    weight = PER_FILE_COST
+    for walked in walk(entry.path, matcher, relpath + "/"):
+        weight += PER_FILE_COST
+        if not walked.is_dir:
+            try:
+                weight += os.lstat(walked.path).st_size
+            except OSError:
+                pass
+    return weight
+
+
+def plan_shards(
+    source: str, jobs: int, matcher: "FilterMatcher | None" = None
+) -> list[list[str]]:
+    from .filter_matcher import FilterMatcher
+
+    matcher = matcher or FilterMatcher([])
+    prefix = transfer_prefix(source)
+    with os.scandir(source) as entries:
+        weights = [(_weight(e, prefix + e.name, matcher), e.name) for e in entries]
+    # only what the filters let through is weighed, and what they leave out
+    # needs no worker at all
+    weighted = sorted((pair for pair in weights if pair[0]), reverse=True)
+
+    shards: list[tuple[int, int, list[str]]] = [
+        (0, i, []) for i in range(min(jobs, len(weighted)))
+    ]
+    for weight, name in weighted:
+        load, index, names = heapq.heappop(shards)
+        names.append(name)
+        heapq.heappush(shards, (load + weight, index, names))
+
+    return [names for _, _, names in sorted(shards, key=lambda s: s[1]) if names]
+
+
+def shard_excludes(source: str, names: list[str]) -> list[str]:
+    prefix = "/" + transfer_prefix(source)
+    return [f"--exclude={prefix}{escape_pattern(name)}" for name in names]
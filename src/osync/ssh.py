@@ -0,0 +1,81 @@
+import hashlib
+import os
+import shlex
+import subprocess
+from dataclasses import dataclass, field
+
+from .dirs import runtime_dir
+
+DEFAULT_PERSIST = 600
+
+
+@dataclass
+class SshMaster:
+    host: str
+    socket_dir: str = field(default_factory=lambda: runtime_dir("ssh"))
+    persist: int = DEFAULT_PERSIST
+    ssh: str = "ssh"
+
+    @property
+    def socket(self) -> str:
+        # hashed, because unix socket paths are limited to ~100 bytes
+        digest = hashlib.sha1(self.host.encode()).hexdigest()[:16]
+        return os.path.join(self.socket_dir, digest)
+
+    def command(self) -> list[str]:
+        return [
+            self.ssh,
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={self.socket}",
+            "-o",
+            f"ControlPersist={self.persist}",
+        ]
+
+    def transport_args(self) -> list[str]:
+        return ["-e", shlex.join(self.command())]
+
+    def _control(self, operation: str) -> bool:
+        proc = subprocess.run(
+            [self.ssh, "-S", self.socket, "-O", operation, self.host],
+            capture_output=True,
+        )
+        return proc.returncode == 0
+
+    def check(self) -> bool:
+        return os.path.exists(self.socket) and self._control("check")
+
+    def prepare(self):
+        # a master that died leaves its socket behind, which would make every
+        # later ssh silently give up on multiplexing
+        if os.path.exists(self.socket) and not self._control("check"):
+            os.unlink(self.socket)
+        with open(self.socket + ".host", "w") as f:
+            _ = f.write(self.host)
+
+    def close(self) -> bool:
+        closed = self.check() and self._control("exit")
+        if os.path.exists(self.socket + ".host"):
+            os.unlink(self.socket + ".host")
+        return closed
+
+
+def known_masters(socket_dir: str | None = None, ssh: str = "ssh") -> list[SshMaster]:
+    socket_dir = socket_dir or runtime_dir("ssh")
+    masters: list[SshMaster] = []
+    for name in sorted(os.listdir(socket_dir)):
+        if not name.endswith(".host"):
+            continue
+        with open(os.path.join(socket_dir, name)) as f:
+            masters.append(SshMaster(f.read(), socket_dir=socket_dir, ssh=ssh))
+    return masters
+
+
+def connections(action: str, socket_dir: str | None = None, ssh: str = "ssh"):
+    for master in known_masters(socket_dir, ssh):
+        if action == "close":
+            status = "closed" if master.close() else "not running"
+        else:
+            status = "alive" if master.check() else "dead"
+        print(f"{master.host}\t{status}\t{master.socket}")
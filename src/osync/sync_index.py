@@ -0,0 +1,98 @@
+import hashlib
+import os
+import sqlite3
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from .dirs import cache_dir
+from .filter_matcher import WalkEntry
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    target TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    PRIMARY KEY (target, path)
+) WITHOUT ROWID
+"""
+
+
+@dataclass(frozen=True)
+class FileState:
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @classmethod
+    def from_stat(cls, st: os.stat_result) -> "FileState":
+        return cls(st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+@dataclass
+class IndexDiff:
+    changed: dict[str, FileState] = field(default_factory=lambda: {})
+    removed: list[str] = field(default_factory=lambda: [])
+
+    @property
+    def paths(self) -> list[str]:
+        return sorted(self.changed)
+
+
+def index_path(config_path: str, directory: str | None = None) -> str:
+    # one database per osync.yaml, kept out of the tree being synced: there it
+    # would show up as changed on every walk and could be pushed mid-write
+    digest = hashlib.sha1(os.path.abspath(config_path).encode()).hexdigest()
+    return os.path.join(directory or cache_dir("index"), digest + ".sqlite")
+
+
+class SyncIndex:
+    def __init__(self, path: str, target: str):
+        self.path: str = path
+        self.target: str = target
+        self._conn: sqlite3.Connection = sqlite3.connect(path)
+        _ = self._conn.execute(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def load(self) -> dict[str, FileState]:
+        rows = self._conn.execute(
+            "SELECT path, size, mtime_ns, inode FROM entries WHERE target = ?",
+            (self.target,),
+        )
+        return {
+            path: FileState(size, mtime, inode) for path, size, mtime, inode in rows
+        }
+
+    def diff(self, entries: Iterable[WalkEntry]) -> IndexDiff:
+        known = self.load()
+        result = IndexDiff()
+        for entry in entries:
+            try:
+                state = FileState.from_stat(os.lstat(entry.path))
+            except OSError:
+                continue
+            if entry.is_dir:
+                # a directory's size is meaningless, only its mtime tracks changes
+                state = FileState(0, state.mtime_ns, state.inode)
+            if known.pop(entry.relpath, None) != state:
+                result.changed[entry.relpath] = state
+        result.removed = sorted(known)
+        return result
+
+    def commit(self, diff: IndexDiff):
+        # one transaction, so an interrupted run never leaves a half-updated index
+        with self._conn:
+            _ = self._conn.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (
+                    (self.target, path, s.size, s.mtime_ns, s.inode)
+                    for path, s in diff.changed.items()
+                ),
+            )
+            _ = self._conn.executemany(
+                "DELETE FROM entries WHERE target = ? AND path = ?",
+                ((self.target, path) for path in diff.removed),
+            )
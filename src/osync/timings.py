@@ -0,0 +1,44 @@
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+
+class Timings:
+    def __init__(self, started: float | None = None):
+        self.started: float = started if started is not None else time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+        self.calls: dict[str, int] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        # phases that run once per path add up under one line
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            for i, (existing, total) in enumerate(self.phases):
+                if existing == name:
+                    self.phases[i] = (name, total + seconds)
+                    return
+            self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def report(self) -> str:
+        names = [
+            name if self.calls.get(name, 1) == 1 else f"{name} (x{self.calls[name]})"
+            for name, _ in self.phases
+        ]
+        width = max((len(name) for name in names), default=0)
+        lines = [
+            f"{name:<{width}}  {s * 1000:8.2f} ms"
+            for name, (_, s) in zip(names, self.phases)
+        ]
+        total = time.perf_counter() - self.started
+        lines.append(f"{'total':<{width}}  {total * 1000:8.2f} ms")
+        return "\n".join(lines)
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import subprocess
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING
+
+from .dirs import cache_dir, write_json_atomically
+from .enums import Direction
+
+if TYPE_CHECKING:
+    from .config_cache import FilterGroupLike
+
+# compressing these again only burns CPU on both ends
+COMPRESSED_EXTENSIONS = (
+    "7z bz2 deb gz jar jpeg jpg lz4 lzma mkv mov mp3 mp4 ogg pdf png rar rpm"
+    + " tbz tgz webm webp whl xz zip zst"
+).split()
+PROBE_BYTES = 4 * 1024**2
+PINGS = 3
+DEFAULT_LINK_TTL = 24 * 3600
+SAMPLE_FILES = 2000
+# at these speeds rsync's delta search costs more than just sending the file
+LAN_THROUGHPUT = 50 * 1024**2
+LAN_RTT = 0.002
+SLOW_THROUGHPUT = 2 * 1024**2
+COMPRESSIBLE_SHARE = 0.5
+LARGE_AVERAGE = 64 * 1024**2
+# rsync refuses anything bigger
+MAX_BLOCK_SIZE = 128 * 1024
+
+
+@dataclass(frozen=True)
+class Link:
+    rtt: float
+    throughput: float
+    measured: float
+
+    @property
+    def lan(self) -> bool:
+        return self.throughput >= LAN_THROUGHPUT and self.rtt <= LAN_RTT
+
+    def to_json(self) -> dict[str, float]:
+        return {
+            "rtt": self.rtt,
+            "throughput": self.throughput,
+            "measured": self.measured,
+        }
+
+    @classmethod
+    def from_json(cls, raw: dict[str, float]) -> "Link":
+        return cls(float(raw["rtt"]), float(raw["throughput"]), float(raw["measured"]))
+
+
+def _timed(ssh: list[str], command: str, data: bytes = b"") -> float:
+    start = time.monotonic()
+    proc = subprocess.run([*ssh, command], input=data, capture_output=True)
+    if proc.returncode != 0:
+        message = proc.stderr.decode(errors="replace").strip()
+        raise RuntimeError(f"Probing the link failed: {message}")
+    return time.monotonic() - start
+
+
+def probe(ssh: list[str], probe_bytes: int = PROBE_BYTES, pings: int = PINGS) -> Link:
+    # the quickest of a few empty round trips is the latency, and random bytes
+    # keep ssh's own compression from flattering the throughput
+    rtt = min(_timed(ssh, "true") for _ in range(pings))
+    elapsed = _timed(ssh, "cat > /dev/null", os.urandom(probe_bytes)) - rtt
+    return Link(rtt, probe_bytes / max(elapsed, 1e-6), time.time())
+
+
+class LinkCache:
+    # what a host's link measured, so only the first run pays for the probe
+    def __init__(
+        self,
+        directory: str | None = None,
+        ttl: float = DEFAULT_LINK_TTL,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.directory: str = directory or cache_dir("links")
+        self.ttl: float = ttl
+        self.clock: Callable[[], float] = clock
+
+    def path(self, host: str) -> str:
+        return os.path.join(
+            self.directory, hashlib.sha1(host.encode()).hexdigest() + ".json"
+        )
+
+    def load(self, host: str) -> Link | None:
+        try:
+            with open(self.path(host)) as f:
+                raw = json.load(f)  # pyright:ignore[reportAny]
+            if raw["host"] != host:
+                return None
+            link = Link.from_json(raw)  # pyright:ignore[reportAny]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if self.clock() - link.measured > self.ttl:
+            return None
+        return link
+
+    def get(
+        self, host: str, measure: Callable[[], Link], refresh: bool = False
+    ) -> Link:
+        link = None if refresh else self.load(host)
+        if link is None:
+            link = measure()
+            write_json_atomically(self.path(host), {"host": host, **link.to_json()})
+        return link
+
+
+@dataclass(frozen=True)
+class FileMix:
+    files: int = 0
+    size: int = 0
+    compressed: int = 0
+
+    @property
+    def compressible_share(self) -> float:
+        return 1 - self.compressed / self.size if self.size else 0.0
+
+    @property
+    def average(self) -> float:
+        return self.size / self.files if self.files else 0.0
+
+
+def is_compressed(relpath: str) -> bool:
+    return relpath.rpartition(".")[2].lower() in COMPRESSED_EXTENSIONS
+
+
+def sample_mix(files: Iterable[tuple[str, int]], limit: int = SAMPLE_FILES) -> FileMix:
+    count = size = compressed = 0
+    for relpath, file_size in files:
+        if count == limit:
+            break
+        count += 1
+        size += file_size
+        if is_compressed(relpath):
+            compressed += file_size
+    return FileMix(count, size, compressed)
+
+
+@dataclass(frozen=True)
+class Profile:
+    # None leaves rsync's own default alone
+    whole_file: bool | None = None
+    compress: bool | None = None
+    compress_level: int | None = None
+    block_size: int | None = None
+
+    @property
+    def rsync_args(self) -> list[str]:
+        args: list[str] = []
+        if self.whole_file is not None:
+            args.append("--whole-file" if self.whole_file else "--no-whole-file")
+        if self.compress:
+            args.append("--compress")
+            if self.compress_level is not None:
+                args.append(f"--compress-level={self.compress_level}")
+            args.append(f"--skip-compress={'/'.join(COMPRESSED_EXTENSIONS)}")
+        elif self.compress is not None:
+            args.append("--no-compress")
+        if self.block_size is not None and not self.whole_file:
+            args.append(f"--block-size={min(self.block_size, MAX_BLOCK_SIZE)}")
+        return args
+
+    def describe(self) -> str:
+        method = "whole files" if self.whole_file else "deltas"
+        if self.block_size is not None and not self.whole_file:
+            method += f" ({self.block_size // 1024} KiB blocks)"
+        if not self.compress:
+            return f"{method}, uncompressed"
+        if self.compress_level is None:
+            return f"{method}, compressed"
+        return f"{method}, compressed at level {self.compress_level}"
+
+
+def choose(link: Link, mix: FileMix) -> Profile:
+    if link.lan:
+        # the wire is faster than either end can search for deltas or compress
+        return Profile(whole_file=True, compress=False)
+    compress = mix.compressible_share >= COMPRESSIBLE_SHARE
+    return Profile(
+        whole_file=False,
+        compress=compress,
+        # a slow link is worth the extra CPU for a better ratio
+        compress_level=(6 if link.throughput < SLOW_THROUGHPUT else 1)
+        if compress
+        else None,
+        # fewer checksums to exchange for big files
+        block_size=MAX_BLOCK_SIZE if mix.average >= LARGE_AVERAGE else None,
+    )
+
+
+def transfer_args(
+    direction: Direction,
+    filter_groups: "list[FilterGroupLike]",
+    profile: Profile | None = None,
+) -> list[str]:
+    # what a filter group sets for its direction wins over what was measured;
+    # as with filter rules, the first group that sets something does
+    tuned = profile or Profile()
+    for group in reversed(filter_groups):
+        if Direction(group.direction) != Direction(direction):
+            continue
+        if group.compress is not None:
+            tuned = replace(tuned, compress=group.compress)
+        if group.whole_file is not None:
+            tuned = replace(tuned, whole_file=group.whole_file)
+        if group.block_size is not None:
+            tuned = replace(tuned, block_size=group.block_size)
+    return tuned.rsync_args
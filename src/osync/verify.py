@@ -0,0 +1,143 @@
+import hashlib
+import os
+import shlex
+import sqlite3
+import stat
+import subprocess
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from .dirs import cache_dir
+
+CHUNK_SIZE = 1024 * 1024
+# b2sum computes the same digest as hashlib's default blake2b; -z keeps file
+# names unescaped and NUL-terminated
+REMOTE_HASH = "xargs -0 b2sum -z --"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (dev, inode)
+) WITHOUT ROWID
+"""
+
+
+def hash_file(path: str) -> str | None:
+    digest = hashlib.blake2b()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class HashCache:
+    # keyed by inode, and only trusted while size and mtime still match
+    def __init__(self, path: str | None = None):
+        self.path: str = path or os.path.join(cache_dir(), "hashes.sqlite")
+        self._conn: sqlite3.Connection = sqlite3.connect(self.path)
+        _ = self._conn.execute(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def get(self, st: os.stat_result) -> str | None:
+        row = self._conn.execute(
+            "SELECT digest FROM hashes"
+            + " WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+            (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns),
+        ).fetchone()
+        return None if row is None else str(row[0])  # pyright:ignore[reportAny]
+
+    def put(self, entries: Iterable[tuple[os.stat_result, str]]):
+        with self._conn:
+            _ = self._conn.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                (
+                    (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, digest)
+                    for st, digest in entries
+                ),
+            )
+
+
+def local_hashes(
+    parent: str, relpaths: list[str], cache: HashCache, jobs: int | None = None
+) -> dict[str, str]:
+    hashes: dict[str, str] = {}
+    missing: list[tuple[str, os.stat_result]] = []
+    for relpath in relpaths:
+        try:
+            st = os.stat(os.path.join(parent, relpath))
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        cached = cache.get(st)
+        if cached is not None:
+            hashes[relpath] = cached
+        else:
+            missing.append((relpath, st))
+    if not missing:
+        return hashes
+
+    from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing
+
+    paths = [os.path.join(parent, relpath) for relpath, _ in missing]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        digests = list(pool.map(hash_file, paths, chunksize=64))
+
+    fresh = [
+        (relpath, st, digest)
+        for (relpath, st), digest in zip(missing, digests)
+        if digest is not None
+    ]
+    cache.put((st, digest) for _, st, digest in fresh)
+    hashes.update((relpath, digest) for relpath, _, digest in fresh)
+    return hashes
+
+
+def parse_hash_output(output: bytes) -> dict[str, str]:
+    hashes: dict[str, str] = {}
+    for record in output.split(b"\0"):
+        digest, sep, path = record.partition(b"  ")
+        if sep:
+            hashes[os.fsdecode(path)] = digest.decode()
+    return hashes
+
+
+def remote_hashes(ssh: list[str], parent: str, relpaths: list[str]) -> dict[str, str]:
+    # one round trip: the whole list goes over stdin and xargs batches it
+    remote = f"cd {shlex.quote(parent)} && {REMOTE_HASH}"
+    proc = subprocess.run(
+        [*ssh, remote],
+        input=b"".join(os.fsencode(path) + b"\0" for path in relpaths),
+        capture_output=True,
+    )
+    # xargs exits 123 when some files could not be hashed, e.g. missing ones
+    if proc.returncode not in (0, 123):
+        message = proc.stderr.decode(errors="replace").strip()
+        raise RuntimeError(f"Hashing on the remote failed: {message}")
+    return parse_hash_output(proc.stdout)
+
+
+@dataclass
+class Verification:
+    checked: int = 0
+    differ: list[str] = field(default_factory=lambda: [])
+
+
+def compare(
+    relpaths: list[str], local: dict[str, str], remote: dict[str, str]
+) -> Verification:
+    differ = [
+        path
+        for path in relpaths
+        if local.get(path) is None or local.get(path) != remote.get(path)
+    ]
+    return Verification(len(relpaths), differ)
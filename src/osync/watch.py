@@ -0,0 +1,191 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from collections.abc import Callable
+from dataclasses import replace
+
+from .filter_matcher import FilterMatcher, transfer_root, walk
+from .rsync import RsyncCommand
+from .shard import transfer_prefix
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# IN_MODIFY is left out on purpose: it fires for every write() of a file being
+# saved, while IN_CLOSE_WRITE fires once when the writer is done
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch  # pyright:ignore[reportAny]
+        self.fd: int = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)  # pyright:ignore[reportAny]
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd: int = self._add_watch(self.fd, os.fsencode(path), mask)  # pyright:ignore[reportAny]
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def read(self) -> list[tuple[int, int, str]]:
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events: list[tuple[int, int, str]] = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _cookie, length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(buffer[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Debouncer:
+    def __init__(
+        self,
+        delay: float,
+        max_delay: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.delay: float = delay
+        self.max_delay: float = max_delay
+        self.clock: Callable[[], float] = clock
+        self.pending: set[str] = set()
+        self._first: float = 0.0
+        self._last: float = 0.0
+
+    def add(self, paths: set[str]):
+        if not paths:
+            return
+        now = self.clock()
+        if not self.pending:
+            self._first = now
+        self._last = now
+        self.pending |= paths
+
+    def timeout(self) -> float | None:
+        if not self.pending:
+            return None
+        due = min(self._last + self.delay, self._first + self.max_delay)
+        return max(0.0, due - self.clock())
+
+    def drain(self) -> list[str]:
+        paths, self.pending = sorted(self.pending), set()
+        return paths
+
+
+class Watcher:
+    def __init__(
+        self,
+        source: str,
+        matcher: FilterMatcher,
+        debounce: float = 0.2,
+        max_delay: float = 2.0,
+    ):
+        self.source: str = source
+        self.matcher: FilterMatcher = matcher
+        # every directory needs its watch, even one still too empty to be
+        # transferred under --prune-empty-dirs
+        self._traverse: FilterMatcher = FilterMatcher(matcher.rules)
+        self.debouncer: Debouncer = Debouncer(debounce, max_delay)
+        self.inotify: Inotify = Inotify()
+        self._dirs: dict[int, tuple[str, str]] = {}
+        self._watch_tree(source, transfer_prefix(source))
+
+    def close(self):
+        self.inotify.close()
+
+    def _watch_tree(self, path: str, relprefix: str) -> set[str]:
+        self._dirs[self.inotify.add_watch(path)] = (path, relprefix)
+        found: set[str] = set()
+        for entry in walk(path, self._traverse, relprefix):
+            if entry.is_dir:
+                wd = self.inotify.add_watch(entry.path)
+                self._dirs[wd] = (entry.path, entry.relpath + "/")
+                if self.matcher.prune_empty_dirs:
+                    # the files in it bring it along
+                    continue
+            found.add(entry.relpath)
+        return found
+
+    def _rescan(self) -> set[str]:
+        return {entry.relpath for entry in walk(self.source, self.matcher)}
+
+    def _handle(self, events: list[tuple[int, int, str]]) -> set[str]:
+        changed: set[str] = set()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                changed |= self._rescan()
+                continue
+            if mask & IN_IGNORED:
+                _ = self._dirs.pop(wd, None)
+                continue
+            if wd not in self._dirs or not name:
+                continue
+            path, relprefix = self._dirs[wd]
+            relpath = relprefix + name
+            is_dir = bool(mask & IN_ISDIR)
+            if not self.matcher.included(relpath, is_dir):
+                continue
+            if not (is_dir and self.matcher.prune_empty_dirs):
+                changed.add(relpath)
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                # files may land in a new directory before its watch exists
+                changed |= self._watch_tree(os.path.join(path, name), relpath + "/")
+        return changed
+
+    def poll(self, timeout: float | None = None) -> list[str] | None:
+        wait = self.debouncer.timeout()
+        if wait is None or (timeout is not None and timeout < wait):
+            wait = timeout
+        ready, _, _ = select.select([self.inotify.fd], [], [], wait)
+        if ready:
+            self.debouncer.add(self._handle(self.inotify.read()))
+        if self.debouncer.timeout() == 0.0:
+            return self.debouncer.drain()
+        return None
+
+
+def watch(command: RsyncCommand, debounce: float):
+    matcher = FilterMatcher.from_args(command.filter_args())
+    watcher = Watcher(command.source, matcher, debounce)
+    root = transfer_root(command.source)
+    print(f"Watching {command.source}")
+    try:
+        while True:
+            batch = watcher.poll()
+            if batch is None:
+                continue
+            batch = [p for p in batch if os.path.lexists(os.path.join(root, p))]
+            if not batch:
+                continue
+            push = replace(command, files_from=batch)
+            push.build()
+            _ = push.execute()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
@@ -1,17 +1,121 @@
+import asyncio
+import hashlib
+import io
+import json
 import os
 import shutil
+import signal
+import stat
+import subprocess
+import sys
 import tempfile
+import threading
+import time
 import unittest
 from dataclasses import dataclass
 from pathlib import Path
 from typing import override
 from unittest.mock import patch
 
-from osync import cli
-from osync.filter_group import Direction, FilterGroup
-from osync.findup import findup
+import osync
+from osync import aio, app, cli
+from osync.bandwidth import (
+    Bandwidth,
+    BandwidthLedger,
+    BandwidthPolicy,
+    Throttle,
+    parse_rate,
+)
+from osync.batch import (
+    SyncTarget,
+    coalesce,
+    expand_paths,
+    parent_dest,
+    resolve_targets,
+)
+from osync.config_cache import (
+    CompiledFilterGroup,
+    load_config_cached,
+    load_filter_groups_cached,
+    load_tree_config_cached,
+)
+from osync.daemon import (
+    Daemon,
+    Job,
+    JobKey,
+    Subscriber,
+    execute_job,
+    forward,
+    forwardable,
+)
+from osync.fanout import (
+    RemoteResult,
+    fan_out,
+    format_fan_out,
+    retarget,
+    stragglers,
+)
+from osync.filter_compiler import ALL_DIRS, compile_filters, parent_includes
+from osync.filter_group import Direction, FilterGroup, Kind
+from osync.filter_matcher import FilterMatcher, Rule, transfer_root, walk
+from osync.findup import findall, findup
+from osync.journal import PARTIAL_ARGS, Journal, journal_key, load_journal
+from osync.large_files import (
+    LargeFile,
+    LargeFileLane,
+    RangeState,
+    lane_excludes,
+    parse_size,
+    ranges,
+)
+from osync.manifest import (
+    Manifest,
+    ManifestCache,
+    ManifestEntry,
+    ManifestRefresher,
+    fetch_manifest,
+    parse_list_line,
+    plan_status,
+)
+from osync.metrics import Metrics, add_hook, emit, remove_hook, timed
+from osync.moves import ContentIndex, Move, apply_moves, detect_moves
 from osync.path_resolver import PathResolver
-from osync.rsync import RsyncCommand
+from osync.progress import (
+    ConsoleReporter,
+    FileEvent,
+    JsonReport,
+    LogEvent,
+    OutputParser,
+    ProgressEvent,
+    StatsEvent,
+    parse_line,
+    parse_stats,
+)
+from osync.rsync import RsyncCommand, RsyncResult
+from osync.seed import seed, seed_needed
+from osync.shard import escape_pattern, plan_shards, shard_excludes
+from osync.ssh import SshMaster, known_masters
+from osync.sync_index import SyncIndex, index_path
+from osync.timings import Timings
+from osync.tune import (
+    FileMix,
+    Link,
+    LinkCache,
+    Profile,
+    choose,
+    probe,
+    sample_mix,
+    transfer_args,
+)
+from osync.verify import (
+    HashCache,
+    compare,
+    hash_file,
+    local_hashes,
+    parse_hash_output,
+    remote_hashes,
+)
+from osync.watch import Debouncer, Watcher
 
 
 # ---
@@ -22,13 +126,13 @@ class TestCLI(unittest.TestCase):
         args = cli.main(["--push", "some/path"])
         self.assertTrue(args.push)
         self.assertFalse(args.pull)
-        self.assertEqual(args.path, "some/path")
+        self.assertEqual(args.paths, ["some/path"])
 
     def test_pull_argument(self):
         args = cli.main(["--pull", "another/path"])
         self.assertTrue(args.pull)
         self.assertFalse(args.push)
-        self.assertEqual(args.path, "another/path")
+        self.assertEqual(args.paths, ["another/path"])
 
     def test_force_argument(self):
         args = cli.main(["--push", "--force", "foo/bar"])
@@ -46,6 +150,134 @@ class TestCLI(unittest.TestCase):
         args = cli.main(["--push", "foo/bar"])
         self.assertFalse(args.dry_run)
 
+    def test_jobs_argument(self):
+        args = cli.main(["--push", "--jobs", "4", "foo/bar"])
+        self.assertEqual(args.jobs, 4)
+
+    def test_nojobs_argument(self):
+        args = cli.main(["--push", "foo/bar"])
+        self.assertEqual(args.jobs, 1)
+
+    def test_parses_do_not_share_lists(self):
+        self.assertIsNot(cli.Args().remotes, cli.Args().remotes)
+        self.assertIsNot(cli.Args().paths, cli.Args().paths)
+
+    def test_jobs_cannot_shard_a_pull(self):
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--pull", "--jobs", "4", "foo/bar"])
+        args = cli.main(["--pull", "--jobs", "4", "foo/bar", "foo/baz"])
+        self.assertEqual(args.jobs, 4)
+
+    def test_localfilter_argument(self):
+        args = cli.main(["--push", "--local-filter", "foo/bar"])
+        self.assertTrue(args.local_filter)
+
+    def test_localfilter_needs_push(self):
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--pull", "--local-filter", "foo/bar"])
+
+    def test_incremental_argument(self):
+        args = cli.main(["--push", "--incremental", "foo/bar"])
+        self.assertTrue(args.incremental)
+
+    def test_incremental_needs_push(self):
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--pull", "--incremental", "foo/bar"])
+
+    def test_watch_argument(self):
+        args = cli.main(["--push", "--watch", "--debounce", "0.5", "foo/bar"])
+        self.assertTrue(args.watch)
+        self.assertEqual(args.debounce, 0.5)
+
+    def test_watch_needs_push(self):
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--pull", "--watch", "foo/bar"])
+
+    def test_connections_argument(self):
+        self.assertEqual(cli.main(["--connections"]).connections, "list")
+        self.assertEqual(cli.main(["--connections", "close"]).connections, "close")
+
+    def test_path_required_for_sync(self):
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--push"])
+
+    def test_multiple_paths(self):
+        args = cli.main(["--push", "a", "b", "-"])
+        self.assertEqual(args.paths, ["a", "b", "-"])
+
+    def test_watch_needs_single_path(self):
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--push", "--watch", "a", "b"])
+
+    def test_timings_argument(self):
+        self.assertTrue(cli.main(["--push", "--timings", "a"]).timings)
+
+    def test_status_argument(self):
+        args = cli.main(["--status", "--refresh", "--manifest-ttl", "60", "a"])
+        self.assertTrue(args.status)
+        self.assertTrue(args.refresh)
+        self.assertEqual(args.manifest_ttl, 60)
+
+    def test_metrics_argument(self):
+        args = cli.main(
+            ["--push", "--metrics", "m.prom", "--metrics-format", "prometheus", "a"]
+        )
+        self.assertEqual(args.metrics, "m.prom")
+        self.assertEqual(args.metrics_format, "prometheus")
+
+    def test_verify_argument(self):
+        self.assertTrue(cli.main(["--pull", "--verify", "a"]).verify)
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--push", "--verify", "--watch", "a"])
+
+    def test_resume_argument(self):
+        self.assertTrue(cli.main(["--pull", "--resume", "a"]).resume)
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--push", "--resume", "--incremental", "a"])
+
+    def test_remote_arguments(self):
+        args = cli.main(["--push", "--remote", "a@one", "--remote", "b@two", "x"])
+        self.assertEqual(args.remotes, ["a@one", "b@two"])
+        self.assertEqual(
+            cli.main(["--pull", "--remote", "a@one", "x"]).remotes, ["a@one"]
+        )
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--pull", "--remote", "a@one", "--remote", "b@two", "x"])
+
+    def test_detect_moves_needs_push(self):
+        self.assertTrue(cli.main(["--push", "--detect-moves", "a"]).detect_moves)
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--pull", "--detect-moves", "a"])
+
+    def test_seed_argument(self):
+        self.assertTrue(cli.main(["--pull", "--seed", "a"]).seed)
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--pull", "--seed", "--dry-run", "a"])
+
+    def test_large_files_argument(self):
+        args = cli.main(["--push", "--large-files", "1G", "--streams", "8", "a"])
+        self.assertEqual(args.large_files, 1024**3)
+        self.assertEqual(args.streams, 8)
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--push", "--large-files", "big", "a"])
+
+    def test_auto_tune_argument(self):
+        self.assertTrue(cli.main(["--pull", "--auto-tune", "a"]).auto_tune)
+        with self.assertRaises(SystemExit):
+            _ = cli.main(
+                ["--push", "--auto-tune", "--remote", "a@one", "--remote", "b@two", "x"]
+            )
+
+    def test_refresh_needs_status(self):
+        with self.assertRaises(SystemExit):
+            _ = cli.main(["--push", "--refresh", "a"])
+
+    def test_explain_filters_needs_no_path(self):
+        self.assertTrue(cli.main(["--push", "--explain-filters"]).explain_filters)
+
+    def test_no_daemon_argument(self):
+        self.assertTrue(cli.main(["--push", "--no-daemon", "a"]).no_daemon)
+
     def test_mutually_exclusive(self):
         with self.assertRaises(SystemExit):
             _ = cli.main(["--push", "--pull", "foo"])
@@ -112,6 +344,441 @@ class TestFilterGroup_MultiplPatternsToRsyncArgs(unittest.TestCase):
         self.assertEqual(fp.rsync_args, expected)
 
 
+# ------------
+# CONFIG_CACHE
+# ------------
+CONFIG = """
+- direction: push
+  kind: include
+  patterns: ["a", "b"]
+"""
+
+
+BANDWIDTH_CONFIG = """
+bandwidth:
+  budget: 10M
+  priority: {pull: 3}
+filter_groups:
+  - direction: push
+    kind: include
+    patterns: ["a"]
+    priority: 5
+"""
+
+
+class TestConfigCache(unittest.TestCase):
+    base_dir: str = ""
+    config: str = ""
+    cache: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.config = os.path.join(self.base_dir, "osync.yaml")
+        self.cache = os.path.join(self.base_dir, "cache")
+        os.mkdir(self.cache)
+        with open(self.config, "w") as f:
+            _ = f.write(CONFIG)
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_miss_then_hit(self):
+        groups, hit = load_filter_groups_cached(self.config, self.cache)
+        self.assertFalse(hit)
+        self.assertEqual(
+            groups, [CompiledFilterGroup(Direction.PUSH, Kind.INCLUDE, ["a", "b"])]
+        )
+
+        with patch("osync.filter_group.load_config") as load:
+            cached, hit = load_filter_groups_cached(self.config, self.cache)
+        self.assertTrue(hit)
+        load.assert_not_called()
+        self.assertEqual(cached, groups)
+        self.assertEqual(cached[0].rsync_args, ["--include=a", "--include=b"])
+
+    def test_changed_config_is_revalidated(self):
+        _ = load_filter_groups_cached(self.config, self.cache)
+        with open(self.config, "w") as f:
+            _ = f.write(CONFIG.replace('"b"', '"c", "d"'))
+
+        groups, hit = load_filter_groups_cached(self.config, self.cache)
+        self.assertFalse(hit)
+        self.assertEqual(groups[0].patterns, ["a", "c", "d"])
+
+    def test_bandwidth_section_is_cached(self):
+        with open(self.config, "w") as f:
+            _ = f.write(BANDWIDTH_CONFIG)
+        config, _ = load_config_cached(self.config, self.cache)
+        cached, hit = load_config_cached(self.config, self.cache)
+
+        self.assertTrue(hit)
+        self.assertEqual(cached, config)
+        self.assertEqual(config.bandwidth, BandwidthPolicy(10240, {Direction.PULL: 3}))
+        self.assertEqual(config.filter_groups[0].priority, 5)
+
+    def test_transfer_settings_are_cached(self):
+        with open(self.config, "w") as f:
+            _ = f.write(CONFIG + "  compress: false\n  block_size: 64K\n")
+        config, _ = load_config_cached(self.config, self.cache)
+        cached, hit = load_config_cached(self.config, self.cache)
+
+        self.assertTrue(hit)
+        self.assertEqual(cached, config)
+        self.assertIs(config.filter_groups[0].compress, False)
+        self.assertIsNone(config.filter_groups[0].whole_file)
+        self.assertEqual(config.filter_groups[0].block_size, 64 * 1024)
+
+    def test_invalid_config_still_raises(self):
+        with open(self.config, "w") as f:
+            _ = f.write(CONFIG.replace("include", "bogus"))
+        with self.assertRaisesRegex(ValueError, "not a valid Kind"):
+            _ = load_filter_groups_cached(self.config, self.cache)
+
+
+class TestTreeConfig(unittest.TestCase):
+    base_dir: str = ""
+    cache: str = ""
+    cwd: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.cache = tempfile.mkdtemp()
+        self.cwd = os.path.join(self.base_dir, "repo", "sub", "deep")
+        os.makedirs(self.cwd)
+        self.write("", BANDWIDTH_CONFIG)
+        self.write("repo/sub", CONFIG)
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        shutil.rmtree(self.cache)
+
+    def write(self, directory: str, content: str):
+        with open(os.path.join(self.base_dir, directory, "osync.yaml"), "w") as f:
+            _ = f.write(content)
+
+    def test_nearest_config_comes_first(self):
+        paths, config, hit = load_tree_config_cached(self.cwd, self.cache)
+        self.assertFalse(hit)
+        self.assertEqual(
+            paths,
+            [
+                os.path.join(self.base_dir, "repo", "sub", "osync.yaml"),
+                os.path.join(self.base_dir, "osync.yaml"),
+            ],
+        )
+        self.assertEqual(
+            [g.patterns for g in config.filter_groups], [["a", "b"], ["a"]]
+        )
+        # only the outer one has a bandwidth section
+        self.assertEqual(config.bandwidth, BandwidthPolicy(10240, {Direction.PULL: 3}))
+
+    def test_repeated_lookup_skips_the_walk(self):
+        paths, config, _ = load_tree_config_cached(self.cwd, self.cache)
+        with (
+            patch("osync.config_cache.findall") as walk_up,
+            patch("osync.filter_group.load_config") as load,
+        ):
+            cached_paths, cached, hit = load_tree_config_cached(self.cwd, self.cache)
+        self.assertTrue(hit)
+        walk_up.assert_not_called()
+        load.assert_not_called()
+        self.assertEqual((cached_paths, cached), (paths, config))
+
+    def test_new_config_along_the_path_is_found(self):
+        _ = load_tree_config_cached(self.cwd, self.cache)
+        time.sleep(0.02)  # past the filesystem's timestamp granularity
+        self.write("repo", CONFIG.replace('"b"', '"c"'))
+
+        paths, config, hit = load_tree_config_cached(self.cwd, self.cache)
+        self.assertFalse(hit)
+        self.assertEqual(len(paths), 3)
+        self.assertEqual(
+            [g.patterns for g in config.filter_groups], [["a", "b"], ["a", "c"], ["a"]]
+        )
+
+    def test_edited_config_is_reloaded(self):
+        _ = load_tree_config_cached(self.cwd, self.cache)
+        self.write("repo/sub", CONFIG.replace('"b"', '"c", "d"'))
+        _, config, hit = load_tree_config_cached(self.cwd, self.cache)
+        self.assertFalse(hit)
+        self.assertEqual(config.filter_groups[0].patterns, ["a", "c", "d"])
+
+    def test_root_config_stops_the_merge(self):
+        self.write(
+            "repo/sub", "root: true\nfilter_groups:" + CONFIG.replace("\n", "\n  ")
+        )
+        paths, config, _ = load_tree_config_cached(self.cwd, self.cache)
+        self.assertEqual(len(paths), 1)
+        self.assertEqual([g.patterns for g in config.filter_groups], [["a", "b"]])
+        self.assertIsNone(config.bandwidth)
+
+    def test_no_config_raises(self):
+        with self.assertRaises(LookupError):
+            _ = load_tree_config_cached(self.cache, self.cache)
+
+
+# --------------
+# FILTER_MATCHER
+# --------------
+def matcher(*args: str):
+    return FilterMatcher.from_args(list(args))
+
+
+class TestFilterMatcher(unittest.TestCase):
+    def test_parse_args(self):
+        m = matcher("--include=a", "--exclude=b", "--verbose")
+        self.assertEqual(m.rules, [Rule(Kind.INCLUDE, "a"), Rule(Kind.EXCLUDE, "b")])
+
+    def test_no_rules_includes_everything(self):
+        self.assertTrue(matcher().included("any/thing", False))
+
+    def test_first_match_wins(self):
+        m = matcher("--include=*.py", "--exclude=*")
+        self.assertTrue(m.included("dir/a.py", False))
+        self.assertFalse(m.included("dir/a.txt", False))
+
+    def test_unanchored_matches_final_component(self):
+        m = matcher("--exclude=build")
+        self.assertFalse(m.included("build", True))
+        self.assertFalse(m.included("a/b/build", False))
+        self.assertTrue(m.included("a/build2", False))
+        self.assertTrue(m.included("build/a", False))
+
+    def test_anchored_matches_from_root_only(self):
+        m = matcher("--exclude=/build")
+        self.assertFalse(m.included("build", True))
+        self.assertTrue(m.included("a/build", True))
+
+    def test_single_star_stops_at_slash(self):
+        m = matcher("--exclude=/src/*.o")
+        self.assertFalse(m.included("src/a.o", False))
+        self.assertTrue(m.included("src/sub/a.o", False))
+
+    def test_double_star_crosses_slashes(self):
+        m = matcher("--exclude=/src/**.o")
+        self.assertFalse(m.included("src/sub/deep/a.o", False))
+
+    def test_trailing_slash_only_matches_dirs(self):
+        m = matcher("--exclude=cache/")
+        self.assertFalse(m.included("x/cache", True))
+        self.assertTrue(m.included("x/cache", False))
+
+    def test_triple_star_matches_dir_and_contents(self):
+        m = matcher("--include=/keep/***", "--exclude=*")
+        self.assertTrue(m.included("keep", True))
+        self.assertTrue(m.included("keep/a/b", False))
+        self.assertFalse(m.included("other", False))
+
+    def test_character_class_and_question_mark(self):
+        m = matcher("--include=file[0-9].?", "--exclude=*")
+        self.assertTrue(m.included("file1.c", False))
+        self.assertFalse(m.included("filex.c", False))
+
+    def test_escaped_wildcard_is_literal(self):
+        m = matcher("--exclude=a\\*b*")
+        self.assertFalse(m.included("a*bc", False))
+        self.assertTrue(m.included("axbc", False))
+
+    def test_transfer_root(self):
+        self.assertEqual(transfer_root("/x/dir"), "/x")
+        self.assertEqual(transfer_root("/x/dir/"), "/x/dir/")
+        self.assertEqual(transfer_root("host:/dir"), "host:/")
+
+
+class TestFilterMatcher_Walk(unittest.TestCase):
+    base_dir: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        for relpath in ["src/a.py", "src/b.txt", "src/deep/c.py", "build/d.py", "e.py"]:
+            path = os.path.join(self.base_dir, "proj", relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Path(path).touch()
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def walked(self, *args: str) -> set[str]:
+        source = os.path.join(self.base_dir, "proj")
+        return {e.relpath for e in walk(source, matcher(*args)) if not e.is_dir}
+
+    def test_walk_prunes_excluded_dirs(self):
+        result = self.walked("--exclude=build/")
+        self.assertEqual(
+            result,
+            {"proj/src/a.py", "proj/src/b.txt", "proj/src/deep/c.py", "proj/e.py"},
+        )
+
+    def test_walk_applies_catch_all(self):
+        result = self.walked(
+            "--include=proj/", "--include=src/", "--include=*.py", "--exclude=*"
+        )
+        self.assertEqual(result, {"proj/src/a.py", "proj/e.py"})
+
+    def test_walk_excluded_root_yields_nothing(self):
+        self.assertEqual(self.walked("--exclude=*"), set())
+
+
+# ---------------
+# FILTER_COMPILER
+# ---------------
+class TestFilterCompiler(unittest.TestCase):
+    def patterns(self, *args: str) -> list[str]:
+        return [c.rule.pattern for c in compile_filters(list(args)).rules]
+
+    def test_catch_all_is_appended(self):
+        self.assertEqual(self.patterns("--exclude=*.tmp"), ["*.tmp", "*"])
+
+    def test_passthrough_args_are_kept(self):
+        args = compile_filters(["-a", "--exclude=x"]).args
+        self.assertEqual(args, ["-a", "--exclude=x", "--exclude=*"])
+
+    def test_duplicates_are_dropped(self):
+        compiled = compile_filters(["--exclude=a", "--include=b", "--exclude=a"])
+        self.assertEqual([c.rule.pattern for c in compiled.dropped], ["a"])
+
+    def test_rules_after_catch_all_are_dropped(self):
+        compiled = compile_filters(["--exclude=*.o", "--exclude=*", "--include=*.c"])
+        self.assertEqual([c.rule.pattern for c in compiled.rules], ["*.o", "*"])
+        self.assertEqual([c.rule.pattern for c in compiled.dropped], ["*.c"])
+        self.assertFalse(compiled.prune_empty_dirs)
+
+    def test_only_runs_of_one_kind_are_reordered(self):
+        patterns = self.patterns("--exclude=*.o", "--exclude=/p/b/*.o", "--include=x")
+        self.assertEqual(patterns[:3], ["/p/b/*.o", "*.o", "x"])
+
+    def test_anchored_include_gets_parents(self):
+        self.assertEqual(
+            self.patterns("--include=/p/src/*.py"),
+            ["/p/src/*.py", "/p/", "/p/src/", "*"],
+        )
+        self.assertFalse(compile_filters(["--include=/p/src/*.py"]).prune_empty_dirs)
+
+    def test_prunes_only_with_its_own_all_dirs(self):
+        self.assertTrue(compile_filters(["--include=*.py"]).prune_empty_dirs)
+        self.assertFalse(
+            compile_filters(["--include=*/", "--include=*.py"]).prune_empty_dirs
+        )
+
+    def test_parent_includes(self):
+        def parents(pattern: str):
+            needed = parent_includes(Rule(Kind.INCLUDE, pattern))
+            return None if needed is None else [p.pattern for p in needed]
+
+        self.assertEqual(parents("/p/docs/***"), ["/p/"])
+        self.assertEqual(parents("/p/**/x.py"), ["/p/", "/p/**/"])
+        self.assertEqual(parents("/p/src/**"), ["/p/", "/p/src/", "/p/src/**/"])
+        self.assertIsNone(parents("*.py"))
+
+    def test_unanchored_include_keeps_all_dirs(self):
+        compiled = compile_filters(["--include=/p/a", "--include=*.py"])
+        self.assertIn(ALL_DIRS, [c.rule for c in compiled.rules])
+
+    def test_explain_lists_dropped_rules(self):
+        explained = compile_filters(["--exclude=a", "--exclude=a"]).explain()
+        self.assertIn("dropped", explained)
+
+
+class TestFilterCompiler_Equivalence(unittest.TestCase):
+    base_dir: str = ""
+    files: list[str] = [
+        "src/a.py",
+        "src/b.txt",
+        "src/deep/c.py",
+        "src/deep/er/d.py",
+        "docs/index.md",
+        "docs/img/e.png",
+        "build/f.py",
+        "build/g.o",
+        "h.py",
+        "i.tmp",
+    ]
+    empty_dirs: list[str] = ["docs/empty", "src/deep/er/void", "build/out"]
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        for relpath in self.files:
+            path = os.path.join(self.base_dir, "proj", relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Path(path).touch()
+        for relpath in self.empty_dirs:
+            os.makedirs(os.path.join(self.base_dir, "proj", relpath))
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def walked(self, *args: str) -> set[str]:
+        # directories too, empty ones included, as rsync would create them
+        source = os.path.join(self.base_dir, "proj")
+        return {e.relpath for e in walk(source, matcher(*args))}
+
+    def test_same_transfer_as_naive_rules(self):
+        # rules files as they had to be written before the compiler: every
+        # parent spelled out, then only the catch-all added
+        rule_sets = [
+            ["--include=/proj/", "--include=/proj/src/", "--include=/proj/src/*.py"],
+            ["--include=/proj/", "--include=/proj/src/***", "--exclude=*.txt"],
+            [
+                "--include=/proj/",
+                "--include=/proj/src/",
+                "--include=/proj/src/deep/***",
+            ],
+            [
+                "--include=/proj/",
+                "--include=/proj/docs/***",
+                "--exclude=*.tmp",
+                "--include=/proj/*.py",
+            ],
+            ["--include=*/", "--include=*.py"],
+            ["--exclude=build/", "--include=*/", "--include=*.py", "--include=*.md"],
+            ["--exclude=/proj/src/deep/", "--include=*/", "--include=/proj/src/**"],
+            ["--include=*.py", "--include=*.py", "--exclude=*", "--include=*.md"],
+            ["--exclude=*.tmp", "--include=*"],
+        ]
+        for rules in rule_sets:
+            with self.subTest(rules=rules):
+                naive = self.walked(*rules, "--exclude=*")
+                self.assertEqual(self.walked(*compile_filters(rules).args), naive)
+
+    def test_empty_dirs_are_pruned(self):
+        source = os.path.join(self.base_dir, "proj")
+        args = compile_filters(["--include=*.py"]).args
+        self.assertIn("--prune-empty-dirs", args)
+        dirs = {e.relpath for e in walk(source, matcher(*args)) if e.is_dir}
+        self.assertEqual(
+            dirs, {"proj/src", "proj/src/deep", "proj/src/deep/er", "proj/build"}
+        )
+
+        kept = [arg for arg in args if arg != "--prune-empty-dirs"]
+        unpruned = {e.relpath for e in walk(source, matcher(*kept)) if e.is_dir}
+        self.assertIn("proj/docs/img", unpruned)
+
+    def test_pruned_dirs_come_before_their_files(self):
+        source = os.path.join(self.base_dir, "proj")
+        args = compile_filters(["--include=/proj/src/**/*.py"]).args
+        seen: set[str] = set()
+        for entry in walk(source, matcher(*args)):
+            parent = os.path.dirname(entry.relpath)
+            if parent != "proj":
+                self.assertIn(parent, seen)
+            seen.add(entry.relpath)
+        self.assertIn("proj/src/deep/er/d.py", seen)
+
+    def test_anchored_rules_prune_the_walk(self):
+        source = os.path.join(self.base_dir, "proj")
+        compiled = matcher(*compile_filters(["--include=/proj/src/*.py"]).args)
+        dirs = {e.relpath for e in walk(source, compiled) if e.is_dir}
+        self.assertEqual(dirs, {"proj/src"})
+
+
 # ------
 # FINDUP
 # ------
@@ -146,6 +813,21 @@ class TestFindup(unittest.TestCase):
         found = findup(filename)
         self.assertEqual(found, filepath)
 
+    def test_findall_lists_nearest_first(self):
+        sub_dir = os.path.join(self.base_dir, "a", "b")
+        os.makedirs(sub_dir)
+        for directory in (self.base_dir, os.path.join(self.base_dir, "a", "b")):
+            with open(os.path.join(directory, "testfile.txt"), "w") as f:
+                _ = f.write("test content")
+        self.assertEqual(
+            findall("testfile.txt", sub_dir),
+            [
+                os.path.join(sub_dir, "testfile.txt"),
+                os.path.join(self.base_dir, "testfile.txt"),
+            ],
+        )
+        self.assertEqual(findall("nonexistent.txt", sub_dir), [])
+
     def test_file_not_found_raises(self):
         sub_dir = os.path.join(self.base_dir, "subdir")
         os.mkdir(sub_dir)
@@ -276,6 +958,1710 @@ class TestPathResolver(unittest.TestCase):
         self.assertEqual(result, expected)
 
 
+class TestPathResolver_Many(unittest.TestCase):
+    base_dir: str = ""
+    proxy_root: str = ""
+    path_resolver: PathResolver = PathResolver(".", ".")
+
+    @override
+    def setUp(self) -> None:
+        self.base_dir = os.path.realpath(tempfile.mkdtemp())
+        self.proxy_root = os.path.join(self.base_dir, "proxy")
+        self.path_resolver = PathResolver(self.proxy_root, "user@host")
+        write_file(os.path.join(self.proxy_root, "proj", "sub", "a"), 1)
+        write_file(os.path.join(self.base_dir, "outside", "b"), 1)
+        # a link out of the root, one into it and one between its directories
+        os.symlink(
+            os.path.join(self.base_dir, "outside"),
+            os.path.join(self.proxy_root, "proj", "out"),
+        )
+        os.symlink(
+            os.path.join(self.proxy_root, "proj"),
+            os.path.join(self.base_dir, "outside", "in"),
+        )
+        os.symlink("sub", os.path.join(self.proxy_root, "proj", "alias"))
+        os.chdir(os.path.join(self.proxy_root, "proj"))
+
+    @override
+    def tearDown(self) -> None:
+        os.chdir("/")
+        shutil.rmtree(self.base_dir)
+
+    def paths(self) -> list[str]:
+        root = self.proxy_root
+        outside = os.path.join(self.base_dir, "outside")
+        return [
+            f"{root}/proj/sub/a",
+            f"{root}/proj/sub/missing",
+            f"{root}/proj/alias/a",
+            f"{root}/proj/out/b",
+            f"{root}/proj/sub/../sub/a",
+            f"{root}/proj/missing/../sub",
+            f"{outside}/in/sub/a",
+            "/elsewhere/file",
+            "sub/a",
+            "alias/a",
+            "./sub/",
+            ".",
+            "/",
+        ]
+
+    def test_same_results_as_single_paths(self):
+        paths = self.paths()
+        self.assertEqual(
+            list(self.path_resolver.to_local_many(paths)),
+            [self.path_resolver.to_local(path) for path in paths],
+        )
+        self.assertEqual(
+            list(self.path_resolver.to_remote_many(paths)),
+            [self.path_resolver.to_remote(path) for path in paths],
+        )
+
+    def test_same_error_as_single_path(self):
+        outside = "out/b"
+        with self.assertRaisesRegex(ValueError, "Can't work with a path outside"):
+            _ = self.path_resolver.to_remote(outside)
+
+        mapped = self.path_resolver.to_remote_many(["sub/a", outside, "sub"])
+        self.assertEqual(next(mapped), "user@host:/proj/sub/a")
+        with self.assertRaisesRegex(ValueError, "Can't work with a path outside"):
+            _ = next(mapped)
+
+    def test_resolves_each_directory_once(self):
+        paths = [f"{self.proxy_root}/proj/sub/f{i}" for i in range(100)]
+        with patch(
+            "pathlib.Path.resolve", autospec=True, side_effect=Path.resolve
+        ) as resolve:
+            mapped = list(self.path_resolver.to_remote_many(paths))
+
+        self.assertEqual(mapped[0], "user@host:/proj/sub/f0")
+        self.assertEqual(len(mapped), 100)
+        self.assertLess(resolve.call_count, 5)
+
+
+# -------
+# METRICS
+# -------
+class TestMetrics(unittest.TestCase):
+    def collect(self) -> Metrics:
+        metrics = Metrics(clock=lambda: 100.0)
+        add_hook(metrics)
+        self.addCleanup(remove_hook, metrics)
+        return metrics
+
+    def test_timed_reports_to_hooks(self):
+        @timed("work")
+        def work(x: int) -> int:
+            return x * 2
+
+        self.assertEqual(work(2), 4)
+        metrics = self.collect()
+        _ = work(3)
+        _ = work(4)
+        self.assertEqual(metrics.phases["work"][0], 2)
+
+    def test_early_exits_still_report(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        out = os.path.join(base_dir, "metrics.json")
+        argv = ["osync", "--connections", "--timings", "--metrics", out]
+        with (
+            patch.object(sys, "argv", argv),
+            patch("osync.metrics._hooks", []),
+            patch("osync.app.connections"),
+            patch("sys.stderr", new_callable=io.StringIO) as stderr,
+        ):
+            with self.assertRaises(SystemExit):
+                app.main()
+
+        with open(out) as f:
+            data = json.load(f)
+        self.assertEqual(data["returncode"], 0)
+        self.assertIn("cli", data["phases"])
+        self.assertIn("total", stderr.getvalue())
+
+    def test_instrumented_phases(self):
+        metrics = self.collect()
+        resolver = PathResolver("/proxy", "host")
+        _ = resolver.to_remote("/proxy/a")
+        _ = resolver.to_local("/a")
+        self.assertEqual(set(metrics.phases), {"to_remote", "to_local"})
+
+    def test_bulk_resolution_is_timed(self):
+        metrics = self.collect()
+        targets = resolve_targets(["/a", "/b"], PathResolver("/proxy", "host"))
+        self.assertEqual(len(targets), 2)
+        self.assertEqual(metrics.phases["to_local"][0], 1)
+        self.assertEqual(metrics.phases["to_remote"][0], 1)
+
+    def test_json(self):
+        metrics = self.collect()
+        emit("findup", 0.25)
+        data = metrics.to_json("push", 0, {"total_bytes_sent": 10})
+        self.assertEqual(data["phases"], {"findup": {"calls": 1, "seconds": 0.25}})
+        self.assertEqual(data["stats"], {"total_bytes_sent": 10})
+
+    def test_prometheus(self):
+        metrics = self.collect()
+        emit("findup", 0.25)
+        text = metrics.to_prometheus("pull", 23, {"total_bytes_sent": 10})
+        self.assertIn('osync_phase_seconds{direction="pull",phase="findup"} 0.25', text)
+        self.assertIn('osync_sync_exit_code{direction="pull"} 23', text)
+        self.assertIn('osync_rsync_total_bytes_sent{direction="pull"} 10', text)
+        self.assertTrue(text.endswith("\n"))
+
+    def test_write(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        metrics = self.collect()
+        path = os.path.join(base_dir, "osync.prom")
+        metrics.write(path, "prometheus", "push", 0, {})
+        metrics.write(path + ".json", "json", "push", 0, {})
+        self.assertEqual(
+            sorted(os.listdir(base_dir)), ["osync.prom", "osync.prom.json"]
+        )
+
+
+# --------
+# PROGRESS
+# --------
+class TestProgress(unittest.TestCase):
+    def test_file_line(self):
+        event = parse_line("osync|>f+++++++++|1234|1300|dir/a|b.txt")
+        self.assertEqual(event, FileEvent(">f+++++++++", 1234, 1300, "dir/a|b.txt"))
+        assert isinstance(event, FileEvent)
+        self.assertEqual(event.action, "created")
+
+    def test_file_actions(self):
+        self.assertEqual(FileEvent(">f.st......", 1, 1, "a").action, "updated")
+        self.assertEqual(FileEvent(".d..t......", 0, 0, "a").action, "attributes")
+        self.assertEqual(FileEvent("*deleting", 0, 0, "a").action, "deleting")
+
+    def test_progress_line(self):
+        event = parse_line(
+            "      1,234,567  45%    1.50MB/s    0:01:02 (xfr#3, to-chk=10/100)"
+        )
+        self.assertEqual(
+            event,
+            ProgressEvent(1234567, 45, 1.5 * 1024**2, 62, 3, 10, 100),
+        )
+
+    def test_stats_and_log_lines(self):
+        self.assertEqual(
+            parse_line("Total file size: 1,000 bytes"),
+            StatsEvent("total_file_size", 1000, "Total file size: 1,000 bytes"),
+        )
+        self.assertEqual(
+            parse_line("sending incremental file list"),
+            LogEvent("sending incremental file list"),
+        )
+
+    def test_parser_splits_records_across_chunks(self):
+        parser = OutputParser()
+        events = list(parser.feed(b"osync|>f+++++++++|1|1|a\n   10  1%  1.00kB/s  "))
+        events += list(parser.feed(b"0:00:01\r   20  2%  1.00kB/s  0:00:01\rdone"))
+        events += list(parser.close())
+
+        self.assertIsInstance(events[0], FileEvent)
+        self.assertEqual([e.bytes for e in events[1:3]], [10, 20])  # pyright:ignore[reportAttributeAccessIssue]
+        self.assertEqual(events[3], LogEvent("done"))
+
+    def test_console_rate_adds_up_runs_on_one_thread(self):
+        # a pool thread runs one rsync after the other; the first one's bytes
+        # still count once the second reports
+        with patch("time.monotonic", return_value=10.0):
+            reporter = ConsoleReporter(out=io.StringIO())
+        for _ in range(2):
+            for event in OutputParser().feed(b"  1,048,576 100%  1.00MB/s  0:00:00\n"):
+                reporter(event)
+        with patch("time.monotonic", return_value=11.0):
+            self.assertTrue(reporter.line().startswith("    2.00 MB/s"))
+
+    def test_json_report(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        path = os.path.join(base_dir, "report.json")
+
+        report = JsonReport(path, ["osync", "--push", "."])
+        report(FileEvent(">f+++++++++", 10, 12, "a"))
+        report(LogEvent("ignored"))
+        report(FileEvent(">f.st......", 5, 1, "b"))
+        report.close(0, {"number_of_files": 2})
+
+        with open(path) as f:
+            data = json.load(f)  # pyright:ignore[reportAny]
+        self.assertEqual([e["path"] for e in data["files"]], ["a", "b"])  # pyright:ignore[reportAny]
+        self.assertEqual(
+            data["totals"], {"files": 2, "bytes": 15, "transferred_bytes": 13}
+        )
+        self.assertEqual(data["returncode"], 0)
+
+
+# ----
+# SEED
+# ----
+class TestSeed(unittest.TestCase):
+    base_dir: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        write_file(os.path.join(self.base_dir, "remote", "proj", "a"), 3)
+        write_file(os.path.join(self.base_dir, "remote", "proj", "sub", "b"), 5)
+        write_file(os.path.join(self.base_dir, "remote", "proj", "skipped"), 1)
+        os.utime(os.path.join(self.base_dir, "remote", "proj", "a"), (1000, 1000))
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_seed_needed(self):
+        local = os.path.join(self.base_dir, "local", "proj")
+        self.assertTrue(seed_needed(local))
+        os.makedirs(local)
+        self.assertTrue(seed_needed(local))
+        write_file(os.path.join(local, "a"), 1)
+        self.assertFalse(seed_needed(local))
+
+    def test_pull_streams_only_the_listed_files(self):
+        local = os.path.join(self.base_dir, "local")
+        returncode = seed(
+            Direction.PULL,
+            ["sh", "-c"],
+            local,
+            os.path.join(self.base_dir, "remote"),
+            ["proj/a", "proj/sub/b"],
+        )
+
+        self.assertEqual(returncode, 0)
+        self.assertEqual(os.path.getsize(os.path.join(local, "proj", "sub", "b")), 5)
+        self.assertEqual(os.stat(os.path.join(local, "proj", "a")).st_mtime, 1000)
+        self.assertFalse(os.path.exists(os.path.join(local, "proj", "skipped")))
+
+    def test_newer_files_on_the_receiver_are_kept(self):
+        local = os.path.join(self.base_dir, "local")
+        write_file(os.path.join(local, "proj", "a"), 7)
+        returncode = seed(
+            Direction.PULL,
+            ["sh", "-c"],
+            local,
+            os.path.join(self.base_dir, "remote"),
+            ["proj/a", "proj/sub/b"],
+        )
+
+        self.assertEqual(returncode, 0)
+        self.assertEqual(os.path.getsize(os.path.join(local, "proj", "a")), 7)
+        self.assertEqual(os.path.getsize(os.path.join(local, "proj", "sub", "b")), 5)
+
+    def test_push_creates_the_remote_parent(self):
+        dest = os.path.join(self.base_dir, "other", "parent")
+        returncode = seed(
+            Direction.PUSH,
+            ["sh", "-c"],
+            os.path.join(self.base_dir, "remote"),
+            dest,
+            ["proj/a"],
+        )
+
+        self.assertEqual(returncode, 0)
+        self.assertEqual(os.listdir(os.path.join(dest, "proj")), ["a"])
+
+
+# -----
+# SHARD
+# -----
+def write_file(path: str, size: int):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        _ = f.write(b"x" * size)
+
+
+class TestShard(unittest.TestCase):
+    base_dir: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_every_entry_in_exactly_one_shard(self):
+        for name in ["a", "b", "c", "d", "e"]:
+            write_file(os.path.join(self.base_dir, name, "file"), 10)
+
+        shards = plan_shards(self.base_dir, 3)
+
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(
+            sorted(n for s in shards for n in s), ["a", "b", "c", "d", "e"]
+        )
+
+    def test_big_entry_gets_its_own_shard(self):
+        write_file(os.path.join(self.base_dir, "big", "file"), 10_000_000)
+        for name in ["a", "b", "c"]:
+            write_file(os.path.join(self.base_dir, name, "file"), 10)
+
+        shards = plan_shards(self.base_dir, 2)
+
+        self.assertIn(["big"], shards)
+
+    def test_fewer_entries_than_jobs(self):
+        write_file(os.path.join(self.base_dir, "only"), 10)
+        self.assertEqual(plan_shards(self.base_dir, 8), [["only"]])
+
+    def test_only_included_files_are_weighed(self):
+        write_file(os.path.join(self.base_dir, "a", "big.o"), 10_000_000)
+        write_file(os.path.join(self.base_dir, "a", "file"), 10)
+        write_file(os.path.join(self.base_dir, "b", "file"), 1000)
+        write_file(os.path.join(self.base_dir, "c", "big.o"), 10)
+        included = matcher("--exclude=*.o")
+
+        self.assertEqual(plan_shards(self.base_dir, 2), [["a"], ["b", "c"]])
+        self.assertEqual(plan_shards(self.base_dir, 2, included), [["b"], ["a", "c"]])
+
+    def test_excludes_are_anchored_to_transfer_root(self):
+        self.assertEqual(shard_excludes("/x/dir", ["a"]), ["--exclude=/dir/a"])
+        self.assertEqual(shard_excludes("/x/dir/", ["a"]), ["--exclude=/a"])
+
+    def test_escape_pattern(self):
+        self.assertEqual(escape_pattern("plain\\name"), "plain\\name")
+        self.assertEqual(escape_pattern("a*[b]"), "a\\*\\[b]")
+
+
+# ---------
+# BANDWIDTH
+# ---------
+class TestBandwidth(unittest.TestCase):
+    base_dir: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("500"), 500)
+        self.assertEqual(parse_rate("500K"), 500)
+        self.assertEqual(parse_rate("1.5MiB/s"), 1536)
+        self.assertEqual(parse_rate("2g"), 2 * 1024**2)
+        with self.assertRaises(ValueError):
+            _ = parse_rate("fast")
+
+    def test_priority_classes(self):
+        policy = BandwidthPolicy(100, {Direction.PUSH: 2})
+        push = CompiledFilterGroup(Direction.PUSH, Kind.INCLUDE, ["a"])
+        pull = CompiledFilterGroup(Direction.PULL, Kind.INCLUDE, ["a"], priority=7)
+        self.assertEqual(policy.priority(Direction.PUSH, [push, pull]), 2)
+        self.assertEqual(policy.priority(Direction.PULL, [push, pull]), 7)
+        self.assertEqual(BandwidthPolicy(100).priority(Direction.PULL, [push]), 1)
+
+    def test_shares_follow_priorities(self):
+        ledger = BandwidthLedger(self.base_dir)
+        high = ledger.acquire(900, 2)
+        low = ledger.acquire(900, 1)
+        self.assertEqual(ledger.share(high), 600)
+        self.assertEqual(ledger.share(low), 300)
+
+        ledger.release(high)
+        self.assertEqual(ledger.share(low), 900)
+
+    def test_strictest_budget_applies(self):
+        ledger = BandwidthLedger(self.base_dir)
+        lease = ledger.acquire(1000, 1)
+        _ = ledger.acquire(200, 1)
+        self.assertEqual(ledger.share(lease), 100)
+
+    def test_dead_transfers_are_dropped(self):
+        ledger = BandwidthLedger(self.base_dir)
+        lease = ledger.acquire(100, 1)
+        with open(os.path.join(self.base_dir, "gone.json"), "w") as f:
+            json.dump({"pid": 2**22 + 1, "budget": 100, "priority": 1}, f)
+        self.assertEqual(ledger.share(lease), 100)
+        self.assertEqual(os.listdir(self.base_dir), [os.path.basename(lease.path)])
+
+    def test_reused_pid_does_not_keep_a_lease(self):
+        ledger = BandwidthLedger(self.base_dir)
+        lease = ledger.acquire(100, 1)
+        with open(lease.path) as f:
+            started = json.load(f)["started"]  # pyright:ignore[reportAny]
+        self.assertIsInstance(started, int)
+        # our own pid, but once held by a process that started earlier
+        with open(os.path.join(self.base_dir, "reused.json"), "w") as f:
+            json.dump(
+                {
+                    "pid": os.getpid(),
+                    "started": started - 1,
+                    "budget": 100,
+                    "priority": 1,
+                },
+                f,
+            )
+        self.assertEqual(ledger.leases(), [lease])
+        self.assertEqual(os.listdir(self.base_dir), [os.path.basename(lease.path)])
+
+    def test_killed_owner_leaves_no_stopped_rsync(self):
+        proc = subprocess.Popen(["sleep", "30"])
+        self.addCleanup(proc.kill)
+        os.kill(proc.pid, signal.SIGSTOP)
+        # the signal is delivered asynchronously; wait until it has stopped
+        _ = os.waitpid(proc.pid, os.WUNTRACED)
+        with open(os.path.join(self.base_dir, "gone.json"), "w") as f:
+            json.dump(
+                {"pid": 2**22 + 1, "budget": 100, "priority": 1, "stopped": [proc.pid]},
+                f,
+            )
+        _ = BandwidthLedger(self.base_dir).leases()
+        self.assertEqual(proc.wait(timeout=5), -signal.SIGTERM)
+
+    def test_abort_resumes_and_ends_the_tree(self):
+        throttle = Throttle(Bandwidth(100, 1, self.base_dir))
+        proc = subprocess.Popen(["sleep", "30"])
+        self.addCleanup(proc.kill)
+        throttle.start(proc)
+        os.kill(proc.pid, signal.SIGSTOP)
+        throttle.abort()
+        self.assertEqual(proc.wait(timeout=5), -signal.SIGTERM)
+        throttle.stop()
+
+    def test_sigterm_during_a_pause_ends_the_tree(self):
+        script = (
+            "import os, signal, subprocess, sys\n"
+            + "from osync.bandwidth import Bandwidth, Throttle\n"
+            + "throttle = Throttle(Bandwidth(100, 1, sys.argv[1]))\n"
+            + "proc = subprocess.Popen(['sleep', '30'])\n"
+            + "throttle.start(proc)\n"
+            + "os.kill(proc.pid, signal.SIGSTOP)\n"
+            + "print(proc.pid, flush=True)\n"
+            + "proc.wait()\n"
+        )
+        owner = subprocess.Popen(
+            [sys.executable, "-c", script, self.base_dir], stdout=subprocess.PIPE
+        )
+        assert owner.stdout is not None
+        paused = int(owner.stdout.readline())
+        owner.terminate()
+        self.assertEqual(owner.wait(timeout=5), -signal.SIGTERM)
+        owner.stdout.close()
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                with open(f"/proc/{paused}/stat") as f:
+                    state = f.read().rpartition(")")[2].split()[0]
+            except OSError:
+                break
+            if state == "Z":
+                break
+            time.sleep(0.01)
+        else:
+            os.kill(paused, signal.SIGKILL)
+            self.fail("the paused child was left behind")
+
+    def test_throttle_duty(self):
+        bandwidth = Bandwidth(100, 1, self.base_dir)
+        first = Throttle(bandwidth)
+        self.assertEqual(first.duty(), 1.0)
+        second = Throttle(bandwidth.split(2))
+        self.assertAlmostEqual(first.duty(), 2 / 3)
+        self.assertAlmostEqual(second.duty(), 1 / 3)
+        first.stop()
+        second.stop()
+        self.assertEqual(os.listdir(self.base_dir), [])
+
+
+# -----
+# BATCH
+# -----
+def targets(*paths: str):
+    return [SyncTarget(p, "host:" + p) for p in paths]
+
+
+class TestBatch(unittest.TestCase):
+    def test_expand_stdin(self):
+        stdin = io.StringIO("x\n\n  y  \n")
+        self.assertEqual(expand_paths(["a", "-", "b"], stdin), ["a", "x", "y", "b"])
+
+    def test_nested_paths_merge_into_ancestor(self):
+        groups = coalesce(targets("/p/a/b", "/p/a", "/p/a/c/d"))
+        self.assertEqual(groups, [targets("/p/a")])
+
+    def test_prefix_is_not_nesting(self):
+        groups = coalesce(targets("/p/a", "/p/a-b/c", "/p/a/c"))
+        self.assertEqual(groups, [targets("/p/a"), targets("/p/a-b/c")])
+
+    def test_siblings_are_grouped(self):
+        groups = coalesce(targets("/p/b", "/q/c", "/p/a", "/p/a"))
+        self.assertEqual(groups, [targets("/p/a", "/p/b"), targets("/q/c")])
+
+    def test_parent_dest(self):
+        self.assertEqual(parent_dest("host:/p/a"), "host:/p/.")
+
+
+# ---
+# SSH
+# ---
+# Stand-in for ssh that only understands the control commands: a master is
+# "alive" while a marker file sits next to its socket
+FAKE_SSH = """#!/bin/sh
+sock=$2; op=$4
+case $op in
+    check) test -e "$sock.alive" ;;
+    exit) test -e "$sock.alive" && rm "$sock.alive" ;;
+esac
+"""
+
+
+class TestSshMaster(unittest.TestCase):
+    socket_dir: str = ""
+    ssh: str = ""
+
+    @override
+    def setUp(self):
+        self.socket_dir = tempfile.mkdtemp()
+        self.ssh = os.path.join(self.socket_dir, "fake-ssh")
+        with open(self.ssh, "w") as f:
+            _ = f.write(FAKE_SSH)
+        os.chmod(self.ssh, 0o755)
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.socket_dir)
+
+    def master(self, host: str = "user@host"):
+        return SshMaster(host, socket_dir=self.socket_dir, persist=30, ssh=self.ssh)
+
+    def start(self, master: SshMaster):
+        master.prepare()
+        Path(master.socket).touch()
+        Path(master.socket + ".alive").touch()
+
+    def test_transport_args(self):
+        master = self.master()
+        self.assertEqual(master.transport_args()[0], "-e")
+        transport = master.transport_args()[1]
+        self.assertIn(f"ControlPath={master.socket}", transport)
+        self.assertIn("ControlPersist=30", transport)
+
+    def test_socket_per_host(self):
+        self.assertNotEqual(self.master("a@x").socket, self.master("b@x").socket)
+
+    def test_stale_socket_is_removed(self):
+        master = self.master()
+        Path(master.socket).touch()
+        master.prepare()
+        self.assertFalse(os.path.exists(master.socket))
+
+    def test_live_socket_is_kept(self):
+        master = self.master()
+        self.start(master)
+        master.prepare()
+        self.assertTrue(master.check())
+
+    def test_list_and_close(self):
+        self.start(self.master("a@x"))
+        self.start(self.master("b@x"))
+
+        masters = known_masters(self.socket_dir, self.ssh)
+        self.assertEqual(sorted(m.host for m in masters), ["a@x", "b@x"])
+        self.assertTrue(all(m.close() for m in masters))
+        self.assertEqual(known_masters(self.socket_dir, self.ssh), [])
+
+
+# ----------
+# SYNC_INDEX
+# ----------
+class TestSyncIndex(unittest.TestCase):
+    base_dir: str = ""
+    source: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.base_dir, "proj")
+        write_file(os.path.join(self.source, "a"), 1)
+        write_file(os.path.join(self.source, "sub", "b"), 2)
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def index(self, target: str = "target"):
+        config = os.path.join(self.base_dir, "osync.yaml")
+        index = SyncIndex(index_path(config, self.base_dir), target)
+        self.addCleanup(index.close)
+        return index
+
+    def diff(self, index: SyncIndex):
+        return index.diff(walk(self.source, FilterMatcher([])))
+
+    def test_index_lives_outside_the_tree(self):
+        cache = os.path.join(self.base_dir, "cache")
+        with patch.dict(os.environ, {"XDG_CACHE_HOME": cache}):
+            path = index_path(os.path.join(self.source, "osync.yaml"))
+        self.assertTrue(path.startswith(os.path.join(cache, "osync", "index")))
+        self.assertNotEqual(path, index_path("/y/osync.yaml", self.base_dir))
+
+    def test_first_diff_is_everything(self):
+        diff = self.diff(self.index())
+        self.assertEqual(diff.paths, ["proj/a", "proj/sub", "proj/sub/b"])
+
+    def test_committed_index_has_no_changes(self):
+        index = self.index()
+        index.commit(self.diff(index))
+        diff = self.diff(self.index())
+        self.assertEqual(diff.changed, {})
+        self.assertEqual(diff.removed, [])
+
+    def test_modified_and_removed_files(self):
+        index = self.index()
+        index.commit(self.diff(index))
+        write_file(os.path.join(self.source, "a"), 5)
+        os.remove(os.path.join(self.source, "sub", "b"))
+
+        diff = self.diff(index)
+
+        self.assertIn("proj/a", diff.paths)
+        self.assertNotIn("proj/sub/b", diff.paths)
+        self.assertEqual(diff.removed, ["proj/sub/b"])
+
+    def test_targets_are_independent(self):
+        index = self.index("one")
+        index.commit(self.diff(index))
+        self.assertEqual(len(self.diff(self.index("two")).changed), 3)
+
+
+# ------
+# DAEMON
+# ------
+def job(*locals: str, direction: Direction = Direction.PUSH):
+    return Job(
+        JobKey(direction, False, False, "/osync.yaml", "host"),
+        [SyncTarget(local, "host:" + local) for local in locals],
+        [],
+        subscribers=[Subscriber(io.StringIO())],
+    )
+
+
+class TestDaemon(unittest.TestCase):
+    def test_forwardable(self):
+        self.assertTrue(forwardable(cli.main(["--push", "a"])))
+        self.assertFalse(forwardable(cli.main(["--push", "--no-daemon", "a"])))
+        self.assertFalse(forwardable(cli.main(["--push", "--watch", "a"])))
+        self.assertFalse(forwardable(cli.main(["--status", "a"])))
+
+    def test_forward_without_daemon(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        self.assertIsNone(forward(["--push", "a"], os.path.join(base_dir, "sock")))
+
+    def test_executed_jobs_journal_and_refresh(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        fake = os.path.join(base_dir, "rsync")
+        with open(fake, "w") as f:
+            # the daemon's rsync gets no stdin to drain
+            _ = f.write(FAKE_RSYNC.replace("cat >/dev/null\n", ""))
+        os.chmod(fake, 0o755)
+        env = {
+            "PATH": base_dir + os.pathsep + os.environ["PATH"],
+            "XDG_CACHE_HOME": base_dir,
+        }
+        out = io.StringIO()
+        with patch.dict(os.environ, env), patch.object(SshMaster, "prepare"):
+            manifests = ManifestCache()
+            manifests.save(Manifest("host:/p/proj", time.time()))
+            returncode = execute_job(job("/p/proj"), out)
+            stale = manifests.load("host:/p/proj")
+
+        self.assertEqual(returncode, 23)
+        self.assertIn(PARTIAL_ARGS[0], out.getvalue().splitlines()[0])
+        journals = os.path.join(base_dir, "osync", "journals")
+        (name,) = os.listdir(journals)
+        state = load_journal(os.path.join(journals, name))
+        assert state is not None
+        self.assertEqual(state.key, "push /p/proj -> host:/p/.")
+        self.assertEqual(state.done, {"dir/a"})
+        self.assertEqual(state.returncode, 23)
+        # a failed transfer leaves the remote unknown, so its manifest goes
+        self.assertIsNone(stale)
+
+    def test_config_stays_resident_until_changed(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        config = os.path.join(base_dir, "osync.yaml")
+        with open(config, "w") as f:
+            _ = f.write("[]\n")
+        daemon = Daemon("unused")
+        with (
+            patch.dict(os.environ, {"XDG_CACHE_HOME": base_dir}),
+            patch(
+                "osync.daemon.load_tree_config_cached",
+                side_effect=load_tree_config_cached,
+            ) as load,
+        ):
+            self.assertEqual(daemon.config(base_dir)[0], config)
+            _ = daemon.config(base_dir)
+            self.assertEqual(load.call_count, 1)
+
+            with open(config, "w") as f:
+                _ = f.write(CONFIG)
+            os.utime(config, ns=(0, 0))
+            _, compiled = daemon.config(base_dir)
+            self.assertEqual(load.call_count, 2)
+        self.assertEqual(compiled.filter_groups[0].patterns, ["a", "b"])
+
+    def test_overlapping_requests_merge(self):
+        daemon = Daemon("unused", settle=0)
+        daemon.submit(job("/p/a/b"))
+        daemon.submit(job("/p/c"))
+        daemon.submit(job("/p/a"))
+        self.assertEqual(len(daemon.pending), 2)
+        self.assertEqual(len(daemon.pending[0].subscribers), 2)
+
+    def test_other_direction_does_not_merge(self):
+        daemon = Daemon("unused", settle=0)
+        daemon.submit(job("/p/a"))
+        daemon.submit(job("/p/a", direction=Direction.PULL))
+        self.assertEqual(len(daemon.pending), 2)
+
+    def test_overlapping_jobs_wait_for_running_ones(self):
+        daemon = Daemon("unused", settle=0)
+        daemon.running.append(job("/p/a"))
+        daemon.submit(job("/p/a/b", direction=Direction.PULL))
+        daemon.submit(job("/p/c"))
+        nxt = daemon._next(time.monotonic())  # pyright:ignore[reportPrivateUsage]
+        assert nxt is not None
+        self.assertEqual(nxt.targets[0].local, "/p/c")
+
+    def test_settle_delays_dispatch(self):
+        daemon = Daemon("unused", settle=10)
+        daemon.submit(job("/p/a"))
+        submitted = daemon.pending[0].submitted
+        self.assertIsNone(daemon._next(submitted + 1))  # pyright:ignore[reportPrivateUsage]
+        self.assertIsNotNone(daemon._next(submitted + 10))  # pyright:ignore[reportPrivateUsage]
+
+    def test_serves_requests_over_socket(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        proxy_root = os.path.join(base_dir, "proxy")
+        os.makedirs(os.path.join(proxy_root, "proj"))
+        with open(os.path.join(proxy_root, "osync.yaml"), "w") as f:
+            _ = f.write("[]\n")
+
+        ran: list[Job] = []
+
+        def run_job(job: Job, out: object) -> int:
+            ran.append(job)
+            print("transferred", file=out)  # pyright:ignore[reportArgumentType]
+            return 0
+
+        path = os.path.join(base_dir, "sock")
+        daemon = Daemon(path, settle=0, run_job=run_job)
+        stop = threading.Event()
+        server = threading.Thread(target=daemon.serve_forever, args=(stop,))
+        server.start()
+        self.addCleanup(server.join)
+        self.addCleanup(stop.set)
+        while not os.path.exists(path):
+            time.sleep(0.01)
+
+        out = io.StringIO()
+        env = {
+            "OSYNC_PROXY_ROOT": proxy_root,
+            "OSYNC_REMOTE_USER_HOST": "host",
+            "XDG_CACHE_HOME": base_dir,
+        }
+        with patch.dict(os.environ, env), patch("os.getcwd", return_value=proxy_root):
+            returncode = forward(["--push", "proj"], path, out=out)
+
+        self.assertEqual(returncode, 0)
+        self.assertEqual(out.getvalue(), "transferred\n")
+        self.assertEqual(
+            ran[0].targets, [SyncTarget(f"{proxy_root}/proj", "host:/proj")]
+        )
+
+
+# ------
+# FANOUT
+# ------
+class TestFanOut(unittest.TestCase):
+    def test_retarget_swaps_host(self):
+        command = rsynccommand()
+        command.dest = "a@one:/x/."
+        command.files_from = ["proj/a"]
+
+        other = retarget(command, "b@two", ["-e", "ssh"])
+
+        self.assertEqual(other.dest, "b@two:/x/.")
+        self.assertEqual(other.extra_args, ["-e", "ssh"])
+        self.assertIs(other.files_from, command.files_from)
+        self.assertEqual(command.dest, "a@one:/x/.")
+
+    def test_stragglers(self):
+        results = [
+            RemoteResult(name, RsyncResult(0, {}), seconds)
+            for name, seconds in (("a", 1.0), ("b", 1.2), ("c", 5.0))
+        ]
+        self.assertEqual(stragglers(results), ["c"])
+        self.assertEqual(stragglers(results[:2]), [])
+        self.assertEqual(stragglers(results[1:]), ["c"])
+        self.assertEqual(stragglers(results[2:]), [])
+        self.assertIn("c: 0 files transferred", format_fan_out(results))
+        self.assertTrue(format_fan_out(results).endswith("(straggler)"))
+
+    def test_fan_out_runs_every_remote(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        fake = os.path.join(base_dir, "rsync")
+        with open(fake, "w") as f:
+            _ = f.write(FAKE_RSYNC)
+        os.chmod(fake, 0o755)
+        command = rsynccommand()
+        command.base_args = [fake]
+        command.dest = "a@one:/x/."
+        command.files_from = ["dir/a"]
+
+        with patch("sys.stdout", io.StringIO()):
+            results = fan_out(
+                {
+                    remote: [
+                        retarget(command, remote, []),
+                        retarget(command, remote, []),
+                    ]
+                    for remote in ("a@one", "b@two")
+                },
+                per_remote=2,
+            )
+
+        self.assertEqual([r.remote for r in results], ["a@one", "b@two"])
+        for r in results:
+            self.assertEqual(r.result.returncode, 23)
+            self.assertEqual(r.result.stats["number_of_regular_files_transferred"], 2)
+
+
+# -----------
+# LARGE_FILES
+# -----------
+class TestLargeFiles(unittest.TestCase):
+    base_dir: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.base_dir, "state"))
+        write_file(os.path.join(self.base_dir, "local", "proj", "sub", "big"), 4500)
+        os.utime(
+            os.path.join(self.base_dir, "local", "proj", "sub", "big"), (1000, 1000)
+        )
+        os.makedirs(os.path.join(self.base_dir, "remote"))
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def lane(self, direction: Direction) -> LargeFileLane:
+        return LargeFileLane(
+            direction,
+            ["sh", "-c"],
+            os.path.join(self.base_dir, "local"),
+            os.path.join(self.base_dir, "remote"),
+            streams=3,
+            range_size=1000,
+            state_dir=os.path.join(self.base_dir, "state"),
+        )
+
+    def read(self, side: str) -> bytes:
+        with open(os.path.join(self.base_dir, side, "proj", "sub", "big"), "rb") as f:
+            return f.read()
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("512M"), 512 * 1024**2)
+        self.assertEqual(parse_size("1.5kB"), 1536)
+        self.assertEqual(parse_size(10), 10)
+        with self.assertRaises(ValueError):
+            _ = parse_size("lots")
+
+    def test_ranges_and_excludes(self):
+        self.assertEqual(ranges(2500, 1000), [(0, 1000), (1000, 1000), (2000, 500)])
+        self.assertEqual(
+            lane_excludes([LargeFile("proj/a[1]", 1, 1)]), ["--exclude=/proj/a\\[1]"]
+        )
+
+    def test_push_in_ranges(self):
+        lane = self.lane(Direction.PUSH)
+        self.assertTrue(lane.transfer(LargeFile("proj/sub/big", 4500, 1000)))
+
+        self.assertEqual(self.read("remote"), self.read("local"))
+        remote = os.path.join(self.base_dir, "remote", "proj", "sub")
+        self.assertEqual(os.listdir(remote), ["big"])
+        self.assertEqual(os.stat(os.path.join(remote, "big")).st_mtime, 1000)
+        self.assertEqual(os.listdir(os.path.join(self.base_dir, "state")), [])
+
+    def test_pull_in_ranges(self):
+        os.rename(
+            os.path.join(self.base_dir, "local", "proj"),
+            os.path.join(self.base_dir, "remote", "proj"),
+        )
+        lane = self.lane(Direction.PULL)
+        self.assertTrue(lane.transfer(LargeFile("proj/sub/big", 4500, 1000)))
+        self.assertEqual(self.read("local"), self.read("remote"))
+
+    def test_up_to_date_file_is_skipped(self):
+        shutil.copytree(
+            os.path.join(self.base_dir, "local", "proj"),
+            os.path.join(self.base_dir, "remote", "proj"),
+        )
+        lane = self.lane(Direction.PUSH)
+        with patch.object(lane, "_send") as send:
+            self.assertTrue(lane.transfer(LargeFile("proj/sub/big", 4500, 1000)))
+        send.assert_not_called()
+
+    def test_resume_sends_only_missing_ranges(self):
+        lane = self.lane(Direction.PUSH)
+        file = LargeFile("proj/sub/big", 4500, 1000)
+        key = f"push {lane.local_parent} {lane.remote_parent} proj/sub/big 4500 1000"
+        state = RangeState(key, os.path.join(self.base_dir, "state"))
+        os.makedirs(os.path.join(self.base_dir, "remote", "proj", "sub"))
+        with open(
+            os.path.join(self.base_dir, "remote", "proj", "sub", "big.osync-part"), "wb"
+        ) as f:
+            _ = f.write(self.read("local")[:2000])
+        state.add(0)
+        state.add(1)
+
+        sent: list[int] = []
+        send = lane._send  # pyright:ignore[reportPrivateUsage]
+
+        def recording(file: LargeFile, offset: int, length: int) -> bool:
+            sent.append(offset)
+            return send(file, offset, length)
+
+        with patch.object(lane, "_send", recording):
+            self.assertTrue(lane.transfer(file))
+
+        self.assertEqual(sorted(sent), [2000, 3000, 4000])
+        self.assertEqual(self.read("remote"), self.read("local"))
+
+    def test_modes_follow_the_source(self):
+        lane = self.lane(Direction.PUSH)
+        self.assertTrue(lane.transfer(LargeFile("proj/sub/big", 4500, 1000, 0o640)))
+        remote = os.path.join(self.base_dir, "remote", "proj", "sub", "big")
+        self.assertEqual(stat.S_IMODE(os.stat(remote).st_mode), 0o640)
+
+        os.chmod(remote, 0o604)
+        os.unlink(os.path.join(self.base_dir, "local", "proj", "sub", "big"))
+        lane = self.lane(Direction.PULL)
+        self.assertTrue(lane.transfer(LargeFile("proj/sub/big", 4500, 1001)))
+        local = os.path.join(self.base_dir, "local", "proj", "sub", "big")
+        self.assertEqual(stat.S_IMODE(os.stat(local).st_mode), 0o604)
+
+    def test_unreadable_source_fails_instead_of_hanging(self):
+        lane = self.lane(Direction.PUSH)
+        file = LargeFile("proj/sub/big", 4500, 1000)
+        os.unlink(os.path.join(self.base_dir, "local", "proj", "sub", "big"))
+        self.assertFalse(lane._send(file, 0, 1000))  # pyright:ignore[reportPrivateUsage]
+
+    def test_unwritable_destination_is_reported(self):
+        os.rename(
+            os.path.join(self.base_dir, "local", "proj"),
+            os.path.join(self.base_dir, "remote", "proj"),
+        )
+        # a file where the destination directory should be
+        write_file(os.path.join(self.base_dir, "local", "proj"), 1)
+        out = io.StringIO()
+        with patch("sys.stdout", out):
+            returncode = self.lane(Direction.PULL).run(
+                [LargeFile("proj/sub/big", 4500, 1000)]
+            )
+        self.assertEqual(returncode, 23)
+        self.assertIn("failed  proj/sub/big", out.getvalue())
+
+    def test_silent_remote_is_a_failure_not_a_crash(self):
+        # an ssh that answers nothing, e.g. a stat missing on the remote
+        lane = self.lane(Direction.PUSH)
+        lane.ssh = ["true"]
+        file = LargeFile("proj/sub/big", 4500, 1000)
+        self.assertFalse(lane._up_to_date(file))  # pyright:ignore[reportPrivateUsage]
+        out = io.StringIO()
+        with patch("sys.stdout", out):
+            self.assertEqual(lane.run([file]), 23)
+        self.assertIn("failed  proj/sub/big", out.getvalue())
+
+
+# -------
+# JOURNAL
+# -------
+class TestJournal(unittest.TestCase):
+    base_dir: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_key_names_direction_and_paths(self):
+        command = rsynccommand()
+        command.extra_sources = ["/other"]
+        self.assertEqual(journal_key(command), "push /src/ /other -> /dst/")
+
+    def test_records_completed_files(self):
+        journal = Journal("push a -> b", self.base_dir)
+        self.addCleanup(journal.finish, 1)
+        journal(FileEvent(">f+++++++++", 3, 3, "proj/a"))
+        journal(FileEvent("cd+++++++++", 0, 0, "proj/sub/"))
+        journal(LogEvent("sending incremental file list"))
+
+        state = load_journal(journal.path)
+
+        assert state is not None
+        self.assertEqual(state.key, "push a -> b")
+        self.assertEqual(state.done, {"proj/a", "proj/sub"})
+        self.assertIsNone(state.returncode)
+
+    def test_success_removes_journal(self):
+        journal = Journal("push a -> b", self.base_dir)
+        journal.finish(0)
+        self.assertIsNone(load_journal(journal.path))
+
+    def test_failure_keeps_journal(self):
+        journal = Journal("push a -> b", self.base_dir)
+        journal(FileEvent(">f+++++++++", 3, 3, "proj/a"))
+        journal.finish(20)
+
+        # a resumed run appends to the same journal
+        resumed = Journal("push a -> b", self.base_dir)
+        self.addCleanup(resumed.finish, 1)
+        resumed(FileEvent(">f+++++++++", 3, 3, "proj/b"))
+        state = load_journal(resumed.path)
+
+        assert state is not None
+        self.assertEqual(state.done, {"proj/a", "proj/b"})
+        self.assertEqual(state.returncode, 20)
+
+    def test_torn_last_line_is_ignored(self):
+        journal = Journal("push a -> b", self.base_dir)
+        journal(FileEvent(">f+++++++++", 3, 3, "proj/a"))
+        journal.finish(1)
+        with open(journal.path, "a") as f:
+            _ = f.write('{"done": "pro')
+
+        state = load_journal(journal.path)
+
+        assert state is not None
+        self.assertEqual(state.done, {"proj/a"})
+
+    def test_journals_a_transfer(self):
+        fake = os.path.join(self.base_dir, "rsync")
+        with open(fake, "w") as f:
+            _ = f.write(FAKE_RSYNC)
+        os.chmod(fake, 0o755)
+        journal = Journal("push a -> b", self.base_dir)
+
+        rsync_cmd = rsynccommand()
+        rsync_cmd.base_args = [fake]
+        rsync_cmd.files_from = ["dir/a"]
+        rsync_cmd.extra_args = PARTIAL_ARGS
+        rsync_cmd.listeners = [journal]
+        rsync_cmd.build()
+        with patch("sys.stdout", io.StringIO()):
+            result = rsync_cmd.run()
+        journal.finish(result.returncode)
+
+        state = load_journal(journal.path)
+        assert state is not None
+        self.assertIn("--partial-dir=.osync-partial", rsync_cmd.args)
+        self.assertEqual(state.done, {"dir/a"})
+        self.assertEqual(state.returncode, 23)
+
+
+# --------
+# MANIFEST
+# --------
+FAKE_LIST_RSYNC = """#!/bin/sh
+printf 'drwxr-xr-x          4,096 2025/01/02 03:04:05 proj\\n'
+printf -- '-rw-r--r--          1,234 2025/01/02 03:04:05 proj/a file\\n'
+printf 'lrwxrwxrwx              1 2025/01/02 03:04:05 proj/link -> a file\\n'
+exit 0
+"""
+
+
+class TestManifest(unittest.TestCase):
+    base_dir: str = ""
+    local: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.local = os.path.join(self.base_dir, "proj")
+        write_file(os.path.join(self.local, "same"), 1)
+        write_file(os.path.join(self.local, "newer"), 2)
+        write_file(os.path.join(self.local, "local-only"), 3)
+        os.utime(os.path.join(self.local, "same"), (100, 100))
+        os.utime(os.path.join(self.local, "newer"), (200, 200))
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def manifest(self, fetched: float = 1000.0):
+        return Manifest(
+            "host:/proj",
+            fetched,
+            {
+                "proj": ManifestEntry(4096, 1, True),
+                "proj/same": ManifestEntry(1, 100),
+                "proj/newer": ManifestEntry(2, 150),
+                "proj/remote-only": ManifestEntry(4, 100),
+                "proj/build": ManifestEntry(4096, 100, True),
+                "proj/build/out": ManifestEntry(4, 100),
+            },
+        )
+
+    def test_parse_list_line(self):
+        path, entry = parse_list_line(  # pyright:ignore[reportGeneralTypeIssues]
+            "-rw-r--r--          1,234 2025/01/02 03:04:05 proj/a b"
+        )
+        self.assertEqual(path, "proj/a b")
+        self.assertEqual(entry.size, 1234)
+        self.assertFalse(entry.is_dir)
+        self.assertIsNone(parse_list_line("receiving incremental file list"))
+
+    def test_fetch_manifest(self):
+        fake = os.path.join(self.base_dir, "rsync")
+        with open(fake, "w") as f:
+            _ = f.write(FAKE_LIST_RSYNC)
+        os.chmod(fake, 0o755)
+
+        manifest = fetch_manifest("host:/proj", rsync=fake)
+
+        self.assertEqual(set(manifest.entries), {"proj", "proj/a file", "proj/link"})
+        self.assertTrue(manifest.entries["proj"].is_dir)
+
+    def test_cache_honours_ttl(self):
+        now = [1000.0]
+        cache = ManifestCache(self.base_dir, ttl=60, clock=lambda: now[0])
+        cache.save(self.manifest())
+
+        self.assertEqual(cache.load("host:/proj"), self.manifest())
+        now[0] += 61
+        self.assertIsNone(cache.load("host:/proj"))
+
+    def test_cache_get_fetches_on_miss_or_refresh(self):
+        cache = ManifestCache(self.base_dir, clock=lambda: 1000.0)
+        fetched: list[str] = []
+
+        def fetch(root: str):
+            fetched.append(root)
+            return self.manifest()
+
+        _ = cache.get("host:/proj", fetch)
+        _ = cache.get("host:/proj", fetch)
+        _ = cache.get("host:/proj", fetch, refresh=True)
+        self.assertEqual(len(fetched), 2)
+
+    def test_filtered_prunes_excluded_dirs(self):
+        paths = [p for p, _ in self.manifest().filtered(matcher("--exclude=build/"))]
+        self.assertEqual(paths, ["proj", "proj/newer", "proj/remote-only", "proj/same"])
+
+    def test_plan_status(self):
+        changes = plan_status(
+            self.local, self.manifest(), matcher(), matcher("--exclude=build/")
+        )
+        self.assertEqual(
+            {(c.direction, c.reason, c.path) for c in changes},
+            {
+                (Direction.PUSH, "new", "proj/local-only"),
+                (Direction.PUSH, "changed", "proj/newer"),
+                (Direction.PULL, "new", "proj/remote-only"),
+            },
+        )
+
+    def test_refresher_updates_transferred_paths(self):
+        cache = ManifestCache(self.base_dir, clock=lambda: 1000.0)
+        refresher = ManifestRefresher(cache, [self.manifest()], self.base_dir)
+        refresher(FileEvent("<f+++++++++", 3, 3, "proj/local-only"))
+        refresher.apply(0)
+
+        manifest = cache.load("host:/proj")
+        assert manifest is not None
+        self.assertEqual(manifest.entries["proj/local-only"].size, 3)
+        self.assertEqual(manifest.entries["proj/same"], ManifestEntry(1, 100))
+
+    def test_refresher_invalidates_after_failure(self):
+        cache = ManifestCache(self.base_dir, clock=lambda: 1000.0)
+        cache.save(self.manifest())
+        ManifestRefresher(cache, [self.manifest()], self.base_dir).apply(23)
+        self.assertIsNone(cache.load("host:/proj"))
+
+
+# -----
+# MOVES
+# -----
+class TestMoves(unittest.TestCase):
+    base_dir: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_detect_renames(self):
+        known = {"proj/a": "1", "proj/old/b": "2", "proj/c": "3"}
+        current = {"proj/z": "1", "proj/new/b": "2", "proj/c": "4", "proj/d": "5"}
+        self.assertEqual(
+            detect_moves(known, current),
+            [Move("proj/old/b", "proj/new/b"), Move("proj/a", "proj/z")],
+        )
+
+    def test_duplicates_move_once(self):
+        known = {"proj/a": "1", "proj/b": "1"}
+        current = {"proj/x": "1", "proj/y": "1", "proj/z": "1"}
+        self.assertEqual(
+            detect_moves(known, current),
+            [Move("proj/a", "proj/x"), Move("proj/b", "proj/y")],
+        )
+
+    def test_content_index_per_target(self):
+        path = os.path.join(self.base_dir, "index.sqlite")
+        one = ContentIndex(path, "one")
+        self.addCleanup(one.close)
+        one.replace({"proj/a": "1"})
+        one.replace({"proj/b": "2"})
+        two = ContentIndex(path, "two")
+        self.addCleanup(two.close)
+
+        self.assertEqual(one.load(), {"proj/b": "2"})
+        self.assertEqual(two.load(), {})
+
+    def test_apply_moves_on_the_remote(self):
+        ssh = os.path.join(self.base_dir, "ssh")
+        with open(ssh, "w") as f:
+            _ = f.write(FAKE_REMOTE_SSH)
+        os.chmod(ssh, 0o755)
+        remote = os.path.join(self.base_dir, "remote")
+        for name, content in [("a", "A"), ("b", "B"), ("old/c", "C")]:
+            os.makedirs(
+                os.path.dirname(os.path.join(remote, "proj", name)), exist_ok=True
+            )
+            with open(os.path.join(remote, "proj", name), "w") as f:
+                _ = f.write(content)
+
+        apply_moves(
+            [ssh, "host"],
+            remote,
+            [
+                Move("proj/a", "proj/b"),
+                Move("proj/b", "proj/a"),
+                Move("proj/old/c", "proj/new dir/c"),
+                Move("proj/missing", "proj/d"),
+            ],
+        )
+
+        def read(name: str) -> str:
+            with open(os.path.join(remote, "proj", name)) as f:
+                return f.read()
+
+        self.assertEqual((read("a"), read("b"), read("new dir/c")), ("B", "A", "C"))
+        self.assertEqual(sorted(os.listdir(remote)), ["proj"])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(remote, "proj"))), ["a", "b", "new dir"]
+        )
+
+
+# -------
+# TIMINGS
+# -------
+class TestTimings(unittest.TestCase):
+    def test_phases_in_order(self):
+        timings = Timings()
+        timings.record("imports", 0.5)
+        with timings.phase("findup"):
+            pass
+        self.assertEqual([name for name, _ in timings.phases], ["imports", "findup"])
+        report = timings.report().splitlines()
+        self.assertTrue(report[0].startswith("imports"))
+        self.assertIn("500.00 ms", report[0])
+        self.assertTrue(report[-1].startswith("total"))
+
+    def test_repeated_phases_add_up(self):
+        timings = Timings()
+        timings.record("to_local", 0.25)
+        timings.record("to_local", 0.5)
+        self.assertEqual(timings.phases, [("to_local", 0.75)])
+        self.assertIn("to_local (x2)", timings.report())
+
+
+# ----
+# TUNE
+# ----
+# Stand-in for ssh over a link with the latency and rate from the environment
+FAKE_LINK_SSH = f"""#!{sys.executable}
+import os, subprocess, sys, time
+time.sleep(float(os.environ.get("FAKE_LINK_RTT", "0")))
+rate = float(os.environ.get("FAKE_LINK_RATE", "0"))
+proc = subprocess.Popen(["sh", "-c", sys.argv[-1]], stdin=subprocess.PIPE)
+while block := sys.stdin.buffer.read(65536):
+    if rate:
+        time.sleep(len(block) / rate)
+    proc.stdin.write(block)
+proc.stdin.close()
+sys.exit(proc.wait())
+"""
+
+TEXT = FileMix(files=10, size=10 * 1024**2, compressed=0)
+
+
+class TestTune(unittest.TestCase):
+    base_dir: str = ""
+    ssh: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.ssh = os.path.join(self.base_dir, "ssh")
+        with open(self.ssh, "w") as f:
+            _ = f.write(FAKE_LINK_SSH)
+        os.chmod(self.ssh, 0o755)
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_probe_tells_a_slow_link_from_a_fast_one(self):
+        env = {"FAKE_LINK_RTT": "0.05", "FAKE_LINK_RATE": str(1024**2)}
+        with patch.dict(os.environ, env):
+            slow = probe([self.ssh, "host"], probe_bytes=512 * 1024, pings=2)
+        fast = probe([self.ssh, "host"], probe_bytes=512 * 1024, pings=2)
+
+        self.assertGreaterEqual(slow.rtt, 0.05)
+        self.assertLess(slow.throughput, 2 * 1024**2)
+        self.assertGreater(fast.throughput, slow.throughput)
+        self.assertEqual(
+            choose(slow, TEXT),
+            Profile(whole_file=False, compress=True, compress_level=6),
+        )
+
+    def test_failing_probe_raises(self):
+        with self.assertRaisesRegex(RuntimeError, "Probing the link failed"):
+            _ = probe(["sh", "-c", "exit 255", "host"], pings=1)
+
+    def test_lan_sends_whole_files_uncompressed(self):
+        profile = choose(Link(0.0005, 100 * 1024**2, 0), TEXT)
+        self.assertEqual(profile.rsync_args, ["--whole-file", "--no-compress"])
+
+    def test_compressed_files_are_not_compressed_again(self):
+        wan = Link(0.04, 10 * 1024**2, 0)
+        self.assertFalse(choose(wan, FileMix(2, 100, 80)).compress)
+        profile = choose(wan, TEXT)
+        self.assertEqual(profile.compress_level, 1)
+        skip = next(a for a in profile.rsync_args if a.startswith("--skip-compress="))
+        self.assertIn("zip", skip.split("=")[1].split("/"))
+
+    def test_large_files_get_large_blocks(self):
+        mix = FileMix(files=2, size=2 * 1024**3, compressed=2 * 1024**3)
+        profile = choose(Link(0.04, 10 * 1024**2, 0), mix)
+        self.assertIn("--block-size=131072", profile.rsync_args)
+
+    def test_sample_mix_is_capped(self):
+        files = (("a.txt" if i % 2 else "b.gz", 10) for i in range(100))
+        self.assertEqual(sample_mix(files, limit=10), FileMix(10, 100, 50))
+
+    def test_link_is_measured_once_per_host(self):
+        now = [1000.0]
+        cache = LinkCache(self.base_dir, ttl=60, clock=lambda: now[0])
+        measured: list[str] = []
+
+        def measure() -> Link:
+            measured.append("x")
+            return Link(0.01, 1024.0, now[0])
+
+        first = cache.get("user@host", measure)
+        self.assertEqual(cache.get("user@host", measure), first)
+        self.assertEqual(len(measured), 1)
+        _ = cache.get("user@other", measure)
+        now[0] += 61
+        _ = cache.get("user@host", measure)
+        self.assertEqual(len(measured), 3)
+
+    def test_filter_group_settings_win(self):
+        groups = [
+            FilterGroup(Direction.PUSH, Kind.INCLUDE, ["a"], whole_file=False),
+            FilterGroup(Direction.PULL, Kind.INCLUDE, ["a"], compress=True),
+            FilterGroup(Direction.PUSH, Kind.INCLUDE, ["b"], block_size="64K"),  # pyright:ignore[reportArgumentType]
+        ]
+        lan = Profile(whole_file=True, compress=False)
+        self.assertEqual(
+            transfer_args(Direction.PUSH, groups, lan),
+            ["--no-whole-file", "--no-compress", "--block-size=65536"],
+        )
+        # like filter rules, the first group to set something wins
+        later = FilterGroup(Direction.PUSH, Kind.INCLUDE, ["c"], whole_file=True)
+        self.assertIn(
+            "--no-whole-file", transfer_args(Direction.PUSH, [*groups, later], lan)
+        )
+        self.assertEqual(transfer_args(Direction.PUSH, []), [])
+
+    def test_rsync_command_carries_the_profile(self):
+        rsync_cmd = rsynccommand()
+        rsync_cmd.tuned = Profile(whole_file=True, compress=False)
+        rsync_cmd.build()
+        self.assertIn("--whole-file", rsync_cmd.args)
+
+
+# ------
+# VERIFY
+# ------
+# Stand-in for ssh that runs the remote command locally
+FAKE_REMOTE_SSH = """#!/bin/sh
+for last; do :; done
+exec sh -c "$last"
+"""
+
+
+class TestVerify(unittest.TestCase):
+    base_dir: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        for side, b in [("local", "x"), ("remote", "y")]:
+            os.makedirs(os.path.join(self.base_dir, side, "proj"))
+            for name, content in [("a", "same"), ("b", b)]:
+                with open(os.path.join(self.base_dir, side, "proj", name), "w") as f:
+                    _ = f.write(content)
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def cache(self) -> HashCache:
+        cache = HashCache(os.path.join(self.base_dir, "hashes.sqlite"))
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_hash_file_matches_b2sum(self):
+        path = os.path.join(self.base_dir, "local", "proj", "a")
+        self.assertEqual(hash_file(path), hashlib.blake2b(b"same").hexdigest())
+        self.assertIsNone(hash_file(os.path.join(self.base_dir, "missing")))
+
+    def test_cache_is_keyed_by_inode_size_and_mtime(self):
+        cache = self.cache()
+        path = os.path.join(self.base_dir, "local", "proj", "a")
+        cache.put([(os.stat(path), "digest")])
+        self.assertEqual(cache.get(os.stat(path)), "digest")
+        os.utime(path, (1, 1))
+        self.assertIsNone(cache.get(os.stat(path)))
+
+    def test_local_hashes_use_the_cache(self):
+        cache = self.cache()
+        parent = os.path.join(self.base_dir, "local")
+        first = local_hashes(parent, ["proj/a", "proj/b", "proj/missing"], cache)
+        self.assertEqual(set(first), {"proj/a", "proj/b"})
+        with patch("concurrent.futures.ProcessPoolExecutor") as pool:
+            again = local_hashes(parent, ["proj/a", "proj/b"], cache)
+        pool.assert_not_called()
+        self.assertEqual(again, first)
+
+    def test_parse_hash_output(self):
+        output = b"abc  proj/a b\0def  proj/\nc\0"
+        self.assertEqual(
+            parse_hash_output(output), {"proj/a b": "abc", "proj/\nc": "def"}
+        )
+
+    def test_remote_hashes_in_one_command(self):
+        ssh = os.path.join(self.base_dir, "ssh")
+        with open(ssh, "w") as f:
+            _ = f.write(FAKE_REMOTE_SSH)
+        os.chmod(ssh, 0o755)
+        parent = os.path.join(self.base_dir, "remote")
+
+        remote = remote_hashes([ssh, "host"], parent, ["proj/a", "proj/b", "proj/c"])
+        local = local_hashes(
+            os.path.join(self.base_dir, "local"), ["proj/a", "proj/b"], self.cache()
+        )
+
+        self.assertEqual(set(remote), {"proj/a", "proj/b"})
+        verification = compare(["proj/a", "proj/b", "proj/c"], local, remote)
+        self.assertEqual(verification.checked, 3)
+        self.assertEqual(verification.differ, ["proj/b", "proj/c"])
+
+    def test_verify_and_moves_keep_each_group(self):
+        # two groups, only the second one differs: the commands verify keeps
+        # must stay paired with their own group for everything after it
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        proxy_root = os.path.join(base_dir, "proxy")
+        remote_root = os.path.join(base_dir, "remote")
+        files = {
+            "one/a/same": ("same", "same"),
+            "two/b/new": ("moved", None),
+            "two/b/old": (None, "moved"),
+            "two/b/changed": ("x", "y"),
+        }
+        for path, contents in files.items():
+            for root, content in zip((proxy_root, remote_root), contents):
+                if content is not None:
+                    os.makedirs(
+                        os.path.dirname(os.path.join(root, path)), exist_ok=True
+                    )
+                    with open(os.path.join(root, path), "w") as f:
+                        _ = f.write(content)
+        config = os.path.join(proxy_root, "osync.yaml")
+        with open(config, "w") as f:
+            _ = f.write('- {direction: push, kind: include, patterns: ["*"]}\n')
+
+        bin_dir = os.path.join(base_dir, "bin")
+        os.makedirs(bin_dir)
+        for name, script in [("ssh", ROOTED_SSH), ("rsync", LOGGING_RSYNC)]:
+            with open(os.path.join(bin_dir, name), "w") as f:
+                _ = f.write(script)
+            os.chmod(os.path.join(bin_dir, name), 0o755)
+        log = os.path.join(base_dir, "rsync.log")
+        env = {
+            "PATH": bin_dir + os.pathsep + os.environ["PATH"],
+            "OSYNC_PROXY_ROOT": proxy_root,
+            "OSYNC_REMOTE_USER_HOST": "host",
+            "XDG_CACHE_HOME": base_dir,
+            "XDG_RUNTIME_DIR": base_dir,
+            "FAKE_REMOTE_ROOT": remote_root,
+            "FAKE_RSYNC_LOG": log,
+        }
+        key = f"push {proxy_root}/two/b -> host:/two/."
+        with patch.dict(os.environ, env):
+            index = ContentIndex(index_path(config), key)
+            index.replace({"b/old": hashlib.blake2b(b"moved").hexdigest()})
+            index.close()
+
+        cwd = os.getcwd()
+        os.chdir(proxy_root)
+        self.addCleanup(os.chdir, cwd)
+        argv = ["osync", "--push", "--verify", "--detect-moves", "--no-daemon"]
+        with (
+            patch.dict(os.environ, env),
+            patch.object(sys, "argv", [*argv, "one/a", "two/b"]),
+            patch("osync.metrics._hooks", []),
+            patch("sys.stdout", new_callable=io.StringIO) as stdout,
+        ):
+            with self.assertRaises(SystemExit) as raised:
+                app.main()
+
+        self.assertEqual(raised.exception.code, 0)
+        self.assertIn("moved  b/old -> b/new", stdout.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(remote_root, "two/b/new")))
+        self.assertFalse(os.path.exists(os.path.join(remote_root, "two/b/old")))
+        with open(log) as f:
+            transferred = f.read()
+        self.assertIn(f"{proxy_root}/two\nhost:/two/.\nb/new\nb/changed\n", transferred)
+        self.assertNotIn(f"{proxy_root}/one", transferred)
+        with patch.dict(os.environ, env):
+            index = ContentIndex(index_path(config), key)
+            self.addCleanup(index.close)
+            self.assertEqual(set(index.load()), {"b/new", "b/changed"})
+
+
+# stands in for the remote host, with its root moved under FAKE_REMOTE_ROOT
+ROOTED_SSH = f"""#!{sys.executable}
+import os, re, sys
+command = re.sub(r"^cd ", "cd " + os.environ["FAKE_REMOTE_ROOT"], sys.argv[-1])
+os.execvp("sh", ["sh", "-c", command])
+"""
+
+LOGGING_RSYNC = """#!/bin/sh
+printf '%s\\n' "$@" >>"$FAKE_RSYNC_LOG"
+tr '\\0' '\\n' >>"$FAKE_RSYNC_LOG"
+"""
+
+
+# -----
+# WATCH
+# -----
+class FakeClock:
+    now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestDebouncer(unittest.TestCase):
+    def test_nothing_pending(self):
+        debouncer = Debouncer(1.0, 5.0, FakeClock())
+        self.assertIsNone(debouncer.timeout())
+
+    def test_burst_is_grouped_until_quiet(self):
+        clock = FakeClock()
+        debouncer = Debouncer(1.0, 5.0, clock)
+        debouncer.add({"a"})
+        clock.now = 0.5
+        debouncer.add({"b"})
+        self.assertEqual(debouncer.timeout(), 1.0)
+        clock.now = 1.5
+        self.assertEqual(debouncer.timeout(), 0.0)
+        self.assertEqual(debouncer.drain(), ["a", "b"])
+        self.assertIsNone(debouncer.timeout())
+
+    def test_max_delay_caps_a_continuous_burst(self):
+        clock = FakeClock()
+        debouncer = Debouncer(1.0, 2.0, clock)
+        for tick in range(4):
+            clock.now = tick * 0.6
+            debouncer.add({str(tick)})
+        self.assertAlmostEqual(debouncer.timeout() or 0.0, 0.2)
+
+
+class TestWatcher(unittest.TestCase):
+    def test_batches_included_changes(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        source = os.path.join(base_dir, "proj")
+        os.mkdir(source)
+        watcher = Watcher(source, matcher("--exclude=*.tmp"), debounce=0.05)
+        self.addCleanup(watcher.close)
+
+        write_file(os.path.join(source, "a.txt"), 1)
+        write_file(os.path.join(source, "b.tmp"), 1)
+        write_file(os.path.join(source, "sub", "c.txt"), 1)
+
+        batch = None
+        for _ in range(50):
+            batch = watcher.poll(0.1)
+            if batch is not None:
+                break
+
+        self.assertEqual(batch, ["proj/a.txt", "proj/sub", "proj/sub/c.txt"])
+
+    def test_empty_dirs_are_watched_when_pruning(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        source = os.path.join(base_dir, "proj")
+        write_file(os.path.join(source, "src", "a.py"), 1)
+        os.mkdir(os.path.join(source, "pkg"))
+        args = compile_filters(["--include=*.py"]).args
+        self.assertIn("--prune-empty-dirs", args)
+        watcher = Watcher(source, matcher(*args), debounce=0.05)
+        self.addCleanup(watcher.close)
+
+        write_file(os.path.join(source, "pkg", "new.py"), 1)
+
+        batch = None
+        for _ in range(50):
+            batch = watcher.poll(0.1)
+            if batch is not None:
+                break
+
+        self.assertEqual(batch, ["proj/pkg/new.py"])
+
+
 # -------------
 # RSYNC_COMMAND
 # -------------
@@ -292,6 +2678,10 @@ def rsynccommand():
 class DummmyFilterGroup:
     direction: Direction
     rsync_args: list[str]
+    priority: int | None = None
+    compress: bool | None = None
+    whole_file: bool | None = None
+    block_size: int | None = None
 
 
 class TestRsyncCommand(unittest.TestCase):
@@ -391,3 +2781,305 @@ class TestRsyncCommand(unittest.TestCase):
         rsync_cmd.build()
 
         self.assertEqual(rsync_cmd.args[-2:], ["/src/", "/dst/"])
+
+    def test_shards_exclude_each_others_entries(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        for name in ["a", "b"]:
+            write_file(os.path.join(base_dir, name, "file"), 10)
+
+        rsync_cmd = rsynccommand()
+        rsync_cmd.source = base_dir
+        rsync_cmd.filter_groups = [
+            DummmyFilterGroup(Direction.PUSH, ["--include=file"])
+        ]
+        rsync_cmd.jobs = 2
+        rsync_cmd.build()
+        workers = rsync_cmd.shards()
+
+        root = "/" + os.path.basename(base_dir)
+        self.assertEqual(len(workers), 2)
+        excludes = sorted(
+            arg
+            for w in workers
+            for arg in w.args
+            if arg.startswith(f"--exclude={root}")
+        )
+        self.assertEqual(excludes, [f"--exclude={root}/a", f"--exclude={root}/b"])
+        for worker in workers:
+            self.assertIn("--exclude=*", worker.args)
+            self.assertEqual(worker.args[-2:], [base_dir, "/dst/"])
+
+    def test_single_job_does_not_shard(self):
+        rsync_cmd = rsynccommand()
+        rsync_cmd.build()
+        self.assertEqual(rsync_cmd.shards(), [rsync_cmd])
+
+    def test_remote_source_does_not_shard(self):
+        rsync_cmd = rsynccommand()
+        rsync_cmd.source = "user@host:/src"
+        rsync_cmd.jobs = 4
+        rsync_cmd.build()
+        self.assertEqual(rsync_cmd.shards(), [rsync_cmd])
+
+    def test_files_from_replaces_filters(self):
+        rsync_cmd = rsynccommand()
+        rsync_cmd.source = "/x/dir"
+        rsync_cmd.files_from = ["dir/a", "dir/b"]
+        rsync_cmd.build()
+
+        self.assertNotIn("--exclude=*", rsync_cmd.args)
+        self.assertIn("--files-from=-", rsync_cmd.args)
+        self.assertEqual(rsync_cmd.args[-2:], ["/x", "/dst/"])
+        self.assertEqual(rsync_cmd.stdin(), b"dir/a\0dir/b\0")
+
+    def test_sharded_files_from_partitions_list(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        for name in ["a", "b"]:
+            write_file(os.path.join(base_dir, name, "file"), 10)
+
+        rsync_cmd = rsynccommand()
+        rsync_cmd.source = base_dir
+        rsync_cmd.filter_groups = [
+            DummmyFilterGroup(Direction.PUSH, ["--include=file"])
+        ]
+        rsync_cmd.jobs = 2
+        root = os.path.basename(base_dir)
+        rsync_cmd.files_from = [f"{root}/a/file", f"{root}/b/file"]
+        rsync_cmd.build()
+        workers = rsync_cmd.shards()
+
+        self.assertEqual(
+            sorted(w.files_from or [] for w in workers),
+            [[f"{root}/a/file"], [f"{root}/b/file"]],
+        )
+
+    def test_extra_sources_come_before_dest(self):
+        rsync_cmd = rsynccommand()
+        rsync_cmd.extra_sources = ["/src2/"]
+        rsync_cmd.build()
+
+        self.assertEqual(rsync_cmd.args[-3:], ["/src/", "/src2/", "/dst/"])
+
+
+# Stand-in for rsync that replays a canned transfer and echoes its stdin
+FAKE_RSYNC = """#!/bin/sh
+printf 'sending incremental file list\\n'
+printf 'osync|>f+++++++++|3|3|dir/a\\n'
+printf '          3 100%%    1.00kB/s    0:00:00 (xfr#1, to-chk=0/2)\\r'
+printf 'Number of regular files transferred: 1\\n'
+cat >/dev/null
+exit 23
+"""
+
+
+class TestRsyncCommand_Run(unittest.TestCase):
+    def test_run_streams_events(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        fake = os.path.join(base_dir, "rsync")
+        with open(fake, "w") as f:
+            _ = f.write(FAKE_RSYNC)
+        os.chmod(fake, 0o755)
+
+        events: list[object] = []
+        rsync_cmd = rsynccommand()
+        rsync_cmd.base_args = [fake]
+        rsync_cmd.files_from = ["dir/a"]
+        rsync_cmd.listeners = [events.append]
+        rsync_cmd.build()
+        with patch("sys.stdout", io.StringIO()):
+            result = rsync_cmd.run()
+
+        self.assertEqual(result.returncode, 23)
+        self.assertEqual(result.stats, {"number_of_regular_files_transferred": 1})
+        self.assertEqual(
+            [type(e) for e in events],
+            [LogEvent, FileEvent, ProgressEvent, StatsEvent],
+        )
+
+    def test_command_line_goes_to_out(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        fake = os.path.join(base_dir, "rsync")
+        with open(fake, "w") as f:
+            _ = f.write(FAKE_RSYNC)
+        os.chmod(fake, 0o755)
+
+        out = io.StringIO()
+        rsync_cmd = rsynccommand()
+        rsync_cmd.base_args = [fake]
+        rsync_cmd.files_from = ["dir/a"]
+        rsync_cmd.out = out
+        rsync_cmd.build()
+        with patch("sys.stdout", io.StringIO()) as stdout:
+            _ = rsync_cmd.run()
+
+        self.assertEqual(out.getvalue(), " ".join(rsync_cmd.args) + "\n")
+        self.assertEqual(stdout.getvalue(), "")
+
+    def test_run_with_bandwidth_budget(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        fake = os.path.join(base_dir, "rsync")
+        with open(fake, "w") as f:
+            _ = f.write(FAKE_RSYNC)
+        os.chmod(fake, 0o755)
+        ledger = os.path.join(base_dir, "ledger")
+        os.mkdir(ledger)
+
+        rsync_cmd = rsynccommand()
+        rsync_cmd.base_args = [fake]
+        rsync_cmd.files_from = ["dir/a"]
+        rsync_cmd.bandwidth = Bandwidth(500, directory=ledger)
+        rsync_cmd.build()
+        metrics = Metrics()
+        add_hook(metrics)
+        self.addCleanup(remove_hook, metrics)
+        with patch("sys.stdout", io.StringIO()):
+            result = rsync_cmd.run()
+
+        self.assertIn("--bwlimit=500", rsync_cmd.args)
+        self.assertIn("rsync.transfer", metrics.phases)
+        self.assertEqual(result.returncode, 23)
+        self.assertEqual(os.listdir(ledger), [])
+
+
+class TestRsyncResult(unittest.TestCase):
+    def test_parse_stats(self):
+        output = "\n".join(
+            [
+                "sending incremental file list",
+                "Number of files: 1,234 (reg: 1,000, dir: 234)",
+                "Number of regular files transferred: 5",
+                "File list generation time: 0.002 seconds",
+                "sent 1,234 bytes  received 56 bytes",
+            ]
+        )
+        stats = parse_stats(output)
+        self.assertEqual(
+            stats,
+            {
+                "number_of_files": 1234,
+                "number_of_regular_files_transferred": 5,
+                "file_list_generation_time": 0.002,
+            },
+        )
+
+    def test_combine(self):
+        combined = RsyncResult.combine(
+            [
+                RsyncResult(0, {"number_of_regular_files_transferred": 2}),
+                RsyncResult(23, {"number_of_regular_files_transferred": 3}),
+                RsyncResult(0, {}),
+            ]
+        )
+        self.assertEqual(combined.returncode, 23)
+        self.assertEqual(combined.stats, {"number_of_regular_files_transferred": 5})
+
+
+# ---
+# AIO
+# ---
+SLOW_RSYNC = """#!/bin/sh
+exec sleep 30
+"""
+
+
+class TestAio(unittest.TestCase):
+    base_dir: str = ""
+
+    @override
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        for name, script in (("rsync", FAKE_RSYNC), ("slow-rsync", SLOW_RSYNC)):
+            path = os.path.join(self.base_dir, name)
+            with open(path, "w") as f:
+                _ = f.write(script)
+            os.chmod(path, 0o755)
+
+    @override
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_run_streams_events(self):
+        events: list[object] = []
+        rsync_cmd = rsynccommand()
+        rsync_cmd.base_args = [os.path.join(self.base_dir, "rsync")]
+        rsync_cmd.files_from = ["dir/a"]
+        rsync_cmd.listeners = [events.append]
+
+        result, _ = asyncio.run(aio.run(rsync_cmd))
+
+        self.assertEqual(result.returncode, 23)
+        self.assertEqual(result.stats, {"number_of_regular_files_transferred": 1})
+        self.assertEqual(
+            [type(e) for e in events],
+            [LogEvent, FileEvent, ProgressEvent, StatsEvent],
+        )
+
+    def test_timeout_stops_rsync(self):
+        rsync_cmd = rsynccommand()
+        rsync_cmd.base_args = [os.path.join(self.base_dir, "slow-rsync")]
+
+        async def timed_out():
+            async with asyncio.timeout(0.2):
+                _ = await aio.run(rsync_cmd)
+
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            asyncio.run(timed_out())
+        self.assertLess(time.monotonic() - start, aio.TERMINATE_GRACE)
+
+    def test_sync(self):
+        proxy_root = os.path.join(self.base_dir, "root")
+        write_file(os.path.join(proxy_root, "proj", "a"), 3)
+        events: list[object] = []
+
+        with patch.dict(
+            os.environ, {"PATH": self.base_dir + os.pathsep + os.environ["PATH"]}
+        ):
+            result = asyncio.run(
+                osync.sync(
+                    os.path.join(proxy_root, "proj"),
+                    direction="push",
+                    filters=[],
+                    resolver=PathResolver(proxy_root, "user@host"),
+                    listeners=[events.append],
+                    ssh=False,
+                    timeout=10,
+                )
+            )
+
+        self.assertFalse(result.ok)
+        self.assertEqual(result.returncode, 23)
+        self.assertEqual([f.path for f in result.files], ["dir/a"])
+        self.assertEqual(
+            result.commands[0][-2:], [f"{proxy_root}/proj", "user@host:/."]
+        )
+        self.assertEqual(len(events), 4)
+
+    def test_failed_sync_checks_the_master_again(self):
+        proxy_root = os.path.join(self.base_dir, "root")
+        write_file(os.path.join(proxy_root, "proj", "a"), 3)
+
+        def sync():
+            return osync.sync(
+                os.path.join(proxy_root, "proj"),
+                filters=[],
+                resolver=PathResolver(proxy_root, "user@host"),
+                timeout=10,
+            )
+
+        with (
+            patch.dict(
+                os.environ, {"PATH": self.base_dir + os.pathsep + os.environ["PATH"]}
+            ),
+            patch.object(SshMaster, "prepare") as prepare,
+            patch.object(os.path, "exists", return_value=True),
+        ):
+            self.assertFalse(asyncio.run(sync()).ok)
+            self.assertFalse(asyncio.run(sync()).ok)
+        self.assertEqual(prepare.call_count, 2)
+        self.assertNotIn("user@host", aio._prepared)  # pyright:ignore[reportPrivateUsage]